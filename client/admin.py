@@ -2,7 +2,7 @@
 
 from django.contrib import admin, messages
 
-from .models import Origin, WebServer, Schedule
+from .models import Origin, WebServer, Schedule, OpLog, OpLogRollup
 from .forms import OriginAddForm, OriginEditForm, ScheduleForm, NEW_USER, EXISTING_USER
 
 class OriginAdmin(admin.ModelAdmin):
@@ -56,7 +56,13 @@ class WebServerAdmin(admin.ModelAdmin):
     #readonly_fields = ('apikey',)
     list_display = ( 'name',
     #                 'apikey',
-                     'url'
+                     'url',
+                     'current_latency',
+                     'avg_latency',
+                     'avg_throughput',
+                     'transfers',
+                     'failed_transfers',
+                     'last_failure',
                    )
     def has_add_permission(self, request):
         return not WebServer.objects.filter(pk=1).exists()
@@ -67,7 +73,47 @@ class WebServerAdmin(admin.ModelAdmin):
     def has_change_permission(self, request, obj=None):
         return WebServer.objects.filter(pk=1).exists()
     
+class OpLogAdmin(admin.ModelAdmin):
+    list_display = ('started_at',
+                    'operation',
+                    'phase',
+                    'backup',
+                    'outcome',
+                    'error_class',
+                    'wall_time',
+                    'cpu_time',
+                    'bytes_in',
+                    'bytes_out',
+                    'peak_memory',
+                   )
+    list_filter = ('operation', 'phase', 'outcome')
+    list_select_related = ('backup',)
+    date_hierarchy = 'started_at'
+    
+    #the log is only appended to, by backups and restores
+    def has_add_permission(self, request):
+        return False
+    
+class OpLogRollupAdmin(admin.ModelAdmin):
+    list_display = ('day',
+                    'operation',
+                    'phase',
+                    'outcome',
+                    'error_class',
+                    'count',
+                    'wall_time',
+                    'bytes_out',
+                    'peak_memory',
+                   )
+    list_filter = ('operation', 'phase', 'outcome')
+    date_hierarchy = 'day'
+    
+    def has_add_permission(self, request):
+        return False
+
 admin.site.register(Origin, OriginAdmin)
 admin.site.register(Schedule, ScheduleAdmin)
 admin.site.register(WebServer, WebServerAdmin)
+admin.site.register(OpLog, OpLogAdmin)
+admin.site.register(OpLogRollup, OpLogRollupAdmin)
 
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import time
+
+from datetime import timedelta
+
+from celery import beat, schedules
+from django.db import close_old_connections
+from django.utils import timezone
+
+from client.models import Schedule
+from client.scheduler import get_watermark
+
+#longest time, in seconds, beat waits before checking an entry again
+MAX_CHECK_INTERVAL = 300
+
+
+class rrule_schedule(schedules.schedule):
+    """
+    Celery schedule following the recurrence rule of a Schedule
+    """
+    def __init__(self, db_schedule, nowfun=timezone.now, app=None):
+        self.db_schedule = db_schedule
+        super(rrule_schedule, self).__init__(timedelta(minutes=1), nowfun=nowfun, app=app)
+
+    def is_due(self, last_run_at):
+        now = self.now()
+        next_run = self.db_schedule.next_runtime_after(self.maybe_make_aware(last_run_at))
+        if next_run is None:
+            return schedules.schedstate(False, MAX_CHECK_INTERVAL)
+        if next_run <= now:
+            next_run = self.db_schedule.next_runtime_after(now)
+            is_due = True
+        else:
+            is_due = False
+        if next_run is None:
+            return schedules.schedstate(is_due, MAX_CHECK_INTERVAL)
+        seconds = (next_run - now).total_seconds()
+        return schedules.schedstate(is_due, min(max(seconds, 0), MAX_CHECK_INTERVAL))
+
+    def __repr__(self):
+        return '<rrule: %s>' % self.db_schedule
+
+
+class ScheduleBeat(beat.Scheduler):
+    """
+    Beat scheduler with one entry per active Schedule, each sending a dump
+    task when its schedule is due. Entries are rebuilt when schedules change.
+    """
+    #seconds between checks for changed schedules
+    sync_every = 60
+
+    def setup_schedule(self):
+        self.watermark = None
+        self.last_check = time.time()
+        self.merge_inplace(self.app.conf.CELERYBEAT_SCHEDULE)
+        self.install_default_entries(self.data)
+        self.update_from_schedules()
+
+    def update_from_schedules(self):
+        close_old_connections()
+        self.last_check = time.time()
+        watermark = get_watermark()
+        if watermark == self.watermark:
+            return
+        self.watermark = watermark
+
+        now = timezone.now()
+        entries = dict((name, entry) for name, entry in self.data.items()
+                                     if not name.startswith('schedule-'))
+        for schedule in Schedule.objects.filter(active=True).select_related('rule'):
+            name = 'schedule-%d' % schedule.pk
+            old = self.data.get(name)
+            if old is not None and old.schedule.db_schedule.version == schedule.version:
+                last_run_at = old.last_run_at
+            elif schedule.next_run_at is not None and schedule.next_run_at <= now:
+                #due or missed, so it runs right away
+                last_run_at = schedule.next_run_at - timedelta(minutes=1)
+            else:
+                last_run_at = now
+            entries[name] = self.Entry(name=name,
+                                       task='client.tasks.dump',
+                                       args=(schedule.pk,),
+                                       schedule=rrule_schedule(schedule, app=self.app),
+                                       last_run_at=last_run_at,
+                                       app=self.app)
+        self.data = entries
+
+    def get_schedule(self):
+        if time.time() - self.last_check >= self.sync_every:
+            self.update_from_schedules()
+        return self.data
+
+    def set_schedule(self, schedule):
+        self.data = schedule
+    schedule = property(get_schedule, set_schedule)
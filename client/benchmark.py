@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import math
+import os
+import platform
+
+import django
+
+from django.db import connection
+from django.utils import timezone
+
+from client.conf.settings import API_MAX_CONCURRENCY, DUMP_MEMORY_LIMIT, ENCRYPTION_CHUNK_SIZE
+from client.handlers import DataHandler
+from client.instrumentation import Phase, peak_memory, percentile
+from client.models import Backup, OpLog, Origin, RRule, Schedule, WebServer
+from client.standin import StandInServer
+
+#name of the synthetic rows, so they can be told apart
+PREFIX = 'bench'
+
+
+def generate(rows, width, fanout):
+    """
+    Fills the database with rows synthetic backups of about width bytes,
+    fanout of them per schedule and fanout schedules per rule
+    """
+    schedules = int(math.ceil(float(rows) / fanout))
+    rules = int(math.ceil(float(schedules) / fanout))
+    now = timezone.now()
+
+    RRule.objects.bulk_create([RRule(name=u'%s rule %d' % (PREFIX, i),
+                                     description=u'x' * width,
+                                     frequency=RRule.DAILY)
+                               for i in xrange(rules)])
+    rule_ids = list(RRule.objects.filter(name__startswith=PREFIX).values_list('pk', flat=True))
+    Schedule.objects.bulk_create([Schedule(initial_time=now,
+                                           destination=u'%s-%d' % (PREFIX, i),
+                                           rule_id=rule_ids[i // fanout],
+                                           active=False)
+                                  for i in xrange(schedules)])
+    schedule_ids = list(Schedule.objects.filter(destination__startswith=PREFIX)
+                                        .values_list('pk', flat=True))
+    for start in xrange(0, rows, 1000):
+        Backup.objects.bulk_create([Backup(name=u'%s backup %d' % (PREFIX, i),
+                                           schedule_id=schedule_ids[i // fanout],
+                                           destination=u'%s-%d' % (PREFIX, i // fanout),
+                                           last_error=u'x' * width)
+                                    for i in xrange(start, min(start + 1000, rows))])
+    return {'rules': rules, 'schedules': schedules, 'backups': rows}
+
+
+def summarize(samples):
+    """
+    Returns the samples of an operation with the percentiles of their latency,
+    throughput and the most any of them raised the peak memory
+    """
+    latency = sorted(s['wall_time'] for s in samples)
+    throughput = sorted(s['throughput'] for s in samples)
+    return {
+        'samples': samples,
+        'latency_p50': percentile(latency, 50),
+        'latency_p90': percentile(latency, 90),
+        'throughput_p50': percentile(throughput, 50),
+        'peak_memory_growth': max(s['peak_memory_growth'] for s in samples),
+    }
+
+
+def measure(operation):
+    """
+    Runs operation, which returns how many bytes it handled, as a Phase
+    """
+    with Phase(operation.__name__) as phase:
+        phase.bytes_out = operation()
+    return {
+        'wall_time': phase.wall_time,
+        'cpu_time': phase.cpu_time,
+        'bytes': phase.bytes_out,
+        'throughput': phase.bytes_out / phase.wall_time if phase.wall_time > 0 else None,
+        'peak_memory_growth': phase.peak_memory,
+    }
+
+
+def run(rows=10000, width=200, fanout=10, repeat=3, delay=0, bandwidth=None):
+    """
+    Fills the current database with synthetic data and measures dumps,
+    backups and restores against a stand-in WebServer answering after
+    delay seconds, at most at bandwidth bytes per second.
+    Meant for a scratch database: restores flush it.
+    Returns the results, ready to be written as JSON
+    """
+    server = StandInServer(tokens=['bench'], delay=delay, bandwidth=bandwidth).start()
+    try:
+        Origin.objects.create(name=u'%s origin' % PREFIX, auth_token='bench', remote_id=1)
+        WebServer.objects.create(name=u'%s server' % PREFIX, url=server.url)
+        data = generate(rows, width, fanout)
+
+        #the same operations, with archives encrypted by a throwaway key
+        key = os.urandom(32).encode('hex')
+
+        def handler(key=None):
+            return DataHandler(origin=Origin.instance(), webserver=WebServer.objects.get(url=server.url),
+                               key=key)
+
+        def dump():
+            h = handler()
+            h.get_dumped_data()
+            return h.raw_size
+
+        def backup(key=None):
+            h = handler(key)
+            h.cache_dumpdata()
+            h.backup(destination=PREFIX)
+            #the bytes dumped, as in dump and restore, not the compressed
+            #(and maybe encrypted) archive, so all runs measure the same bytes
+            return h.raw_size
+
+        def restore(key=None):
+            h = handler(key)
+            h.restore(max(b['id'] for b in server.get_backups()))
+            return OpLog.objects.filter(phase=OpLog.DOWNLOAD).latest('started_at').bytes_out
+
+        def encrypted_backup():
+            return backup(key)
+
+        def encrypted_restore():
+            return restore(key)
+
+        results = {}
+        for operation in (dump, backup, restore, encrypted_backup, encrypted_restore):
+            samples = [measure(operation) for _ in xrange(repeat)]
+            results[operation.__name__] = summarize(samples)
+        #share of the throughput encryption costs
+        for name in ('backup', 'restore'):
+            plain = results[name]['throughput_p50']
+            encrypted = results['encrypted_%s' % name]['throughput_p50']
+            results['encrypted_%s' % name]['throughput_cost'] = \
+                1 - float(encrypted) / plain if plain and encrypted else None
+    finally:
+        server.stop()
+
+    return {
+        'created_at': timezone.now().isoformat(),
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'platform': platform.platform(),
+            'database': connection.vendor,
+        },
+        'settings': {
+            'API_MAX_CONCURRENCY': API_MAX_CONCURRENCY,
+            'DUMP_MEMORY_LIMIT': DUMP_MEMORY_LIMIT,
+            'ENCRYPTION_CHUNK_SIZE': ENCRYPTION_CHUNK_SIZE,
+        },
+        'parameters': {
+            'rows': rows,
+            'width': width,
+            'fanout': fanout,
+            'repeat': repeat,
+            'delay': delay,
+            'bandwidth': bandwidth,
+        },
+        'data': data,
+        'results': results,
+        #of the whole run, as ru_maxrss never goes down
+        'peak_memory': peak_memory(),
+    }
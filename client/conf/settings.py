@@ -9,4 +9,48 @@ TBACKUP_DATETIME_FORMAT = getattr(settings, 'TBACKUP_DATETIME_FORMAT', '%Y%m%d%H
 WEBSERVER_NAME = getattr(settings, 'WEBSERVER_NAME','WebServer')
 WEBSERVER_URL = getattr(settings, 'WEBSERVER_URL','http://127.0.0.1:7000')
 WEBSERVER_API_URL = getattr(settings, 'WEBSERVER_API_URL','/api')
-WEBSERVER_API_VERSION = getattr(settings, 'WEBSERVER_API_VERSION','v1')
\ No newline at end of file
+WEBSERVER_API_VERSION = getattr(settings, 'WEBSERVER_API_VERSION','v1')
+
+#seconds to wait for a WebServer to accept a connection
+WEBSERVER_PROBE_TIMEOUT = getattr(settings, 'WEBSERVER_PROBE_TIMEOUT', 2)
+#seconds a WebServer health check result is reused
+WEBSERVER_HEALTH_TTL = getattr(settings, 'WEBSERVER_HEALTH_TTL', 30)
+#seconds the cached list of remote destinations is served without a refresh
+DESTINATIONS_TTL = getattr(settings, 'DESTINATIONS_TTL', 300)
+#requests to a WebServer API that may run at the same time
+API_MAX_CONCURRENCY = getattr(settings, 'API_MAX_CONCURRENCY', 4)
+#local archives kept by the retention policy: the most recent ones, the last
+#of each of the latest days, weeks and months, and at most this many bytes in
+#total (None for no limit). Archives not yet on a server are always kept
+RETENTION_KEEP_LAST = getattr(settings, 'RETENTION_KEEP_LAST', 10)
+RETENTION_KEEP_DAILY = getattr(settings, 'RETENTION_KEEP_DAILY', 7)
+RETENTION_KEEP_WEEKLY = getattr(settings, 'RETENTION_KEEP_WEEKLY', 4)
+RETENTION_KEEP_MONTHLY = getattr(settings, 'RETENTION_KEEP_MONTHLY', 12)
+RETENTION_MAX_SIZE = getattr(settings, 'RETENTION_MAX_SIZE', None)
+#minutes before a failed scheduled run is retried, doubled on each failure in
+#a row, and retries before the schedule just waits for its next run
+SCHEDULE_RETRY_DELAY = getattr(settings, 'SCHEDULE_RETRY_DELAY', 5)
+SCHEDULE_MAX_RETRIES = getattr(settings, 'SCHEDULE_MAX_RETRIES', 5)
+#bytes a compressed dump may take in memory before it's spilled to disk
+DUMP_MEMORY_LIMIT = getattr(settings, 'DUMP_MEMORY_LIMIT', 64 * 1024 * 1024)
+#days phases are kept in the operation log before being compacted into daily totals
+OPLOG_KEEP_DAYS = getattr(settings, 'OPLOG_KEEP_DAYS', 90)
+#rows in each page of the backups and schedules tables
+TABLE_PAGE_SIZE = getattr(settings, 'TABLE_PAGE_SIZE', 25)
+#JSON listing of backups: seconds a page is cached (changes invalidate it before,
+#if every process shares the cache backend), most rows per page, and the token
+#monitoring tools may send instead of logging in as staff, to it and to the metrics
+BACKUPS_API_TTL = getattr(settings, 'BACKUPS_API_TTL', 300)
+BACKUPS_API_MAX_LIMIT = getattr(settings, 'BACKUPS_API_MAX_LIMIT', 100)
+BACKUPS_API_TOKEN = getattr(settings, 'BACKUPS_API_TOKEN', None)
+#days job progress files are kept, and seconds between their updates
+JOBS_KEEP_DAYS = getattr(settings, 'JOBS_KEEP_DAYS', 7)
+JOBS_PROGRESS_INTERVAL = getattr(settings, 'JOBS_PROGRESS_INTERVAL', 0.5)
+#secret archives are encrypted with before they're stored or sent (None
+#leaves them only compressed), and bytes of plaintext in each authenticated chunk
+ARCHIVE_KEY = getattr(settings, 'ARCHIVE_KEY', None)
+ENCRYPTION_CHUNK_SIZE = getattr(settings, 'ENCRYPTION_CHUNK_SIZE', 64 * 1024)
+#seconds between stack samples when backups or restores are profiled
+PROFILE_INTERVAL = getattr(settings, 'PROFILE_INTERVAL', 0.005)
+#seconds the metrics that need queries (phases, unsent backups, schedule lag) are reused
+METRICS_TTL = getattr(settings, 'METRICS_TTL', 15)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import connection
+
+from client.conf.settings import DESTINATIONS_TTL, WEBSERVER_PROBE_TIMEOUT
+from client.models import Origin, WebServer
+
+CACHE_KEY = 'client.destinations'
+
+_refreshing = threading.Lock()
+_thread = None
+
+def get_destinations():
+    """
+    Returns the names of remote destinations from the cache: stale names
+    are returned right away and refreshed in background, while an empty
+    cache waits for the server up to WEBSERVER_PROBE_TIMEOUT.
+    """
+    entry = cache.get(CACHE_KEY)
+    if entry is None:
+        refresh_in_background().join(WEBSERVER_PROBE_TIMEOUT)
+        entry = cache.get(CACHE_KEY)
+        if entry is None:
+            return []
+    if time.time() - entry['fetched_at'] > DESTINATIONS_TTL:
+        refresh_in_background()
+    return entry['destinations']
+
+def fetch():
+    token = Origin.instance().auth_token
+    api = WebServer.instance().get_api(token=token)
+    return [d['name'] for d in api.destinations.get()]
+
+def refresh():
+    destinations = fetch()
+    #kept forever, staleness is told by fetched_at
+    cache.set(CACHE_KEY, {'destinations': destinations, 'fetched_at': time.time()}, None)
+    return destinations
+
+def refresh_in_background():
+    """
+    Starts a refresh, or returns the one already running.
+    """
+    global _thread
+    #a single refresh at a time
+    with _refreshing:
+        if _thread is not None and _thread.is_alive():
+            return _thread
+        def run():
+            try:
+                refresh()
+            except Exception:
+                #keeps serving stale destinations until the server is back
+                pass
+            finally:
+                connection.close()
+        _thread = threading.Thread(target=run)
+        _thread.daemon = True
+        _thread.start()
+        return _thread
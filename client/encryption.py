@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import hmac
+import os
+import struct
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.crypto import constant_time_compare
+from django.utils.encoding import force_bytes
+
+try:
+    from Crypto.Cipher import AES
+    from Crypto.Util import Counter
+except ImportError:
+    AES = None
+
+from client.conf.settings import ENCRYPTION_CHUNK_SIZE
+
+#encrypted archives start with MAGIC, then a random salt the keys of the
+#archive are derived from. Gzipped ones start with 1f 8b, so both can be told apart
+MAGIC = 'TBKENC1\n'
+SALT_SIZE = 16
+HEADER_SIZE = len(MAGIC) + SALT_SIZE
+#each chunk is a (final, length) header, its ciphertext and the HMAC-SHA256
+#of its number, header and ciphertext
+CHUNK_HEADER = struct.Struct('>BI')
+TAG_SIZE = 32
+
+
+class DecryptionError(Exception):
+    pass
+
+
+def derive_keys(key, salt):
+    """
+    Returns the AES-256 and HMAC keys of an archive, derived from key and
+    its salt, so no two archives share them
+    """
+    if AES is None:
+        raise ImproperlyConfigured('ARCHIVE_KEY is set, but pycrypto is not installed')
+    key = force_bytes(key)
+    derive = lambda label: hmac.new(key, salt + label, hashlib.sha256).digest()
+    return derive('encryption'), derive('authentication')
+
+def seal(cipher_key, mac_key, index, final, data):
+    """
+    Encrypts and authenticates chunk number index of an archive
+    """
+    counter = Counter.new(64, prefix=struct.pack('>Q', index))
+    ciphertext = AES.new(cipher_key, AES.MODE_CTR, counter=counter).encrypt(data)
+    header = CHUNK_HEADER.pack(final, len(ciphertext))
+    tag = hmac.new(mac_key, struct.pack('>Q', index) + header + ciphertext, hashlib.sha256).digest()
+    return header + ciphertext + tag
+
+
+class EncryptingWriter(object):
+    """
+    Encrypts what's written to it into stream, in authenticated chunks of
+    chunk_size bytes, as it's written. Chunks are numbered and the last one
+    is marked, so reordered, dropped or truncated chunks are detected.
+    close writes the last chunk, but leaves stream open. The writes into
+    stream are measured as phase, if given
+    """
+    def __init__(self, stream, key, chunk_size=ENCRYPTION_CHUNK_SIZE, phase=None):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.phase = phase
+        salt = os.urandom(SALT_SIZE)
+        self.cipher_key, self.mac_key = derive_keys(key, salt)
+        self.index = 0
+        self.buffer = []
+        self.buffered = 0
+        self.count = 0
+        self.closed = False
+        self.stream.write(MAGIC + salt)
+
+    def write(self, data):
+        self.count += len(data)
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.chunk_size:
+            data = ''.join(self.buffer)
+            full = len(data) - len(data) % self.chunk_size
+            self.seal(data[:full], final=False)
+            self.buffer = [data[full:]]
+            self.buffered = len(data) - full
+
+    def seal(self, data, final):
+        if self.phase is None:
+            self._seal(data, final)
+            return
+        with self.phase:
+            self._seal(data, final)
+
+    def _seal(self, data, final):
+        chunks = [data[i:i + self.chunk_size] for i in xrange(0, len(data), self.chunk_size)] or ['']
+        for n, chunk in enumerate(chunks):
+            self.stream.write(seal(self.cipher_key, self.mac_key, self.index,
+                                   final and n == len(chunks) - 1, chunk))
+            self.index += 1
+
+    def flush(self):
+        #only whole chunks are written before close
+        pass
+
+    def close(self):
+        if not self.closed:
+            self.seal(''.join(self.buffer), final=True)
+            self.buffer = []
+            self.closed = True
+
+
+class Decryptor(object):
+    """
+    Decrypts an archive fed to it in pieces of any size, as they're
+    downloaded. Archives that aren't encrypted pass through unchanged.
+    Raises DecryptionError as soon as a chunk fails authentication, and
+    in finish if the archive was cut short
+    """
+    def __init__(self, key):
+        self.key = key
+        self.buffer = ''
+        self.encrypted = None
+        self.index = 0
+        self.finished = False
+
+    def feed(self, data):
+        """
+        Returns the plaintext of data that's available so far
+        """
+        if self.encrypted is False:
+            return data
+        self.buffer += data
+        if self.encrypted is None:
+            if len(self.buffer) < HEADER_SIZE and MAGIC.startswith(self.buffer[:len(MAGIC)]):
+                return ''
+            self.encrypted = self.buffer.startswith(MAGIC)
+            if not self.encrypted:
+                data, self.buffer = self.buffer, ''
+                return data
+            if not self.key:
+                raise DecryptionError('The archive is encrypted, but ARCHIVE_KEY is not set')
+            self.cipher_key, self.mac_key = derive_keys(self.key, self.buffer[len(MAGIC):HEADER_SIZE])
+            self.buffer = self.buffer[HEADER_SIZE:]
+
+        plaintext = []
+        offset = 0
+        while len(self.buffer) - offset >= CHUNK_HEADER.size:
+            if self.finished:
+                raise DecryptionError('Unexpected data after the last chunk of the archive')
+            final, length = CHUNK_HEADER.unpack_from(self.buffer, offset)
+            end = offset + CHUNK_HEADER.size + length + TAG_SIZE
+            if len(self.buffer) < end:
+                break
+            plaintext.append(self.open(self.buffer[offset:end], final))
+            offset = end
+        self.buffer = self.buffer[offset:]
+        return ''.join(plaintext)
+
+    def open(self, chunk, final):
+        body, tag = chunk[:-TAG_SIZE], chunk[-TAG_SIZE:]
+        expected = hmac.new(self.mac_key, struct.pack('>Q', self.index) + body, hashlib.sha256).digest()
+        if not constant_time_compare(tag, expected):
+            raise DecryptionError('Chunk %d of the archive failed authentication: '
+                                  'it was changed, or ARCHIVE_KEY is wrong' % self.index)
+        counter = Counter.new(64, prefix=struct.pack('>Q', self.index))
+        self.index += 1
+        self.finished = bool(final)
+        return AES.new(self.cipher_key, AES.MODE_CTR, counter=counter).decrypt(body[CHUNK_HEADER.size:])
+
+    def finish(self):
+        """
+        Returns what's left of an archive that isn't encrypted, and checks
+        an encrypted one was complete
+        """
+        if not self.encrypted:
+            data, self.buffer = self.buffer, ''
+            return data
+        if not self.finished or self.buffer:
+            raise DecryptionError('The archive is truncated')
+        return ''
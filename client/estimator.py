@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from collections import namedtuple
+
+from django.core import serializers
+from django.db import connection, router
+from django.db.models import get_apps, get_models
+
+from client.conf.settings import DUMP_MEMORY_LIMIT
+from client.models import Backup
+
+#apps and models left out of dumps, as in dumpdata's --exclude
+DUMP_EXCLUDE = ['contenttypes', 'auth.permission']
+
+#rows serialized per model to measure its average width
+SAMPLE_ROWS = 20
+#past runs used for compression ratio and throughput
+HISTORY_RUNS = 5
+#assumed until there are past runs
+DEFAULT_COMPRESSION_RATIO = 0.25
+DEFAULT_THROUGHPUT = 2 * 1024 * 1024
+#room left for estimation errors
+SAFETY_MARGIN = 1.25
+
+#strategies: compressed dump buffered in memory or spilled to a temporary file
+MEMORY = 'memory'
+SPILL = 'spill'
+
+Estimate = namedtuple('Estimate', 'rows raw_size compressed_size seconds')
+
+
+class InsufficientSpace(Exception):
+    pass
+
+
+def dumped_models(exclude=DUMP_EXCLUDE):
+    """
+    Returns the models dumpdata writes, leaving out exclude
+    """
+    models = []
+    for app in get_apps():
+        app_label = app.__name__.split('.')[-2]
+        if app_label in exclude:
+            continue
+        for model in get_models(app, include_auto_created=True):
+            label = '%s.%s' % (app_label, model._meta.object_name.lower())
+            if model._meta.proxy or label in exclude:
+                continue
+            if router.allow_syncdb(connection.alias, model):
+                models.append(model)
+    return models
+
+def row_count(model):
+    """
+    Returns the number of rows of model, from the planner's statistics
+    where the database keeps them, so big tables aren't scanned
+    """
+    table = model._meta.db_table
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+        row = cursor.fetchone()
+        #never analyzed tables have no statistics
+        if row and row[0] > 0:
+            return int(row[0])
+    elif connection.vendor == 'mysql':
+        cursor.execute('SELECT table_rows FROM information_schema.tables '
+                       'WHERE table_schema = DATABASE() AND table_name = %s', [table])
+        row = cursor.fetchone()
+        if row and row[0]:
+            return int(row[0])
+    return model._default_manager.count()
+
+def row_width(model):
+    """
+    Returns the average length of the serialized rows of model, from a sample
+    """
+    sample = list(model._default_manager.all()[:SAMPLE_ROWS])
+    if not sample:
+        return 0
+    return float(len(serializers.serialize('json', sample, use_natural_keys=True))) / len(sample)
+
+def history(runs=HISTORY_RUNS):
+    """
+    Returns the compression ratio and throughput (raw bytes per second)
+    of the latest dumps
+    """
+    dumps = Backup.objects.filter(raw_size__gt=0, size__isnull=False, dump_seconds__isnull=False) \
+                          .order_by('-pk') \
+                          .values_list('raw_size', 'size', 'dump_seconds')[:runs]
+    if not dumps:
+        return DEFAULT_COMPRESSION_RATIO, DEFAULT_THROUGHPUT
+    raw_size = sum(d[0] for d in dumps)
+    size = sum(d[1] for d in dumps)
+    seconds = sum(d[2] for d in dumps)
+    return float(size) / raw_size, raw_size / seconds if seconds > 0 else DEFAULT_THROUGHPUT
+
+def estimate_dump(exclude=DUMP_EXCLUDE):
+    """
+    Predicts rows, uncompressed and compressed size in bytes, and seconds of a dump
+    """
+    rows = 0
+    raw_size = 0
+    for model in dumped_models(exclude):
+        count = row_count(model)
+        rows += count
+        if count:
+            raw_size += int(count * row_width(model))
+    ratio, throughput = history()
+    return Estimate(rows, raw_size, int(raw_size * ratio), raw_size / throughput)
+
+def free_space(path):
+    """
+    Returns the bytes free for path, which is measured at its nearest
+    existing parent if it isn't created yet (e.g. on a fresh install)
+    """
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    stat = os.statvfs(path)
+    return stat.f_bavail * stat.f_frsize
+
+def available_memory(meminfo='/proc/meminfo'):
+    """
+    Returns the bytes of memory available without swapping, or None where
+    the system doesn't tell (anything but Linux 3.14 and later)
+    """
+    try:
+        with open(meminfo) as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, ValueError, IndexError):
+        pass
+    return None
+
+def plan(estimate, path, memory_limit=DUMP_MEMORY_LIMIT):
+    """
+    Picks how to write a dump: compressed in memory if it fits both
+    memory_limit and the memory available now, otherwise spilled to a
+    temporary file in path. Raises InsufficientSpace if path can't take it,
+    before anything is written.
+    """
+    needed = int(estimate.compressed_size * SAFETY_MARGIN)
+    memory = available_memory()
+    if memory is not None:
+        memory_limit = min(memory_limit, memory)
+    strategy = MEMORY if needed <= memory_limit else SPILL
+    #a spilled dump is copied into the store, so it's on disk twice for a while
+    needed_on_disk = needed * 2 if strategy == SPILL else needed
+    available = free_space(path)
+    if needed_on_disk > available:
+        raise InsufficientSpace('Dump needs about %d bytes in %s, but only %d are free'
+                                % (needed_on_disk, path, available))
+    return strategy
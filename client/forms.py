@@ -4,6 +4,7 @@ from django import forms
 from slumber.exceptions import HttpClientError, HttpServerError
 
 from client.models import (Origin, WebServer, Schedule)
+from client.destinations import get_destinations
 
 NEW_USER = u'0'
 EXISTING_USER = u'1'
@@ -187,16 +188,30 @@ class OriginEditForm(forms.ModelForm):
 class ScheduleForm(forms.ModelForm):
     model = Schedule
 
-    #busca no servidor remoto (via API) os destinos disponíveis
+    #busca os destinos disponíveis no cache local, atualizado em segundo plano
+    #a partir do servidor remoto (via API); com o cache vazio espera o servidor
+    #por WEBSERVER_PROBE_TIMEOUT
     def __init__(self, *args, **kwargs):
         super(ScheduleForm, self).__init__(*args, **kwargs)
 
-        token   = Origin.instance().auth_token
-        api     = WebServer.instance().get_api(token=token)
-        choices = [ (d['name'], d['name']) for d in api.destinations.get() ]
+        try:
+            names = get_destinations()
+        except Exception:
+            names = []
+        #mantém o destino atual mesmo se o servidor estiver indisponível
+        current = self.instance.destination if self.instance else None
+        if current and current not in names:
+            names = [current] + names
+        choices = [ (name, name) for name in names ]
 
         self.fields['destination'] = forms.ChoiceField(choices=choices)
 
+    def clean(self):
+        cleaned_data = super(ScheduleForm, self).clean()
+        if not self.fields['destination'].choices:
+            raise forms.ValidationError(u'Os destinos ainda estão sendo carregados do servidor. Tente novamente em instantes.')
+        return cleaned_data
+
 
 class ConfirmRestoreForm(forms.Form):
     username = forms.CharField(label=u'Usuário')
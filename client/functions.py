@@ -5,6 +5,8 @@ import json
 import operator
 import requests
 
+import pytz
+
 from datetime     import timedelta
 from hashlib      import sha1 as SHA
 from django.conf  import settings
@@ -75,6 +77,34 @@ def remove_key(d, key):
 def normalize_time(dt):
   return dt - timedelta(seconds=dt.second) - timedelta(microseconds=dt.microsecond)
 
+def to_local_naive(dt):
+  '''converts an aware datetime into a naive one in local wall-clock time'''
+  if dt is None:
+    return None
+  return timezone.make_naive(dt, pytz.timezone(settings.TIME_ZONE))
+
+def from_local_naive(dt):
+  '''converts a naive local wall-clock datetime into an aware one.
+     Times inside a DST gap are pushed forward and ambiguous times
+     resolve to their first occurrence.
+  '''
+  if dt is None:
+    return None
+  tz = pytz.timezone(settings.TIME_ZONE)
+  try:
+    return tz.localize(dt, is_dst=None)
+  except pytz.AmbiguousTimeError:
+    return tz.localize(dt, is_dst=True)
+  except pytz.NonExistentTimeError:
+    return tz.normalize(tz.localize(dt, is_dst=False))
+
+def jitter_offset(identity, window):
+  '''stable offset, in minutes, of identity inside a window of minutes.
+     Hashing spreads offsets of many identities evenly across the window.
+  '''
+  if not window:
+    return 0
+  return int(SHA(identity.encode('utf-8')).hexdigest(), 16) % window
 
 def to_hyperlink(hyperlink, display_text=None, attrs=None):
   txt_attrs = ''.join([' {}="{}"'.format(k,v) for k,v in attrs.iteritems()]) if attrs else ''
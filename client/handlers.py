@@ -1,9 +1,12 @@
 
-from datetime import datetime
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from cStringIO import StringIO
 import gzip
 import zlib
+import math
 import os
+import tempfile
 import requests
 import pytz
 import dateutil.parser
@@ -11,28 +14,51 @@ import dateutil.tz
 
 from django import forms
 from django.core.management import call_command
-from django.core.files.base import ContentFile
+from django.core.files.base import File
+from django.db import transaction
+from django.db.models.signals import post_save
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
-from client.conf.settings import settings, TBACKUP_DATETIME_FORMAT
+from client.conf.settings import settings, TBACKUP_DATETIME_FORMAT, API_MAX_CONCURRENCY, ARCHIVE_KEY
 
 from client.auth import HTTPTokenAuth
-from client.models import Backup, Origin, WebServer, Schedule
-from client import functions
+from client.models import Backup, OpLog, Origin, WebServer, Schedule
+from client.instrumentation import MeasuredWriter, OpLogBuffer, Phase
+from client.remote import AsyncAPI
+from client.storage import HashingWriter, archive_storage
+from client import encryption, estimator, functions, listing, profiling
+from client.snapshot import snapshot
 
 class DataHandler(object):
     
-    def __init__(self, origin=None, webserver=None):
+    def __init__(self, origin=None, webserver=None, profiler=None, job=None, key=ARCHIVE_KEY):
         #current time
         self.run_time = functions.normalize_time(timezone.now())
         self.run_time_local = timezone.make_naive(self.run_time, pytz.timezone(settings.TIME_ZONE))
         now_str = datetime.strftime(self.run_time_local, TBACKUP_DATETIME_FORMAT)
         
+        #runs missed while the agent was down, found by catch_up
+        self.missed_runs = {}
+        
         #get schedules to run now
         self.schedules = self.get_schedules_to_run()
         
         self.origin = origin
         self.webserver = webserver
+        self.contents = None
+        self.digest = None
+        self.estimate = None
+        self.raw_size = None
+        self.dump_seconds = None
+        self.phases = []
+        #phases of this handler's operations, written once each is done
+        self.oplog_buffer = OpLogBuffer()
+        #profiles each phase, if given a profiling.Profiler
+        self.profile = profiler.phase if profiler else profiling.nothing
+        #reports progress, if running as a jobs.Job
+        self.job = job
+        #archives are encrypted with key, if set
+        self.key = key
         if isinstance(webserver, WebServer) and isinstance(origin, Origin):
             self.api = webserver.get_api(token=origin.auth_token)
         else:
@@ -45,38 +71,126 @@ class DataHandler(object):
         
         
     def cache_dumpdata(self):
-        self.contents = self.get_dumped_data()
+        #makes sure there's room for the dump before writing any of it
+        self.estimate = estimator.estimate_dump()
+        strategy = estimator.plan(self.estimate, archive_storage.location)
+        self.contents = self.get_dumped_data(spill=strategy == estimator.SPILL)
     
     
+    def report(self, **progress):
+        '''
+            Records progress (phase, bytes_transferred, bytes_total,
+            rows_loaded) on the handler's job, if it has one
+        '''
+        if self.job:
+            self.job.update(**progress)
+    
     def get_schedules_to_run(self):
         """
         Fetches all active jobs scheduled to run now
         """
-        #django converts UTC to localtime in filters, so we need to
-        #use our run_time_local, a naive datetime object
-        schedules = Schedule.objects.filter(active=True,
-                                            initial_time__hour=self.run_time_local.hour,
-                                            initial_time__minute=self.run_time_local.minute)
-        return [s for s in schedules if s.is_runtime(self.run_time)]
+        #next_run_at is kept up to date by Schedule.save and Schedule.mark_run,
+        #so a single range query over its index finds every due schedule
+        return list(Schedule.objects
+                            .filter(active=True, next_run_at__lte=self.run_time)
+                            .select_related('rule'))
+    
+    def catch_up(self, since):
+        """
+        Makes schedules that missed runs since since (the agent's last
+        tick) due again, and refreshes the schedules to run.
+        Returns a dict of schedule -> missed run times
+        """
+        self.missed_runs = self.queue_missed_runs(since)
+        self.schedules = self.get_schedules_to_run()
+        return self.missed_runs
+    
+    def queue_missed_runs(self, since):
+        """
+        Finds runs missed between since (the agent's last tick) and now
+        and makes their schedules due, so each one is backed up once no
+        matter how many runs it missed.
+        Returns a dict of schedule -> missed run times
+        """
+        #nothing was missed if the agent ticked within the last minute
+        if since is None or self.run_time - since <= timedelta(minutes=1):
+            return {}
+        
+        missed_runs = {}
+        for schedule in Schedule.objects.filter(active=True).select_related('rule'):
+            #a run at run_time isn't missed, it's due now
+            runs = [r for r in schedule.runtimes_between(since, self.run_time)
+                      if r < self.run_time]
+            if not runs:
+                continue
+            missed_runs[schedule] = runs
+            if schedule.next_run_at is None or schedule.next_run_at > self.run_time:
+                Schedule.objects.filter(pk=schedule.pk).update(next_run_at=runs[0])
+        return missed_runs
     
-    def get_dumped_data(self):
+    def get_dumped_data(self, spill=False):
         '''
-            Gets complete dump of the database in JSON format, Gzipped
+            Gets complete dump of the database in JSON format, Gzipped.
+            It's compressed, encrypted if there's a key, and hashed as
+            dumpdata writes it, into memory or, if spill is set, into a
+            temporary file next to the archives
         '''
-        contents = StringIO()
-        contents_gzipped = StringIO()
-        
-        #use natural keys to handle auto-generated
-        #contenttypes and auth.permission properly
-        call_command('dumpdata',
-                     use_natural_keys=True,
-                     exclude=['contenttypes', 'auth.permission'],
-                     stdout=contents)
-        contents.seek(0)
+        if spill:
+            if not os.path.isdir(archive_storage.location):
+                os.makedirs(archive_storage.location)
+            contents_gzipped = tempfile.TemporaryFile(dir=archive_storage.location)
+        else:
+            contents_gzipped = StringIO()
         
-        gzip_file = gzip.GzipFile(fileobj=contents_gzipped, mode='w')
-        gzip_file.write(contents.read())
-        gzip_file.close()
+        hashed = HashingWriter(contents_gzipped)
+        dump = Phase(OpLog.DUMP)
+        compress = Phase(OpLog.COMPRESS)
+        encrypt = Phase(OpLog.ENCRYPT)
+        if self.key:
+            encrypted = encryption.EncryptingWriter(hashed, self.key, phase=encrypt)
+            gzip_file = gzip.GzipFile(filename='', fileobj=encrypted, mode='w', mtime=0)
+        else:
+            encrypted = None
+            #no time or name in the header, so identical dumps make
+            #identical archives, which are stored once
+            gzip_file = gzip.GzipFile(filename='', fileobj=hashed, mode='w', mtime=0)
+        contents = MeasuredWriter(gzip_file, compress,
+                                  progress=lambda count: self.report(bytes_transferred=count))
+        self.report(phase=OpLog.DUMP, bytes_transferred=0,
+                    bytes_total=self.estimate.raw_size if self.estimate else None)
+        try:
+            with self.profile(OpLog.DUMP), dump:
+                #use natural keys to handle auto-generated
+                #contenttypes and auth.permission properly.
+                #Every model is read from the same snapshot, so
+                #rows written meanwhile can't leave orphans in the dump
+                with snapshot():
+                    call_command('dumpdata',
+                                 use_natural_keys=True,
+                                 exclude=estimator.DUMP_EXCLUDE,
+                                 stdout=contents)
+                contents.flush()
+                with compress:
+                    gzip_file.close()
+                    if encrypted:
+                        encrypted.close()
+        except Exception:
+            #failed dumps are logged too, with no backup to point to
+            self.oplog_buffer.add(dump.oplog())
+            self.oplog_buffer.flush()
+            raise
+        self.dump_seconds = dump.wall_time
+        dump.exclude(compress)
+        self.raw_size = dump.bytes_out = compress.bytes_in = contents.count
+        compress.bytes_out = contents_gzipped.tell()
+        self.digest = hashed.hexdigest()
+        #logged with the first backup made of this dump
+        self.phases = [dump, compress]
+        if encrypted:
+            compress.exclude(encrypt)
+            compress.bytes_out = encrypt.bytes_in = encrypted.count
+            encrypt.bytes_out = contents_gzipped.tell()
+            self.phases.append(encrypt)
         
         contents_gzipped.seek(0)
         return contents_gzipped
@@ -88,6 +202,14 @@ class DataHandler(object):
         
         if not self.api:
             raise Exception('origin and webserver instances must be passed to DataHandler''s constructor to connect to API')
+        
+        backup_obj = self.create_local_backup(schedule=schedule, destination=destination)
+        return self.upload(backup_obj)
+    
+    def create_local_backup(self, schedule=None, destination=None):
+        '''
+            Saves cached dumpdata as a local Backup
+        '''
         if not self.contents:
             raise Exception('dumpdata was not cached. Run cache_dumpdata')
         
@@ -99,29 +221,155 @@ class DataHandler(object):
             backup_obj.destination = destination
         
         backup_obj.full_clean()
+        
+        #identical dumps are stored once and linked under each destination
+        content = File(self.contents)
+        self.contents.seek(0, os.SEEK_END)
+        backup_obj.size = self.contents.tell()
+        backup_obj.raw_size = self.raw_size
+        backup_obj.dump_seconds = self.dump_seconds
+        self.report(phase=OpLog.STORE, bytes_transferred=0, bytes_total=backup_obj.size)
+        store = Phase(OpLog.STORE, bytes_in=backup_obj.size)
+        try:
+            with self.profile(OpLog.STORE), store:
+                backup_obj.digest = archive_storage.store(content, digest=self.digest)
+                name = backup_obj.file.field.generate_filename(backup_obj, self.filename)
+                backup_obj.file = archive_storage.link(backup_obj.digest, name)
+        except Exception:
+            #failed stores are logged too, with the phases of their dump
+            #and no backup to point to
+            self.oplog_buffer.add(*[p.oplog() for p in self.phases + [store] if p.started_at])
+            self.oplog_buffer.flush()
+            self.phases = []
+            raise
+        #nothing was written if the archive was already stored
+        store.bytes_out = backup_obj.size if archive_storage.references(backup_obj.digest) == 1 else 0
         backup_obj.save()
-        backup_obj.file.save(self.filename, ContentFile(self.contents))
         
+        self.oplog_buffer.add(*[p.oplog(backup_obj) for p in self.phases + [store]])
+        self.oplog_buffer.flush()
+        self.phases = []
+        
+        #local backup is done, so the schedule won't be due again until its next run
+        if schedule:
+            schedule.mark_run(self.run_time)
+        
+        return backup_obj
+    
+    def upload(self, backup_obj, date=None):
+        '''
+            Sends a local Backup to the best available server,
+            failing over to the next one when a transfer fails
+        '''
+        if not self.api:
+            raise Exception('origin and webserver instances must be passed to DataHandler''s constructor to connect to API')
+        
+        date = date or self.run_time
+        size = backup_obj.file.size
+        webservers = WebServer.ranked(size) or [self.webserver]
+        self.report(phase=OpLog.UPLOAD, bytes_transferred=0, bytes_total=size)
+        
+        errors = []
+        try:
+            with self.profile(OpLog.UPLOAD):
+                for webserver in webservers:
+                    try:
+                        self.upload_to(webserver, backup_obj, date)
+                        self.report(bytes_transferred=size)
+                        return True
+                    except Exception as e:
+                        webserver.record_failure()
+                        errors.append(u'%s: %s' % (webserver.name, e))
+        finally:
+            self.oplog_buffer.flush()
+        raise Exception(_('Error sending backup to server: %s' % '; '.join(errors)))
+    
+    def upload_to(self, webserver, backup_obj, date):
+        api = webserver.get_api(token=self.origin.auth_token)
+        result, upload = self.post_backup(api, backup_obj, date)
+        self.record_upload(webserver, backup_obj, date, result, upload)
+    
+    def post_backup(self, api, backup_obj, date):
+        '''
+            Sends the file of a local Backup and returns the server's response
+            and the measured upload Phase. It only does I/O, so it may run on
+            AsyncAPI workers
+        '''
         remote_backup_info = {
-            'name': self.filename,
+            'name': backup_obj.name,
             'destination': backup_obj.destination,
-            'date': self.run_time,
+            'date': date,
         }
         
-        self.contents.seek(0)
         #post to server
+        backup_obj.file.open('rb')
+        upload = Phase(OpLog.UPLOAD, bytes_out=backup_obj.file.size)
         try:
-            result = self.api.backups.post(remote_backup_info, files={'file': self.contents})
-            if 'id' in result:
-                backup_obj.remote_backup_date = self.run_time
-                backup_obj.remote_id = result['id']
-                backup_obj.save()
-            else:
-                raise Exception(_('Server response not recognized: %s' % result))
-        except Exception as e:
-            raise Exception(_('Error sending backup to server: %s' % e))
-    
-        return True
+            with upload:
+                result = api.backups.post(remote_backup_info, files={'file': backup_obj.file})
+        except Exception:
+            #written by the caller's flush, off this thread
+            self.oplog_buffer.add(upload.oplog(backup_obj))
+            raise
+        finally:
+            backup_obj.file.close()
+        
+        if 'id' not in result:
+            raise Exception(_('Server response not recognized: %s' % result))
+        return result, upload
+    
+    def record_upload(self, webserver, backup_obj, date, result, upload):
+        webserver.record_transfer(backup_obj.file.size, upload.wall_time)
+        self.oplog_buffer.add(upload.oplog(backup_obj))
+        backup_obj.remote_backup_date = date
+        backup_obj.remote_id = result['id']
+        backup_obj.webserver = webserver
+        backup_obj.save()
+    
+    def drain(self, backups=None, date=None):
+        '''
+            Sends local Backups that aren't on a server yet (all of them by default),
+            several at a time, to the best available server. Backups it fails to take
+            are retried one by one on the other servers.
+            Returns the backups that could not be sent
+        '''
+        if not self.api:
+            raise Exception('origin and webserver instances must be passed to DataHandler''s constructor to connect to API')
+        
+        if backups is None:
+            backups = Backup.objects.filter(remote_id__isnull=True).exclude(file='')
+        backups = list(backups)
+        if not backups:
+            return []
+        
+        date = date or self.run_time
+        webserver = (WebServer.ranked() or [self.webserver])[0]
+        api = webserver.get_api(token=self.origin.auth_token)
+        
+        failed = []
+        with self.profile(OpLog.UPLOAD), AsyncAPI(api, API_MAX_CONCURRENCY) as async_api:
+            #files are read and sent by the workers; the database is only
+            #touched here, as each upload finishes
+            posts = [(backup_obj, async_api.submit(self.post_backup, api, backup_obj, date))
+                     for backup_obj in backups]
+            try:
+                for backup_obj, post in posts:
+                    try:
+                        result, upload = post.result()
+                    except Exception:
+                        webserver.record_failure()
+                        try:
+                            self.upload(backup_obj, date)
+                        except Exception as e:
+                            backup_obj.last_error = unicode(e)
+                            Backup.objects.filter(pk=backup_obj.pk).update(last_error=backup_obj.last_error)
+                            listing.invalidate()
+                            failed.append(backup_obj)
+                        continue
+                    self.record_upload(webserver, backup_obj, date, result, upload)
+            finally:
+                self.oplog_buffer.flush()
+        return failed
     
     def restore(self, remote_backup_id):
         '''
@@ -139,63 +387,167 @@ class DataHandler(object):
         #get metadata for the restored backup
         self.restored_bkp_metadata = self.api.backups(remote_backup_id).get()
         
-        #use zlib with magic number to handle gzip chunks
+        #use zlib with magic number to handle gzip chunks,
+        #decrypted first if the archive is encrypted
         z = zlib.decompressobj(16+zlib.MAX_WBITS)
-        #use requests instead of slumber API to handle chunk (stream) downloads
-        with open(tmp_file, 'wb') as f:
-            response = requests.get(url, auth=auth, stream=True)
-            if not response.ok:
-                raise forms.ValidationError(u'Erro inesperado: %s' % response)
-            for chunk in response.iter_content(1024):
-                if chunk:
-                    f.write(z.decompress(chunk))
-                    
+        decryptor = encryption.Decryptor(self.key)
+        download = Phase(OpLog.DOWNLOAD, bytes_in=0, bytes_out=0)
+        load = Phase(OpLog.LOAD)
         out=StringIO()
         err=StringIO()
-        #FLUSH ALL DB AND THEN LOAD DOWNLOADED FIXTURE
-        call_command('flush', interactive=False)
-        call_command('loaddata', tmp_file, stdout=out, stderr=err)
-        
-        #if error
-        err.seek(0, os.SEEK_END)
-        if err.tell() > 0:
-            err.seek(0)
-            raise Exception(err.read())
+        try:
+            #use requests instead of slumber API to handle chunk (stream) downloads
+            with self.profile(OpLog.DOWNLOAD), open(tmp_file, 'wb') as f, download:
+                response = requests.get(url, auth=auth, stream=True)
+                if not response.ok:
+                    raise forms.ValidationError(u'Erro inesperado: %s' % response)
+                self.report(phase=OpLog.DOWNLOAD, bytes_transferred=0,
+                            bytes_total=int(response.headers.get('content-length') or 0) or None)
+                for chunk in response.iter_content(64 * 1024):
+                    if chunk:
+                        data = z.decompress(decryptor.feed(chunk))
+                        f.write(data)
+                        download.bytes_in += len(chunk)
+                        download.bytes_out += len(data)
+                        self.report(bytes_transferred=download.bytes_in)
+                data = z.decompress(decryptor.finish())
+                f.write(data)
+                download.bytes_out += len(data)
+            
+            #FLUSH ALL DB AND THEN LOAD DOWNLOADED FIXTURE
+            load.bytes_in = download.bytes_out
+            self.report(phase=OpLog.LOAD, rows_loaded=0)
+            with self.profile(OpLog.LOAD), load, self.counting_rows():
+                call_command('flush', interactive=False, verbosity=0)
+                call_command('loaddata', tmp_file, stdout=out, stderr=err)
+                
+                #if error
+                err.seek(0, os.SEEK_END)
+                if err.tell() > 0:
+                    err.seek(0)
+                    raise Exception(err.read())
+        except Exception:
+            #the database may have been replaced, so they point to no backup
+            self.oplog_buffer.add(*[p.oplog() for p in (download, load) if p.started_at])
+            self.oplog_buffer.flush()
+            raise
         
         #deletes tmp_file
         os.remove(tmp_file)
         
         self.sync_backup_info()
+        
+        #logged now, since loading replaced the database
+        backup_obj = Backup.objects.filter(remote_id=remote_backup_id).first()
+        self.oplog_buffer.add(download.oplog(backup_obj), load.oplog(backup_obj))
+        self.oplog_buffer.flush()
         return out.read()
     
-    def sync_backup_info(self):
+    @contextmanager
+    def counting_rows(self):
+        '''
+            Reports the rows loaddata saves while in the with block
+        '''
+        if not self.job:
+            yield
+            return
+        loaded = [0]
+        def count(sender, raw=False, **kwargs):
+            if raw:
+                loaded[0] += 1
+                self.report(rows_loaded=loaded[0])
+        post_save.connect(count, weak=False, dispatch_uid='client.handlers.counting_rows')
+        try:
+            yield
+        finally:
+            post_save.disconnect(dispatch_uid='client.handlers.counting_rows')
+            self.report(rows_loaded=loaded[0])
+    
+    def sync_backup_info(self, min_date=None):
         
         #get info from restored metadata obtained in restore method
-        if 'id' in self.restored_bkp_metadata:
-            remote_backups = self.api.backups.get(min_date=self.restored_bkp_metadata['date'])
-            remote_backups = sorted(remote_backups, key=lambda k: k['date'])
-            
+        if min_date is None and 'id' in self.restored_bkp_metadata:
+            min_date = self.restored_bkp_metadata['date']
+        if min_date is not None:
+            schedules = self.get_schedules_by_time()
+            for remote_backups in self.iter_remote_backups(min_date):
+                self.upsert_backups(remote_backups, schedules)
+    
+    def get_schedules_by_time(self):
+        '''
+            Maps the local (hour, minute) of active schedules' runs to the schedule
+        '''
+        schedules = {}
+        for schedule in Schedule.objects.filter(active=True).order_by('pk'):
+            local_dt = functions.to_local_naive(schedule.shift(schedule.initial_time))
+            schedules.setdefault((local_dt.hour, local_dt.minute), schedule)
+        return schedules
+    
+    def iter_remote_backups(self, min_date):
+        '''
+            Yields pages of remote backups made since min_date, in order.
+            When the server tells how many there are, the following pages
+            are fetched concurrently, a few pages ahead of the consumer
+        '''
+        response = self.api.backups.get(min_date=min_date, page=1)
+        #unpaginated listings come as a plain list
+        if not isinstance(response, dict):
+            yield response
+            return
+        yield response['results']
+        if not response.get('next'):
+            return
+        
+        if response.get('count') and response['results']:
+            pages = int(math.ceil(float(response['count']) / len(response['results'])))
+            get_page = lambda page: self.api.backups.get(min_date=min_date, page=page)['results']
+            with AsyncAPI(self.api, API_MAX_CONCURRENCY) as async_api:
+                for results in async_api.imap(get_page, xrange(2, pages + 1)):
+                    yield results
+            return
+        
+        #without a count, pages are followed one by one
+        page = 2
+        while True:
+            response = self.api.backups.get(min_date=min_date, page=page)
+            yield response['results']
+            if not response.get('next'):
+                return
+            page += 1
+    
+    def upsert_backups(self, remote_backups, schedules):
+        '''
+            Creates or updates Backups of a page of remote backups, keyed on remote_id
+        '''
+        tz = pytz.timezone(settings.TIME_ZONE)
+        remote_ids = [r_b['id'] for r_b in remote_backups]
+        existing = dict((b.remote_id, b) for b in Backup.objects.filter(remote_id__in=remote_ids))
+        
+        new_backups = []
+        updated = False
+        with transaction.atomic():
             for r_b in remote_backups:
                 #parses datetime in isoformat string to datetime object
                 dt = dateutil.parser.parse(r_b['date'])
                 #converts UTC datetime to local datetime
-                local_dt = timezone.make_naive(dt, pytz.timezone(settings.TIME_ZONE))
+                local_dt = timezone.make_naive(dt, tz)
                 
-                schedule = Schedule.objects \
-                                   .filter(active=True,
-                                           initial_time__hour=local_dt.hour,
-                                           initial_time__minute=local_dt.minute) \
-                                   .first()
-                if schedule:
-                    b = Backup(schedule=schedule)
-                else:
-                    b = Backup()
-                    
-                b.remote_backup_date = r_b['date']
-                b.destination = r_b['destination']
-                b.remote_id = r_b['id']
-                b.name = r_b['name']
-                b.save()
+                schedule = schedules.get((local_dt.hour, local_dt.minute))
+                values = {
+                    'remote_backup_date': dt,
+                    'destination': r_b['destination'],
+                    'name': r_b['name'],
+                }
+                b = existing.get(r_b['id'])
+                if b is None:
+                    new_backups.append(Backup(schedule=schedule, remote_id=r_b['id'], **values))
+                elif b.schedule_id != (schedule.pk if schedule else None) or \
+                     any(getattr(b, field) != value for field, value in values.items()):
+                    Backup.objects.filter(pk=b.pk).update(schedule=schedule, **values)
+                    updated = True
+            Backup.objects.bulk_create(new_backups)
+        if new_backups or updated:
+            listing.invalidate()
         
     def fix_contenttypes_mismatch(self):
         '''
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+import math
+import resource
+import sys
+import threading
+import time
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from client import metrics
+from client.conf.settings import OPLOG_KEEP_DAYS
+from client.functions import to_local_naive
+from client.models import OpLog, OpLogRollup
+
+#CPU time of the calling thread only, so concurrent uploads don't add up.
+#Python 2 lacks the constant, but Linux has it
+RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD',
+                        1 if sys.platform.startswith('linux') else resource.RUSAGE_SELF)
+#ru_maxrss is in bytes on OS X and in kilobytes elsewhere
+MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+def cpu_time():
+    usage = resource.getrusage(RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+def peak_memory():
+    """
+    High-water mark of the process' memory, which only ever goes up
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * MAXRSS_UNIT
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of sorted values
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 99)
+    4
+    """
+    if not values:
+        return None
+    return values[max(int(math.ceil(p / 100.0 * len(values))) - 1, 0)]
+
+
+class Phase(object):
+    """
+    Measures wall and CPU time of a phase of a backup or restore, run in
+    one or more with blocks. The caller sets bytes_in and bytes_out:
+
+        with Phase(OpLog.STORE, bytes_in=size) as store:
+            ...
+            store.bytes_out = written
+        buffer.add(store.oplog(backup))
+
+    An exception raised in a with block is recorded as the phase's error.
+    peak_memory is how much the phase raised the process' peak memory: 0
+    when it stayed below the peak of earlier work.
+    """
+    def __init__(self, phase, bytes_in=None, bytes_out=None):
+        self.phase = phase
+        self.bytes_in = bytes_in
+        self.bytes_out = bytes_out
+        self.started_at = None
+        self.finished_at = None
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self.peak_memory = None
+        self.error = None
+
+    def __enter__(self):
+        if self.started_at is None:
+            self.started_at = timezone.now()
+        self._wall = time.time()
+        self._cpu = cpu_time()
+        self._memory = peak_memory()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.wall_time += time.time() - self._wall
+        self.cpu_time += cpu_time() - self._cpu
+        self.peak_memory = (self.peak_memory or 0) + peak_memory() - self._memory
+        self.finished_at = timezone.now()
+        if exc_value is not None:
+            self.error = exc_value
+
+    def exclude(self, other):
+        """
+        Takes out the time of other, measured inside this phase
+        """
+        self.wall_time -= other.wall_time
+        self.cpu_time -= other.cpu_time
+
+    def oplog(self, backup=None):
+        return OpLog(backup=backup,
+                     operation=OpLog.OPERATIONS[self.phase],
+                     phase=self.phase,
+                     started_at=self.started_at,
+                     finished_at=self.finished_at,
+                     wall_time=self.wall_time,
+                     cpu_time=self.cpu_time,
+                     bytes_in=self.bytes_in,
+                     bytes_out=self.bytes_out,
+                     peak_memory=self.peak_memory,
+                     outcome=OpLog.OK if self.error is None else OpLog.ERROR,
+                     error_class=type(self.error).__name__ if self.error is not None else '',
+                     error=force_text(self.error, errors='replace')[:255] if self.error is not None else '')
+
+
+class MeasuredWriter(object):
+    """
+    Writes into stream, in blocks of buffer_size bytes, measuring the
+    writes as phase and counting the bytes written. progress, if given,
+    is called with the count after each block
+    """
+    def __init__(self, stream, phase, buffer_size=64 * 1024, progress=None):
+        self.stream = stream
+        self.phase = phase
+        self.buffer_size = buffer_size
+        self.progress = progress
+        self.buffer = []
+        self.buffered = 0
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            with self.phase:
+                self.stream.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+            if self.progress:
+                self.progress(self.count)
+
+
+class OpLogBuffer(object):
+    """
+    Collects OpLogs and writes them with a single query on flush, so phases
+    are logged without touching the database in the middle of an operation.
+    Any thread may add logs; the one running the operation flushes them
+    once it's done, whether it succeeded or not. Each DataHandler has its
+    own, so concurrent operations don't write each other's logs
+    """
+    def __init__(self):
+        self.logs = []
+        self.lock = threading.Lock()
+
+    def add(self, *logs):
+        with self.lock:
+            self.logs.extend(logs)
+
+    def flush(self):
+        with self.lock:
+            logs, self.logs = self.logs, []
+        if logs:
+            OpLog.objects.bulk_create(logs)
+        return len(logs)
+
+
+def compact_oplog(days=OPLOG_KEEP_DAYS, batch_size=1000):
+    """
+    Adds the OpLogs older than days to the OpLogRollup of their day,
+    histogram buckets of the metrics included, and deletes them,
+    batch_size at a time.
+    Returns how many were compacted
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    compacted = 0
+    while True:
+        logs = list(OpLog.objects.filter(started_at__lt=cutoff)
+                                 .order_by('pk')
+                                 .values_list('pk', 'started_at', 'operation', 'phase', 'outcome',
+                                              'error_class', 'wall_time', 'cpu_time', 'bytes_in',
+                                              'bytes_out', 'peak_memory')[:batch_size])
+        if not logs:
+            return compacted
+
+        totals = defaultdict(lambda: {'count': 0, 'wall_time': 0.0, 'cpu_time': 0.0,
+                                      'bytes_in': 0, 'bytes_out': 0, 'peak_memory': None,
+                                      'durations': [], 'throughputs': []})
+        for pk, started_at, operation, phase, outcome, error_class, \
+                wall, cpu, read, written, memory in logs:
+            total = totals[(to_local_naive(started_at).date(), operation, phase, outcome, error_class)]
+            total['count'] += 1
+            total['wall_time'] += wall
+            total['cpu_time'] += cpu or 0
+            total['bytes_in'] += read or 0
+            total['bytes_out'] += written or 0
+            total['peak_memory'] = max(total['peak_memory'], memory)
+            total['durations'].append(wall)
+            #as metrics.observe_phases measures them
+            if phase == OpLog.UPLOAD and written is not None and wall > 0:
+                total['throughputs'].append(written / wall)
+
+        with transaction.atomic():
+            for (day, operation, phase, outcome, error_class), total in totals.items():
+                rollup, created = OpLogRollup.objects.get_or_create(day=day, operation=operation,
+                                                                    phase=phase, outcome=outcome,
+                                                                    error_class=error_class)
+                for field in ('count', 'wall_time', 'cpu_time', 'bytes_in', 'bytes_out'):
+                    setattr(rollup, field, getattr(rollup, field) + total[field])
+                rollup.peak_memory = max(rollup.peak_memory, total['peak_memory'])
+                #rollups with buckets blank from before they were kept keep them blank,
+                #since the phases compacted then can't be put in buckets anymore
+                if created or rollup.duration_buckets:
+                    rollup.duration_buckets = metrics.add_to_buckets(
+                        rollup.duration_buckets, total['durations'], metrics.PHASE_DURATION.buckets)
+                    if phase == OpLog.UPLOAD:
+                        rollup.throughput_buckets = metrics.add_to_buckets(
+                            rollup.throughput_buckets, total['throughputs'], metrics.UPLOAD_THROUGHPUT.buckets)
+                        rollup.throughput += sum(total['throughputs'])
+                rollup.save()
+            #rows are append-only, so the batch is every old row up to its last id
+            OpLog.objects.filter(started_at__lt=cutoff, pk__lte=logs[-1][0]).delete()
+        compacted += len(logs)
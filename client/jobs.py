@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import json
+import os
+import tempfile
+import time
+import uuid
+
+from django.utils import timezone
+from django.utils.encoding import force_text
+
+from client.conf.settings import JOBS_KEEP_DAYS, JOBS_PROGRESS_INTERVAL
+from client.storage import archive_storage
+
+#kinds and states of a job
+BACKUP  = 'backup'
+RESTORE = 'restore'
+PENDING = 'pending'
+RUNNING = 'running'
+DONE    = 'done'
+FAILED  = 'failed'
+#seconds after which a .tmp file is a leftover of a save that crashed,
+#rather than one being written
+TMP_KEEP_SECONDS = 60 * 60
+
+
+class Job(object):
+    """
+    Progress of a backup or restore running in a worker, kept as a JSON
+    file next to the archives: any process can read it, and restores,
+    which flush the database, don't wipe it.
+
+    Progress updates are written at most every JOBS_PROGRESS_INTERVAL
+    seconds, except when the phase or state changes. Jobs run in with
+    blocks, which record whether they succeeded:
+
+        with Job.get(job_id) as job:
+            job.update(phase=OpLog.DOWNLOAD, bytes_transferred=0)
+            ...
+    """
+    FIELDS = ('id', 'kind', 'state', 'phase', 'backup', 'bytes_transferred', 'bytes_total',
+              'rows_loaded', 'error', 'created_at', 'updated_at')
+
+    def __init__(self, **data):
+        for field in self.FIELDS:
+            setattr(self, field, data.get(field))
+        self.written_at = 0
+
+    @staticmethod
+    def directory():
+        return os.path.join(archive_storage.location, '.jobs')
+
+    @classmethod
+    def path(cls, id):
+        return os.path.join(cls.directory(), '%s.json' % id)
+
+    @classmethod
+    def create(cls, kind, backup=None):
+        cls.delete_old()
+        now = timezone.now().isoformat()
+        job = cls(id=uuid.uuid4().hex, kind=kind, state=PENDING, backup=backup,
+                  bytes_transferred=0, rows_loaded=0, created_at=now)
+        job.save()
+        return job
+
+    @classmethod
+    def get(cls, id):
+        """
+        Returns the job, or None if there's none with that id
+        """
+        try:
+            with open(cls.path(id)) as f:
+                return cls(**json.load(f))
+        except (IOError, ValueError):
+            return None
+
+    @classmethod
+    def delete_old(cls, days=JOBS_KEEP_DAYS):
+        """
+        Deletes jobs not updated for days, and files left by saves that
+        crashed. Other processes may be saving or deleting jobs meanwhile
+        """
+        if not os.path.isdir(cls.directory()):
+            return
+        now = time.time()
+        for name in os.listdir(cls.directory()):
+            path = os.path.join(cls.directory(), name)
+            oldest = now - (TMP_KEEP_SECONDS if name.endswith('.tmp') else days * 24 * 60 * 60)
+            try:
+                if os.path.getmtime(path) < oldest:
+                    os.remove(path)
+            except OSError as e:
+                #renamed into place or deleted by another process
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def as_dict(self):
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    def save(self):
+        if not os.path.isdir(self.directory()):
+            os.makedirs(self.directory())
+        self.updated_at = timezone.now().isoformat()
+        self.written_at = time.time()
+        #readers never see a half written file
+        fd, tmp = tempfile.mkstemp(dir=self.directory(), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.as_dict(), f)
+        os.rename(tmp, self.path(self.id))
+
+    def update(self, **fields):
+        """
+        Records progress, such as phase, bytes_transferred or rows_loaded
+        """
+        changed = any(getattr(self, k) != v for k, v in fields.items() if k in ('phase', 'state'))
+        for k, v in fields.items():
+            setattr(self, k, v)
+        if changed or time.time() - self.written_at >= JOBS_PROGRESS_INTERVAL:
+            self.save()
+
+    def __enter__(self):
+        self.update(state=RUNNING)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_value is None:
+            self.update(state=DONE, phase=None)
+        else:
+            self.update(state=FAILED, error=u'%s: %s' % (exc_type.__name__,
+                                                         force_text(exc_value, errors='replace')))
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import hashlib
+import time
+import uuid
+
+from django.core.cache import cache
+
+from client.conf.settings import BACKUPS_API_TTL
+
+#version of the backups listing, changed whenever a backup is
+STATE_KEY = 'client.listing.state'
+PAGE_KEY = 'client.listing.page.%s.%s'
+
+def state():
+    """
+    Returns the current version of the listing and when it changed.
+    Every process must share the cache backend (see CACHES in the
+    settings) to see the others' changes right away; otherwise they only
+    see them once BACKUPS_API_TTL runs out
+    """
+    current = cache.get(STATE_KEY)
+    if current is None:
+        current = invalidate()
+    return current
+
+def invalidate(**kwargs):
+    """
+    Starts a new version of the listing. Connected to Backup's signals,
+    and called after bulk updates, which send none
+    """
+    modified = int(time.time())
+    previous = cache.get(STATE_KEY)
+    if previous is not None:
+        #Last-Modified has one second resolution, so changes within the
+        #same second must still move it forward, or If-Modified-Since
+        #would answer 304 for the stale page
+        modified = max(modified, previous['modified'] + 1)
+    current = {'version': uuid.uuid4().hex, 'modified': modified}
+    cache.set(STATE_KEY, current, BACKUPS_API_TTL)
+    return current
+
+def get_page(query, build):
+    """
+    Returns the cached {'body', 'etag', 'modified'} of the page of the
+    listing for query (a normalized query string), calling build to make
+    its body if the listing changed since it was cached
+    """
+    current = state()
+    key = PAGE_KEY % (current['version'], hashlib.md5(query).hexdigest())
+    page = cache.get(key)
+    if page is None:
+        body = build()
+        page = {'body': body,
+                'etag': hashlib.md5(body).hexdigest(),
+                'modified': current['modified']}
+        cache.set(key, page, BACKUPS_API_TTL)
+    return page
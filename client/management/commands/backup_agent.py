@@ -1,27 +1,28 @@
 # -*- coding: utf-8 -*-
 
 import os
-import json
-import gzip
-import requests
-import pytz
+import signal
+import traceback
 
 from datetime    import datetime, timedelta
-from Crypto.Hash import SHA
-from StringIO import StringIO
 
 from client.conf.settings import TBACKUP_DATETIME_FORMAT, settings
 from django.utils import timezone
-from django.core.management import call_command
-from django.core.management.base import BaseCommand, make_option
+from django.utils.translation import ugettext as _
+from django.core.management.base import BaseCommand, CommandError, make_option
 from django.db.models import F, Q
 from client.models import (
+    AgentStatus,
     Origin,
     WebServer,
     Backup,
     Schedule,
 )
 from client.handlers import DataHandler
+from client.profiling import Profiler, profile_directory
+from client.instrumentation import compact_oplog
+from client.retention import RetentionPolicy
+from client.scheduler import Scheduler
 from client import functions
 
 TBACKUP_DUMP_DIR = settings.TBACKUP_DUMP_DIR
@@ -58,6 +59,45 @@ class Command(BaseCommand):
             dest  ='all_missing_tasks',
             help  ='Runs -r and then -s'
         ),
+        make_option(
+            '--prune',
+            '-p',
+            action='store_true',
+            dest  ='prune',
+            help  =('Deletes local archives, already sent, that the retention policy doesn''t keep, '
+            'and rolls up old operation logs')
+        ),
+        make_option(
+            '--restore',
+            action='store',
+            type  ='int',
+            dest  ='restore',
+            help  =('Backs up current data to the destination of the backup with this remote id, '
+            'then restores it')
+        ),
+        make_option(
+            '--profile',
+            action='store_true',
+            dest  ='profile',
+            help  =('Profiles each phase of the backups (or of the restore) and writes '
+            'pstats, collapsed stacks and allocations next to the archives')
+        ),
+        make_option(
+            '--daemon',
+            '-d',
+            action='store_true',
+            dest  ='daemon',
+            help  =('Keeps running and triggers backups at their scheduled times, '
+            'instead of being started every minute. SIGHUP reloads schedules')
+        ),
+        make_option(
+            '--poll-interval',
+            action='store',
+            type  ='int',
+            dest  ='poll_interval',
+            default=60,
+            help  ='Seconds between checks for changed schedules in daemon mode'
+        ),
     )
 
     def handle(self, *args, **options):
@@ -66,23 +106,84 @@ class Command(BaseCommand):
             if not Origin.objects.exists():
                 return
 
-            if options.get('trigger_backups', False):
-                self.trigger_backups()
+            self.profiler = None
+            if options.get('profile', False):
+                if options.get('daemon', False):
+                    raise CommandError('--profile profiles a single run, not the daemon')
+                label = 'restore' if options.get('restore') else 'backup'
+                self.profiler = Profiler(profile_directory(label))
+
+            try:
+                if options.get('daemon', False):
+                    self.run_daemon(options.get('poll_interval'))
+                elif options.get('restore'):
+                    self.restore(options['restore'])
+                elif options.get('trigger_backups', False):
+                    self.trigger_backups()
+                elif options.get('all_missing_tasks', False):
+                    self.all_missing_tasks()
+                elif options.get('retry_failed_backups', False):
+                    self.retry_failed_backups()
+                elif options.get('send_unsent_backups', False):
+                    self.send_unsent_backups()
+                elif options.get('prune', False):
+                    self.prune_old_backups()
+            finally:
+                if self.profiler and self.profiler.artifacts:
+                    self.stdout.write('Profiles written to %s' % self.profiler.directory)
 
         #except Exception, e:
         #    self.stderr.write('%s: %s' % (e.__class__.__name__, e))
 
-#    def delete_old_backups(self):
-#        fourteen_days_ago = datetime.now() - datetime.timedelta(days=14)
-#        backuphistory = Log.objects.filter(
-#            local_status=True,
-#            remote_status=True,
-#            dump_date__lt=fourteen_days_ago)
-#
-#        for backup in backuphistory:
-#            os.remove(os.path.join(TBACKUP_DUMP_DIR, backup.filename))
-#            backup.local_status = False
-#            backup.save()
+    def prune_old_backups(self):
+        """
+        Deletes local archives the retention policy doesn't keep
+        and compacts old operation logs
+        """
+        pruned = RetentionPolicy().prune()
+        if pruned:
+            self.stdout.write('Pruned %d local archive(s)' % pruned)
+        compacted = compact_oplog()
+        if compacted:
+            self.stdout.write('Rolled up %d operation log(s)' % compacted)
+
+    def restore(self, remote_id):
+        """
+        Backs up current data to the restored backup's destination,
+        then restores the backup
+        """
+        backup = Backup.objects.filter(remote_id=remote_id).first()
+        if backup is None:
+            raise CommandError('No backup has the remote id %d' % remote_id)
+        #restores from the server the backup was sent to
+        handler = DataHandler(origin=Origin.instance(),
+                              webserver=backup.webserver or WebServer.instance(),
+                              profiler=self.profiler)
+        handler.cache_dumpdata()
+        if handler.backup(destination=backup.destination):
+            handler.restore(remote_id)
+            self.stdout.write('Restored %s' % backup.name)
+
+    def run_daemon(self, poll_interval):
+        """
+        Runs scheduled backups until SIGTERM or SIGINT
+        """
+        scheduler = Scheduler(self.trigger_scheduled_backups,
+                              poll_interval=poll_interval,
+                              heartbeat=self.record_heartbeat)
+        signal.signal(signal.SIGHUP, scheduler.request_reload)
+        signal.signal(signal.SIGTERM, scheduler.stop)
+        signal.signal(signal.SIGINT, scheduler.stop)
+        #catches up runs missed while the agent was down
+        self.trigger_scheduled_backups()
+        scheduler.run_forever()
+
+    def trigger_scheduled_backups(self):
+        #a failed run must not stop the daemon
+        try:
+            self.trigger_backups()
+        except Exception:
+            self.stderr.write(traceback.format_exc())
 
     def all_missing_tasks(self):
         #self.schedule_missing_jobs()
@@ -112,21 +213,18 @@ class Command(BaseCommand):
         Send unsent backups to WebServer
         Recommended to run as a hourly periodic task
         """
-        for unsent in Backup.objects.filter(Q(state=Backup.WAITING) |
-                                            Q(state=Backup.ERROR_SENDING)):
-            unsent.send(WebServer.instance())
+        handler = DataHandler(origin=Origin.instance(),
+                              webserver=WebServer.instance(),
+                              profiler=self.profiler)
+        self.report_unsent(handler.drain())
 
     def retry_failed_backups(self):
         """
-        Retry backing up (locally) failed past attempts
-        Recommended to run as a hourly periodic task
+        Retry backing up (locally) failed past attempts.
+        Failed runs stay due, backing off (see Schedule.mark_failed),
+        so this runs the ones whose retry time has come
         """
-        dt = functions.normalize_time(timezone.now())
-        backups = Backup.objects.filter(Q(state=Backup.IDLE) |
-                                        Q(state=Backup.ERROR_RUNNING),
-                                        time__lte=dt)
-        for b in backups:
-            b.backup()
+        self.trigger_backups()
 
     def trigger_backups(self):
         """
@@ -137,12 +235,48 @@ class Command(BaseCommand):
         if not Origin.objects.exists():
             raise Exception(_('Origin does not exist'))
         
-        handler = DataHandler(origin=Origin.instance(),webserver=WebServer.instance())
-        if len(handler.schedules) == 0: return
-        
-        handler.cache_dumpdata()
-        for s in handler.schedules:
-            handler.backup(schedule=s)
+        status = AgentStatus.instance()
+        handler = DataHandler(origin=Origin.instance(),
+                              webserver=WebServer.instance(),
+                              profiler=self.profiler)
+        try:
+            #makes schedules that missed runs since the last tick due again
+            for schedule, runs in handler.catch_up(status.last_tick).items():
+                self.stdout.write('Catching up %d missed run(s) of %s' % (len(runs), schedule))
+            if len(handler.schedules) == 0: return
+            
+            try:
+                handler.cache_dumpdata()
+            except Exception:
+                for schedule in handler.schedules:
+                    schedule.mark_failed(handler.run_time)
+                raise
+            self.stdout.write('Dumped %d bytes in %.1fs (estimated: %d rows, %d bytes, '
+                              '%d compressed, %.1fs)' % (
+                              handler.raw_size, handler.dump_seconds, handler.estimate.rows,
+                              handler.estimate.raw_size, handler.estimate.compressed_size,
+                              handler.estimate.seconds))
+            backups = []
+            for schedule in handler.schedules:
+                try:
+                    backups.append(handler.create_local_backup(schedule=schedule))
+                except Exception:
+                    schedule.mark_failed(handler.run_time)
+                    self.stderr.write(traceback.format_exc())
+            #sends them concurrently
+            self.report_unsent(handler.drain(backups))
+            self.prune_old_backups()
+        finally:
+            #schedules that failed are still due, so the tick is recorded anyway
+            status.record_tick(handler.run_time)
+
+    def report_unsent(self, unsent):
+        for backup in unsent:
+            self.stderr.write('Could not send %s: %s' % (backup.name, backup.last_error))
+    
+    def record_heartbeat(self):
+        #idle daemon ticks count as ticks, so only real downtime is caught up
+        AgentStatus.instance().record_tick(functions.normalize_time(timezone.now()))
             
         
 #def fill_data():
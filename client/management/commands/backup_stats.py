@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError, make_option
+from django.utils import timezone
+
+from client.functions import to_local_naive
+from client.instrumentation import percentile
+from client.models import OpLog
+
+PERIODS = {
+    'day'  : lambda dt: dt.strftime('%Y-%m-%d'),
+    'week' : lambda dt: '%d-W%02d' % dt.isocalendar()[:2],
+    'month': lambda dt: dt.strftime('%Y-%m'),
+    'all'  : lambda dt: 'all',
+}
+#in the order they run
+PHASES = [phase for phase, name in OpLog.PHASE_CHOICES]
+
+
+class Command(BaseCommand):
+    help = 'Prints percentiles of the duration, CPU time, size and memory of backup phases'
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--days',
+            action='store',
+            type  ='int',
+            dest  ='days',
+            default=30,
+            help  ='Days of history to include'
+        ),
+        make_option(
+            '--by',
+            action='store',
+            dest  ='by',
+            default='week',
+            help  ='Period percentiles are grouped by: %s' % ', '.join(sorted(PERIODS))
+        ),
+    )
+
+    def handle(self, *args, **options):
+        if options['by'] not in PERIODS:
+            raise CommandError('--by must be one of %s' % ', '.join(sorted(PERIODS)))
+        period = PERIODS[options['by']]
+        since = timezone.now() - timedelta(days=options['days'])
+
+        groups = defaultdict(list)
+        for log in OpLog.objects.filter(started_at__gte=since) \
+                                .values_list('phase', 'started_at', 'wall_time', 'cpu_time',
+                                             'bytes_out', 'peak_memory') \
+                                .iterator():
+            groups[(period(to_local_naive(log[1])), log[0])].append(log)
+
+        self.stdout.write('%-10s %-9s %5s %24s %8s %12s %12s' % (
+                          'period', 'phase', 'n', 'wall p50/p90/p99 (s)',
+                          'cpu p50', 'out p50', 'peak growth'))
+        for key in sorted(groups, key=lambda k: (k[0], PHASES.index(k[1]))):
+            logs = groups[key]
+            wall = sorted(l[2] for l in logs)
+            cpu = sorted(l[3] for l in logs if l[3] is not None)
+            out = sorted(l[4] for l in logs if l[4] is not None)
+            memory = [l[5] for l in logs if l[5] is not None]
+            self.stdout.write('%-10s %-9s %5d %24s %8s %12s %12s' % (
+                              key[0], key[1], len(logs),
+                              '%.2f/%.2f/%.2f' % (percentile(wall, 50), percentile(wall, 90),
+                                                  percentile(wall, 99)),
+                              '%.2f' % percentile(cpu, 50) if cpu else '-',
+                              percentile(out, 50) if out else '-',
+                              max(memory) if memory else '-'))
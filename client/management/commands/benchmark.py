@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, make_option
+from django.db import connection
+
+from client import benchmark
+from client.storage import archive_storage
+
+
+class Command(BaseCommand):
+    help = ('Measures dumps, backups and restores of synthetic data in a scratch '
+            'database, against a stand-in WebServer, and prints the results as JSON')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--rows',
+            action='store',
+            type  ='int',
+            dest  ='rows',
+            default=10000,
+            help  ='Synthetic rows of the most numerous model'
+        ),
+        make_option(
+            '--width',
+            action='store',
+            type  ='int',
+            dest  ='width',
+            default=200,
+            help  ='Bytes of text in each synthetic row'
+        ),
+        make_option(
+            '--fanout',
+            action='store',
+            type  ='int',
+            dest  ='fanout',
+            default=10,
+            help  ='Rows pointing to each row of the model above'
+        ),
+        make_option(
+            '--repeat',
+            action='store',
+            type  ='int',
+            dest  ='repeat',
+            default=3,
+            help  ='Times each operation is measured'
+        ),
+        make_option(
+            '--delay',
+            action='store',
+            type  ='float',
+            dest  ='delay',
+            default=0,
+            help  ='Seconds the stand-in WebServer waits before each answer'
+        ),
+        make_option(
+            '--bandwidth',
+            action='store',
+            type  ='int',
+            dest  ='bandwidth',
+            help  ='Bytes per second the stand-in WebServer transfers at most'
+        ),
+        make_option(
+            '--output',
+            '-o',
+            action='store',
+            dest  ='output',
+            help  ='File the JSON results are written to, instead of the standard output'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            #test databases are built by migrations, as in manage.py test
+            from south.management.commands import patch_for_test_db_setup
+            patch_for_test_db_setup()
+        except ImportError:
+            pass
+
+        #restores flush the database, so the benchmark never runs on the real one
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        #nor does it write archives next to the real ones
+        location = archive_storage.location
+        archive_storage.location = tempfile.mkdtemp(prefix='tbackup_benchmark')
+        try:
+            results = benchmark.run(rows=options['rows'],
+                                    width=options['width'],
+                                    fanout=options['fanout'],
+                                    repeat=options['repeat'],
+                                    delay=options['delay'],
+                                    bandwidth=options['bandwidth'])
+        finally:
+            shutil.rmtree(archive_storage.location, ignore_errors=True)
+            archive_storage.location = location
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options.get('output'):
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+
+from django.core.management.base import BaseCommand, make_option
+
+from client.models import Origin
+from client.functions import jitter_offset
+
+
+class Command(BaseCommand):
+    help = ('Shows how the starts of a schedule spread across its jitter window '
+            'for a fleet of clients')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--clients',
+            '-c',
+            action='store',
+            type  ='int',
+            dest  ='clients',
+            default=1000,
+            help  ='Number of simulated clients'
+        ),
+        make_option(
+            '--window',
+            '-w',
+            action='store',
+            type  ='int',
+            dest  ='window',
+            default=30,
+            help  ='Jitter window, in minutes'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        clients = options['clients']
+        window = options['window']
+
+        arrivals = Counter(jitter_offset(u'client%d' % i, window) for i in xrange(clients))
+        expected = float(clients) / max(window, 1)
+        peak = max(arrivals.values())
+
+        self.stdout.write('%d clients over a %d minute window: '
+                          'expected %.1f per minute, peak %d (%.2fx)' % (
+                          clients, window, expected, peak, peak / expected))
+        for minute in xrange(max(window, 1)):
+            count = arrivals[minute]
+            self.stdout.write('+%3d min %6d %s' % (minute, count, '#' * int(round(60.0 * count / peak))))
+
+        origin = Origin.instance()
+        if origin is not None:
+            self.stdout.write('This client (%s) starts at +%d min' % (origin.name, jitter_offset(origin.name, window)))
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError, make_option
+
+from client.standin import StandInServer
+
+
+class Command(BaseCommand):
+    help = ('Runs a local stand-in for the WebServer API, to use the client offline '
+            'and measure it under a given latency, bandwidth and failure rate')
+
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--address',
+            action='store',
+            dest  ='address',
+            default='127.0.0.1:7000',
+            help  ='host:port to listen on'
+        ),
+        make_option(
+            '--token',
+            action='append',
+            dest  ='tokens',
+            default=[],
+            help  ='Accepted auth token. May be repeated'
+        ),
+        make_option(
+            '--user',
+            action='append',
+            dest  ='users',
+            default=[],
+            help  ='Existing user, as username:password. May be repeated'
+        ),
+        make_option(
+            '--destination',
+            action='append',
+            dest  ='destinations',
+            default=[],
+            help  ='Remote destination. May be repeated'
+        ),
+        make_option(
+            '--latency',
+            action='store',
+            type  ='float',
+            dest  ='latency',
+            default=0,
+            help  ='Seconds each request waits before being answered'
+        ),
+        make_option(
+            '--bandwidth',
+            action='store',
+            type  ='int',
+            dest  ='bandwidth',
+            help  ='Bytes per second uploads and downloads are capped at'
+        ),
+        make_option(
+            '--failure-rate',
+            action='store',
+            type  ='float',
+            dest  ='failure_rate',
+            default=0,
+            help  ='Fraction of the requests answered with a 503, from 0 to 1'
+        ),
+        make_option(
+            '--seed',
+            action='store',
+            type  ='int',
+            dest  ='seed',
+            help  ='Seed of the injected failures, to repeat a run'
+        ),
+        make_option(
+            '--directory',
+            action='store',
+            dest  ='directory',
+            help  ='Where uploaded files are kept. A temporary directory by default'
+        ),
+    )
+
+    def handle(self, *args, **options):
+        host, _, port = options['address'].rpartition(':')
+        if not host or not port.isdigit():
+            raise CommandError('--address must be host:port')
+        if not 0 <= options['failure_rate'] <= 1:
+            raise CommandError('--failure-rate must be between 0 and 1')
+
+        users = []
+        for i, user in enumerate(options['users']):
+            username, _, password = user.partition(':')
+            users.append({'id': i + 1,
+                          'username': username,
+                          'password': password,
+                          'email': '%s@localhost' % username,
+                          'auth_token': '%s-token' % username})
+
+        server = StandInServer(tokens=options['tokens'],
+                               users=users,
+                               destinations=options['destinations'],
+                               delay=options['latency'],
+                               bandwidth=options['bandwidth'],
+                               failure_rate=options['failure_rate'],
+                               seed=options['seed'],
+                               directory=options['directory'],
+                               address=(host, int(port)))
+        server.start()
+        self.stdout.write('Stand-in WebServer at %s (files in %s). Quit with CONTROL-C.'
+                          % (server.url, server.directory))
+        for user in users:
+            self.stdout.write('User %s has token %s' % (user['username'], user['auth_token']))
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+
+import bisect
+import threading
+import time
+
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from client.conf.settings import METRICS_TTL, WEBSERVER_HEALTH_TTL, WEBSERVER_PROBE_TIMEOUT
+from client.snapshot import snapshot
+
+#exposition format served to Prometheus
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+#histogram buckets: seconds of a phase, bytes per second and probe seconds
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+THROUGHPUT_BUCKETS = (16e3, 64e3, 256e3, 1e6, 4e6, 16e6, 64e6, 256e6)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2)
+
+def escape(value):
+    return unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_value(value):
+    """
+    >>> format_value(3.0), format_value(0.25), format_value(float('inf'))
+    ('3', '0.25', '+Inf')
+    """
+    if value == float('inf'):
+        return '+Inf'
+    return '%d' % value if value == int(value) else repr(float(value))
+
+def format_labels(labels):
+    if not labels:
+        return u''
+    return u'{%s}' % u','.join(u'%s="%s"' % (k, escape(v)) for k, v in labels)
+
+def bucket_counts(values, buckets):
+    """
+    Counts values in each of buckets, upper bounds of which the last is
+    +Inf, as Histogram does
+
+    >>> bucket_counts([0.2, 3, 7, 9000], (1, 5, float('inf')))
+    [1, 1, 2]
+    """
+    counts = [0] * len(buckets)
+    for value in values:
+        counts[bisect.bisect_left(buckets, value)] += 1
+    return counts
+
+def format_buckets(counts):
+    return ','.join(str(count) for count in counts)
+
+def parse_buckets(text):
+    return [int(count) for count in text.split(',')] if text else None
+
+def add_buckets(counts, other):
+    return [a + b for a, b in zip(counts, other)]
+
+def add_to_buckets(text, values, buckets):
+    """
+    Adds the counts per bucket of values to the ones formatted in text,
+    blank for none yet, and returns them formatted the same way
+    """
+    counts = parse_buckets(text) or [0] * len(buckets)
+    return format_buckets(add_buckets(counts, bucket_counts(values, buckets)))
+
+
+class Metric(object):
+    """
+    Values of a metric, one per combination of labels, kept in memory.
+    Updates only take a lock, so they're cheap to make anywhere, and
+    replace swaps all of them at once for values read elsewhere
+    """
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('%s takes the labels %s' % (self.name, ', '.join(self.labelnames)))
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+    def replace(self, values):
+        """
+        Takes (labels, value) pairs, labels being a dict, as the values of the
+        metric. Values of histograms are (count per bucket, sum)
+        """
+        values = dict((self.key(labels), value) for labels, value in values)
+        with self.lock:
+            self.values = values
+
+    def samples(self):
+        """
+        Returns (suffix, labels, value) of each sample
+        """
+        with self.lock:
+            return [('', key, value) for key, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = [u'# HELP %s %s' % (self.name, self.help),
+                 u'# TYPE %s %s' % (self.name, self.type)]
+        for suffix, labels, value in self.samples():
+            lines.append(u'%s%s%s %s' % (self.name, suffix, format_labels(labels), format_value(value)))
+        return u'\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        super(Histogram, self).__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append(('_bucket', key + (('le', format_value(bound)),), cumulative))
+                samples.append(('_sum', key, total))
+                samples.append(('_count', key, cumulative))
+        return samples
+
+
+PHASE_DURATION = Histogram('tbackup_phase_duration_seconds',
+                           'Wall time of backup and restore phases',
+                           ['phase'])
+PHASE_CPU = Counter('tbackup_phase_cpu_seconds_total',
+                    'CPU time spent in backup and restore phases',
+                    ['phase'])
+PHASE_ERRORS = Counter('tbackup_phase_errors_total',
+                       'Backup and restore phases that failed',
+                       ['phase', 'error_class'])
+PHASE_BYTES = Counter('tbackup_phase_bytes_total',
+                      'Bytes written by backup and restore phases: dumped, compressed, uploaded...',
+                      ['phase'])
+UPLOAD_THROUGHPUT = Histogram('tbackup_upload_throughput_bytes_per_second',
+                              'Throughput of backup uploads',
+                              buckets=THROUGHPUT_BUCKETS)
+UNSENT_BACKUPS = Gauge('tbackup_unsent_backups',
+                       'Local backups waiting to be sent to a server')
+SCHEDULE_LAG = Gauge('tbackup_schedule_lag_seconds',
+                     'How late the most overdue active schedule is')
+PROBE_LATENCY = Gauge('tbackup_webserver_probe_latency_seconds',
+                      'Time to connect to an online WebServer, as last probed by the process serving the metrics',
+                      ['webserver'])
+WEBSERVER_UP = Gauge('tbackup_webserver_up',
+                     'Whether the last probe of a WebServer, by the process serving the metrics, connected',
+                     ['webserver'])
+
+METRICS = [PHASE_DURATION, PHASE_CPU, PHASE_ERRORS, PHASE_BYTES, UPLOAD_THROUGHPUT,
+           UNSENT_BACKUPS, SCHEDULE_LAG, PROBE_LATENCY, WEBSERVER_UP]
+
+#phases are logged by every process (agent, workers, web) and compacted
+#after a while, so their metrics are totals of the OpLog and OpLogRollup
+#tables: the same in every process, and across restarts
+_lock = threading.Lock()
+_refreshed_at = None
+#totals of the rollups, which only change when OpLogs are compacted, and the
+#(rollups, phases compacted) they were added up at
+_rollup_groups = []
+_rollups_stamp = None
+
+def cumulative_to_buckets(cumulative, total):
+    """
+    Turns counts of values up to each bound but +Inf into counts per bucket
+
+    >>> cumulative_to_buckets([1, 3], 4)
+    [1, 2, 1]
+    """
+    return [count - previous for count, previous in zip(cumulative + [total], [0] + cumulative)]
+
+def oplog_groups():
+    """
+    Returns the totals of the OpLogs kept, grouped by phase, outcome and
+    error class, with their histogram buckets, added up by the database in
+    one query so no row is read
+    """
+    from client.models import OpLog
+
+    #uploads, whose throughput is measured as metrics.bucket_counts would
+    upload = 'phase = %s AND bytes_out IS NOT NULL AND wall_time > 0'
+    columns = ['COUNT(*)', 'SUM(wall_time)', 'SUM(cpu_time)', 'SUM(bytes_out)',
+               'SUM(CASE WHEN %s THEN 1 ELSE 0 END)' % upload,
+               'SUM(CASE WHEN %s THEN bytes_out * 1.0 / wall_time ELSE 0 END)' % upload]
+    params = [OpLog.UPLOAD, OpLog.UPLOAD]
+    for bound in PHASE_DURATION.buckets[:-1]:
+        columns.append('SUM(CASE WHEN wall_time <= %s THEN 1 ELSE 0 END)')
+        params.append(bound)
+    for bound in UPLOAD_THROUGHPUT.buckets[:-1]:
+        columns.append('SUM(CASE WHEN %s AND bytes_out <= %%s * wall_time THEN 1 ELSE 0 END)' % upload)
+        params.extend([OpLog.UPLOAD, bound])
+    cursor = connection.cursor()
+    cursor.execute('SELECT phase, outcome, error_class, %s FROM %s GROUP BY phase, outcome, error_class'
+                   % (', '.join(columns), OpLog._meta.db_table), params)
+
+    durations = len(PHASE_DURATION.buckets) - 1
+    groups = []
+    for row in cursor.fetchall():
+        phase, outcome, error_class, count, wall_time, cpu_time, bytes_out, uploads, throughput = row[:9]
+        groups.append((phase, outcome, error_class, count, wall_time, cpu_time or 0, bytes_out or 0,
+                       cumulative_to_buckets(list(row[9:9 + durations]), count),
+                       cumulative_to_buckets(list(row[9 + durations:]), uploads), throughput or 0))
+    return groups
+
+def rollup_groups():
+    """
+    Returns the totals of the OpLogRollups as oplog_groups does, added up
+    again only if OpLogs were compacted since the last call
+    """
+    global _rollup_groups, _rollups_stamp
+    from client.models import OpLogRollup
+
+    stamp = OpLogRollup.objects.aggregate(rollups=Count('pk'), compacted=Sum('count'))
+    stamp = (stamp['rollups'], stamp['compacted'])
+    if stamp == _rollups_stamp:
+        return _rollup_groups
+
+    totals = {}
+    for phase, outcome, error_class, count, wall_time, cpu_time, bytes_out, \
+            duration_buckets, throughput_buckets, throughput in OpLogRollup.objects.values_list(
+                'phase', 'outcome', 'error_class', 'count', 'wall_time', 'cpu_time', 'bytes_out',
+                'duration_buckets', 'throughput_buckets', 'throughput').iterator():
+        #rollups compacted before buckets were kept are left out of the histograms
+        duration_buckets = parse_buckets(duration_buckets)
+        throughput_buckets = parse_buckets(throughput_buckets)
+        key = (phase, outcome, error_class, duration_buckets is not None, throughput_buckets is not None)
+        total = totals.setdefault(key, [0, 0.0, 0.0, 0, None, None, 0.0])
+        total[0] += count
+        total[1] += wall_time
+        total[2] += cpu_time
+        total[3] += bytes_out
+        if duration_buckets is not None:
+            total[4] = add_buckets(total[4] or [0] * len(duration_buckets), duration_buckets)
+        if throughput_buckets is not None:
+            total[5] = add_buckets(total[5] or [0] * len(throughput_buckets), throughput_buckets)
+            total[6] += throughput
+    _rollup_groups = [key[:3] + tuple(total) for key, total in totals.items()]
+    _rollups_stamp = stamp
+    return _rollup_groups
+
+def observe_phases():
+    """
+    Sets the phase metrics from every phase logged so far: the OpLogs
+    kept and the OpLogRollups of the older ones, read in one snapshot so
+    phases being compacted meanwhile are counted once. Both are added up
+    by group, so the work doesn't grow with the phases logged
+    """
+    from client.models import OpLog
+
+    #[count per bucket, sum] of the histograms, per phase for durations
+    durations = defaultdict(lambda: [[0] * len(PHASE_DURATION.buckets), 0.0])
+    uploads = [[0] * len(UPLOAD_THROUGHPUT.buckets), 0.0]
+    cpu = defaultdict(float)
+    errors = defaultdict(int)
+    written = defaultdict(int)
+    with snapshot():
+        groups = rollup_groups() + oplog_groups()
+
+    for phase, outcome, error_class, count, wall_time, cpu_time, bytes_out, \
+            duration_buckets, throughput_buckets, throughput in groups:
+        if outcome == OpLog.ERROR:
+            errors[(phase, error_class)] += count
+        cpu[phase] += cpu_time
+        written[phase] += bytes_out
+        if duration_buckets is not None:
+            duration = durations[phase]
+            duration[0] = add_buckets(duration[0], duration_buckets)
+            duration[1] += wall_time
+        if throughput_buckets is not None:
+            uploads[0] = add_buckets(uploads[0], throughput_buckets)
+            uploads[1] += throughput
+
+    PHASE_DURATION.replace(({'phase': phase}, tuple(value)) for phase, value in durations.items())
+    PHASE_CPU.replace(({'phase': phase}, value) for phase, value in cpu.items())
+    PHASE_ERRORS.replace(({'phase': phase, 'error_class': error_class}, value)
+                         for (phase, error_class), value in errors.items())
+    PHASE_BYTES.replace(({'phase': phase}, value) for phase, value in written.items())
+    UPLOAD_THROUGHPUT.replace([({}, tuple(uploads))] if sum(uploads[0]) else [])
+
+def update_gauges():
+    """
+    Counts unsent backups, measures the schedule lag and reads the
+    health of active WebServers from this process' cache, probing the
+    stale ones in background for the next scrape
+    """
+    from client.models import Backup, Schedule, WebServer
+    from client.models.location import health
+
+    UNSENT_BACKUPS.set(Backup.objects.filter(remote_id__isnull=True).exclude(file='').count())
+    now = timezone.now()
+    overdue = Schedule.objects.filter(active=True, next_run_at__lt=now) \
+                              .order_by('next_run_at').values_list('next_run_at', flat=True).first()
+    SCHEDULE_LAG.set((now - overdue).total_seconds() if overdue else 0)
+
+    latencies = health.latest(WebServer.objects.filter(active=True), WEBSERVER_PROBE_TIMEOUT,
+                              WEBSERVER_HEALTH_TTL)
+    PROBE_LATENCY.replace(({'webserver': ws.name}, latency)
+                          for ws, latency in latencies.items() if latency is not None)
+    WEBSERVER_UP.replace(({'webserver': ws.name}, int(latency is not None))
+                         for ws, latency in latencies.items())
+
+def refresh():
+    """
+    Reads the metrics that need queries, at most once every METRICS_TTL
+    seconds whatever the scrape rate
+    """
+    global _refreshed_at
+    if _refreshed_at is not None and time.time() - _refreshed_at < METRICS_TTL:
+        return
+    observe_phases()
+    update_gauges()
+    _refreshed_at = time.time()
+
+def reset():
+    global _refreshed_at, _rollup_groups, _rollups_stamp
+    with _lock:
+        for metric in METRICS:
+            metric.clear()
+        _refreshed_at = None
+        _rollup_groups = []
+        _rollups_stamp = None
+
+def render():
+    """
+    Returns the metrics in the Prometheus text format
+    """
+    with _lock:
+        refresh()
+    return u'\n'.join(metric.render() for metric in METRICS) + u'\n'
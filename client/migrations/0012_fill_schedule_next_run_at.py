@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+from django.utils import timezone
+from dateutil import rrule
+
+from client.functions import normalize_time, to_local_naive, from_local_naive
+
+def parse_params(params):
+    #frozen copy of RRule.get_params
+    if params is None:
+        return {}
+    param_dict = []
+    for param in params.split(';'):
+        param = param.split(':')
+        if len(param) == 2:
+            values = [int(p) for p in str(param[1]).translate(None, '()[]').split(',')]
+            param_dict.append((str(param[0]), values[0] if len(values) == 1 else values))
+    return dict(param_dict)
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Fills next_run_at for existing schedules"
+        now = normalize_time(timezone.now())
+        for schedule in orm.Schedule.objects.select_related('rule'):
+            if schedule.rule is None:
+                next_run_at = schedule.initial_time if schedule.initial_time >= now else None
+            else:
+                initial_time = to_local_naive(schedule.initial_time)
+                params = parse_params(schedule.rule.params)
+                params.update({
+                    'dtstart' : initial_time,
+                    'byhour'  : initial_time.hour,
+                    'byminute': initial_time.minute,
+                })
+                rule = rrule.rrule(getattr(rrule, schedule.rule.frequency), **params)
+                next_run_at = from_local_naive(rule.after(to_local_naive(now), True))
+            orm.Schedule.objects.filter(pk=schedule.pk).update(next_run_at=next_run_at)
+
+    def backwards(self, orm):
+        "next_run_at is dropped by the previous migration"
+
+    models = {
+        'client.backup': {
+            'Meta': {'object_name': 'Backup'},
+            'destination': ('django.db.models.fields.CharField', [], {'max_length': '256', 'null': 'True', 'blank': 'True'}),
+            'file': ('django.db.models.fields.files.FileField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '256'}),
+            'origin': ('django.db.models.fields.CharField', [], {'max_length': '256', 'null': 'True', 'blank': 'True'}),
+            'remote_backup_date': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'remote_id': ('django.db.models.fields.BigIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'schedule': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['client.Schedule']", 'null': 'True', 'blank': 'True'})
+        },
+        'client.oplog': {
+            'Meta': {'object_name': 'OpLog'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'client.origin': {
+            'Meta': {'object_name': 'Origin'},
+            'auth_token': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            'remote_id': ('django.db.models.fields.BigIntegerField', [], {})
+        },
+        'client.rrule': {
+            'Meta': {'object_name': 'RRule'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'frequency': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'params': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'})
+        },
+        'client.schedule': {
+            'Meta': {'object_name': 'Schedule'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'destination': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'initial_time': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime(2026, 10, 19, 0, 0)'}),
+            'next_run_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'rule': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['client.RRule']", 'null': 'True', 'blank': 'True'})
+        },
+        'client.webserver': {
+            'Meta': {'object_name': 'WebServer'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'api_root': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            'creation_date': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '80'}),
+            'url': ('django.db.models.fields.CharField', [], {'max_length': '1024'})
+        }
+    }
+
+    complete_apps = ['client']
+    symmetrical = True
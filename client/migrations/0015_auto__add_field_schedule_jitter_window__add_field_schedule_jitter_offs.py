@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding field 'Schedule.jitter_window'
+        db.add_column(u'client_schedule', 'jitter_window',
+                      self.gf('django.db.models.fields.PositiveIntegerField')(default=0),
+                      keep_default=False)
+
+        # Adding field 'Schedule.jitter_offset'
+        db.add_column(u'client_schedule', 'jitter_offset',
+                      self.gf('django.db.models.fields.PositiveIntegerField')(default=0),
+                      keep_default=False)
+
+
+    def backwards(self, orm):
+        # Deleting field 'Schedule.jitter_window'
+        db.delete_column(u'client_schedule', 'jitter_window')
+
+        # Deleting field 'Schedule.jitter_offset'
+        db.delete_column(u'client_schedule', 'jitter_offset')
+
+
+    models = {
+        'client.agentstatus': {
+            'Meta': {'object_name': 'AgentStatus'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_tick': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'})
+        },
+        'client.backup': {
+            'Meta': {'object_name': 'Backup'},
+            'destination': ('django.db.models.fields.CharField', [], {'max_length': '256', 'null': 'True', 'blank': 'True'}),
+            'file': ('django.db.models.fields.files.FileField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '256'}),
+            'origin': ('django.db.models.fields.CharField', [], {'max_length': '256', 'null': 'True', 'blank': 'True'}),
+            'remote_backup_date': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'remote_id': ('django.db.models.fields.BigIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'schedule': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['client.Schedule']", 'null': 'True', 'blank': 'True'})
+        },
+        'client.oplog': {
+            'Meta': {'object_name': 'OpLog'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'})
+        },
+        'client.origin': {
+            'Meta': {'object_name': 'Origin'},
+            'auth_token': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            'remote_id': ('django.db.models.fields.BigIntegerField', [], {})
+        },
+        'client.rrule': {
+            'Meta': {'object_name': 'RRule'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'frequency': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'params': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'})
+        },
+        'client.schedule': {
+            'Meta': {'object_name': 'Schedule'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'destination': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'initial_time': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime(2026, 10, 19, 0, 0)'}),
+            'jitter_offset': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'jitter_window': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'next_run_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'rule': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['client.RRule']", 'null': 'True', 'blank': 'True'}),
+            'version': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'client.webserver': {
+            'Meta': {'object_name': 'WebServer'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'api_root': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            'creation_date': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '80'}),
+            'url': ('django.db.models.fields.CharField', [], {'max_length': '1024'})
+        }
+    }
+
+    complete_apps = ['client']
\ No newline at end of file
@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'OpLogRollup'
+        db.create_table(u'client_oplogrollup', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('day', self.gf('django.db.models.fields.DateField')()),
+            ('operation', self.gf('django.db.models.fields.CharField')(max_length=10)),
+            ('phase', self.gf('django.db.models.fields.CharField')(max_length=10)),
+            ('outcome', self.gf('django.db.models.fields.CharField')(max_length=5)),
+            ('count', self.gf('django.db.models.fields.PositiveIntegerField')(default=0)),
+            ('wall_time', self.gf('django.db.models.fields.FloatField')(default=0)),
+            ('cpu_time', self.gf('django.db.models.fields.FloatField')(default=0)),
+            ('bytes_in', self.gf('django.db.models.fields.BigIntegerField')(default=0)),
+            ('bytes_out', self.gf('django.db.models.fields.BigIntegerField')(default=0)),
+            ('peak_memory', self.gf('django.db.models.fields.BigIntegerField')(null=True, blank=True)),
+        ))
+        db.send_create_signal('client', ['OpLogRollup'])
+
+        # Adding unique constraint on 'OpLogRollup', fields ['day', 'operation', 'phase', 'outcome']
+        db.create_unique(u'client_oplogrollup', ['day', 'operation', 'phase', 'outcome'])
+
+        # Adding field 'OpLog.operation'
+        db.add_column(u'client_oplog', 'operation',
+                      self.gf('django.db.models.fields.CharField')(default='backup', max_length=10),
+                      keep_default=False)
+
+        # Adding field 'OpLog.finished_at'
+        db.add_column(u'client_oplog', 'finished_at',
+                      self.gf('django.db.models.fields.DateTimeField')(null=True, blank=True),
+                      keep_default=False)
+
+        # Adding field 'OpLog.outcome'
+        db.add_column(u'client_oplog', 'outcome',
+                      self.gf('django.db.models.fields.CharField')(default='ok', max_length=5),
+                      keep_default=False)
+
+        # Adding field 'OpLog.error_class'
+        db.add_column(u'client_oplog', 'error_class',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=100, blank=True),
+                      keep_default=False)
+
+        # Adding field 'OpLog.error'
+        db.add_column(u'client_oplog', 'error',
+                      self.gf('django.db.models.fields.CharField')(default='', max_length=255, blank=True),
+                      keep_default=False)
+
+        # Adding index on 'OpLog', fields ['phase', 'started_at']
+        db.create_index(u'client_oplog', ['phase', 'started_at'])
+
+        # Adding index on 'OpLog', fields ['backup', 'started_at']
+        db.create_index(u'client_oplog', ['backup_id', 'started_at'])
+
+
+    def backwards(self, orm):
+        # Removing index on 'OpLog', fields ['backup', 'started_at']
+        db.delete_index(u'client_oplog', ['backup_id', 'started_at'])
+
+        # Removing index on 'OpLog', fields ['phase', 'started_at']
+        db.delete_index(u'client_oplog', ['phase', 'started_at'])
+
+        # Removing unique constraint on 'OpLogRollup', fields ['day', 'operation', 'phase', 'outcome']
+        db.delete_unique(u'client_oplogrollup', ['day', 'operation', 'phase', 'outcome'])
+
+        # Deleting model 'OpLogRollup'
+        db.delete_table(u'client_oplogrollup')
+
+        # Deleting field 'OpLog.operation'
+        db.delete_column(u'client_oplog', 'operation')
+
+        # Deleting field 'OpLog.finished_at'
+        db.delete_column(u'client_oplog', 'finished_at')
+
+        # Deleting field 'OpLog.outcome'
+        db.delete_column(u'client_oplog', 'outcome')
+
+        # Deleting field 'OpLog.error_class'
+        db.delete_column(u'client_oplog', 'error_class')
+
+        # Deleting field 'OpLog.error'
+        db.delete_column(u'client_oplog', 'error')
+
+
+    models = {
+        'client.agentstatus': {
+            'Meta': {'object_name': 'AgentStatus'},
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_tick': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'})
+        },
+        'client.backup': {
+            'Meta': {'object_name': 'Backup'},
+            'destination': ('django.db.models.fields.CharField', [], {'max_length': '256', 'null': 'True', 'blank': 'True'}),
+            'digest': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '64', 'null': 'True', 'blank': 'True'}),
+            'dump_seconds': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'file': ('django.db.models.fields.files.FileField', [], {'max_length': '100', 'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_error': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '256'}),
+            'origin': ('django.db.models.fields.CharField', [], {'max_length': '256', 'null': 'True', 'blank': 'True'}),
+            'raw_size': ('django.db.models.fields.BigIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'remote_backup_date': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'remote_id': ('django.db.models.fields.BigIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'schedule': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['client.Schedule']", 'null': 'True', 'blank': 'True'}),
+            'size': ('django.db.models.fields.BigIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'webserver': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['client.WebServer']", 'null': 'True', 'on_delete': 'models.SET_NULL', 'blank': 'True'})
+        },
+        'client.oplog': {
+            'Meta': {'ordering': "('started_at',)", 'object_name': 'OpLog', 'index_together': "(('phase', 'started_at'), ('backup', 'started_at'))"},
+            'backup': ('django.db.models.fields.related.ForeignKey', [], {'blank': 'True', 'related_name': "'phases'", 'null': 'True', 'on_delete': 'models.SET_NULL', 'to': "orm['client.Backup']"}),
+            'bytes_in': ('django.db.models.fields.BigIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'bytes_out': ('django.db.models.fields.BigIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'cpu_time': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'error': ('django.db.models.fields.CharField', [], {'max_length': '255', 'blank': 'True'}),
+            'error_class': ('django.db.models.fields.CharField', [], {'max_length': '100', 'blank': 'True'}),
+            'finished_at': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'operation': ('django.db.models.fields.CharField', [], {'default': "'backup'", 'max_length': '10'}),
+            'outcome': ('django.db.models.fields.CharField', [], {'default': "'ok'", 'max_length': '5'}),
+            'peak_memory': ('django.db.models.fields.BigIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'phase': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'started_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'wall_time': ('django.db.models.fields.FloatField', [], {})
+        },
+        'client.oplogrollup': {
+            'Meta': {'ordering': "('day',)", 'unique_together': "(('day', 'operation', 'phase', 'outcome'),)", 'object_name': 'OpLogRollup'},
+            'bytes_in': ('django.db.models.fields.BigIntegerField', [], {'default': '0'}),
+            'bytes_out': ('django.db.models.fields.BigIntegerField', [], {'default': '0'}),
+            'count': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'cpu_time': ('django.db.models.fields.FloatField', [], {'default': '0'}),
+            'day': ('django.db.models.fields.DateField', [], {}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'operation': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'outcome': ('django.db.models.fields.CharField', [], {'max_length': '5'}),
+            'peak_memory': ('django.db.models.fields.BigIntegerField', [], {'null': 'True', 'blank': 'True'}),
+            'phase': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            'wall_time': ('django.db.models.fields.FloatField', [], {'default': '0'})
+        },
+        'client.origin': {
+            'Meta': {'object_name': 'Origin'},
+            'auth_token': ('django.db.models.fields.CharField', [], {'max_length': '64'}),
+            'email': ('django.db.models.fields.EmailField', [], {'max_length': '75', 'null': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            'remote_id': ('django.db.models.fields.BigIntegerField', [], {})
+        },
+        'client.rrule': {
+            'Meta': {'object_name': 'RRule'},
+            'description': ('django.db.models.fields.TextField', [], {}),
+            'frequency': ('django.db.models.fields.CharField', [], {'max_length': '10'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '32'}),
+            'params': ('django.db.models.fields.TextField', [], {'null': 'True', 'blank': 'True'})
+        },
+        'client.schedule': {
+            'Meta': {'object_name': 'Schedule'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'destination': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'initial_time': ('django.db.models.fields.DateTimeField', [], {'default': 'datetime.datetime(2026, 10, 19, 0, 0)'}),
+            'jitter_offset': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'jitter_window': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'next_run_at': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True', 'null': 'True', 'blank': 'True'}),
+            'rule': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['client.RRule']", 'null': 'True', 'blank': 'True'}),
+            'version': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'})
+        },
+        'client.webserver': {
+            'Meta': {'object_name': 'WebServer'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'api_root': ('django.db.models.fields.CharField', [], {'max_length': '1024'}),
+            'avg_latency': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'avg_throughput': ('django.db.models.fields.FloatField', [], {'null': 'True', 'blank': 'True'}),
+            'creation_date': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'failed_transfers': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'last_failure': ('django.db.models.fields.DateTimeField', [], {'null': 'True', 'blank': 'True'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '80'}),
+            'transfers': ('django.db.models.fields.PositiveIntegerField', [], {'default': '0'}),
+            'url': ('django.db.models.fields.CharField', [], {'max_length': '1024'})
+        }
+    }
+
+    complete_apps = ['client']
\ No newline at end of file
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from django.db import models
+
+
+class AgentStatus(models.Model):
+    #time of the last tick backup_agent completed, used to find runs
+    #missed while the agent was not running
+    last_tick = models.DateTimeField(null=True, blank=True, verbose_name=u'última execução')
+
+    class Meta:
+        app_label = 'client'
+        verbose_name = u'estado do agente'
+        verbose_name_plural = u'estado do agente'
+
+    @staticmethod
+    def instance():
+        return AgentStatus.objects.get_or_create(pk=1)[0]
+
+    def record_tick(self, dt):
+        self.last_tick = dt
+        AgentStatus.objects.filter(pk=self.pk).update(last_tick=dt)
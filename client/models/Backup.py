@@ -11,7 +11,8 @@ from django.utils.html import format_html
 from django.core.files.base import ContentFile
             
             
-from client import functions
+from client import functions, listing
+from client.storage import archive_storage
 
 from client.models.location import Origin, WebServer
 
@@ -57,21 +58,34 @@ class Backup(models.Model):
     
     #model fields
     name = models.CharField(max_length=256, verbose_name=u'nome')
-    file = models.FileField(upload_to=get_path_name, null=True, blank=True, verbose_name=u'arquivo')
+    file = models.FileField(upload_to=get_path_name, storage=archive_storage,
+                            null=True, blank=True, verbose_name=u'arquivo')
+    #SHA-256 of the archive, which names its object in archive_storage
+    digest = models.CharField(max_length=64, null=True, blank=True, editable=False, db_index=True)
     
     schedule    = models.ForeignKey('Schedule', null=True, blank=True, verbose_name=u'agendamento')
     origin      = models.CharField(max_length=256, null=True, blank=True, verbose_name=u'cliente')
     destination = models.CharField(max_length=256, null=True, blank=True, verbose_name=u'destino')
+    webserver   = models.ForeignKey('WebServer', null=True, blank=True, on_delete=models.SET_NULL,
+                                    verbose_name=u'servidor')
     
     #local_backup_date  = models.DateTimeField(null=True)
-    remote_backup_date = models.DateTimeField(null=True, blank=True, verbose_name=u'data do backup remoto')
+    remote_backup_date = models.DateTimeField(null=True, blank=True, db_index=True,
+                                              verbose_name=u'data do backup remoto')
     
     last_error = models.TextField(null=True, blank=True)
-    remote_id  = models.BigIntegerField(null=True, blank=True, verbose_name=u'id remoto')
+    remote_id  = models.BigIntegerField(null=True, blank=True, db_index=True, verbose_name=u'id remoto')
     
     #time     = models.DateTimeField()
     
-    #size        = models.BigIntegerField(null=True)
+    #size of the local archive, kept so retention doesn't stat every file
+    size        = models.BigIntegerField(null=True, blank=True, editable=False,
+                                         verbose_name=u'tamanho (bytes)')
+    #uncompressed size and duration of the dump, which estimate the next ones
+    raw_size     = models.BigIntegerField(null=True, blank=True, editable=False,
+                                          verbose_name=u'tamanho sem compressão (bytes)')
+    dump_seconds = models.FloatField(null=True, blank=True, editable=False,
+                                     verbose_name=u'duração do dump (s)')
     
     #kind = models.CharField(max_length=13,
     #                        choices=KIND_CHOICES,
@@ -97,6 +111,9 @@ class Backup(models.Model):
     class Meta:
         #app_label required when scathering models in multiple files
         app_label = 'client'
+        #pages of the backups table are ranges of the first index,
+        #and retention tiers of each destination of the second
+        index_together = (('remote_backup_date', 'id'), ('destination', 'remote_backup_date'))
         
     def __unicode__(self):
         return self.name
@@ -172,4 +189,9 @@ class Backup(models.Model):
                     'traceback': exc_traceback,
                   }
 
-        
\ No newline at end of file
+        
+
+
+#the cached JSON listing is rebuilt whenever a backup changes
+models.signals.post_save.connect(listing.invalidate, sender=Backup)
+models.signals.post_delete.connect(listing.invalidate, sender=Backup)
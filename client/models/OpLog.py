@@ -1,9 +1,114 @@
-
+# -*- coding: utf-8 -*-
 
 from django.db import models
 
 
 class OpLog(models.Model):
+    """
+    Append-only log of the phases of backups and restores, including the
+    failed ones. Rows are written in bulk by instrumentation.OpLogBuffer and,
+    once old, compacted into OpLogRollup
+    """
+    #operations and their phases
+    BACKUP  = 'backup'
+    RESTORE = 'restore'
+    OPERATION_CHOICES = (
+        (BACKUP , u'Backup'),
+        (RESTORE, u'Restauro'),
+    )
+    DUMP     = 'dump'
+    COMPRESS = 'compress'
+    ENCRYPT  = 'encrypt'
+    STORE    = 'store'
+    UPLOAD   = 'upload'
+    DOWNLOAD = 'download'
+    LOAD     = 'load'
+    PHASE_CHOICES = (
+        (DUMP    , u'Dump dos dados'),
+        (COMPRESS, u'Compressão'),
+        (ENCRYPT , u'Criptografia'),
+        (STORE   , u'Gravação local'),
+        (UPLOAD  , u'Envio'),
+        (DOWNLOAD, u'Download do restauro'),
+        (LOAD    , u'Carga do restauro'),
+    )
+    OPERATIONS = {
+        DUMP    : BACKUP,
+        COMPRESS: BACKUP,
+        ENCRYPT : BACKUP,
+        STORE   : BACKUP,
+        UPLOAD  : BACKUP,
+        DOWNLOAD: RESTORE,
+        LOAD    : RESTORE,
+    }
+    OK    = 'ok'
+    ERROR = 'error'
+    OUTCOME_CHOICES = (
+        (OK   , u'Sucesso'),
+        (ERROR, u'Erro'),
+    )
+
+    backup      = models.ForeignKey('Backup', null=True, blank=True, on_delete=models.SET_NULL,
+                                    related_name='phases', verbose_name=u'backup')
+    operation   = models.CharField(max_length=10, choices=OPERATION_CHOICES, default=BACKUP,
+                                   verbose_name=u'operação')
+    phase       = models.CharField(max_length=10, choices=PHASE_CHOICES, verbose_name=u'fase')
+    started_at  = models.DateTimeField(db_index=True, verbose_name=u'início')
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=u'fim')
+    wall_time   = models.FloatField(verbose_name=u'duração (s)')
+    cpu_time    = models.FloatField(null=True, blank=True, verbose_name=u'tempo de CPU (s)')
+    bytes_in    = models.BigIntegerField(null=True, blank=True, verbose_name=u'bytes lidos')
+    bytes_out   = models.BigIntegerField(null=True, blank=True, verbose_name=u'bytes escritos')
+    #peak resident memory of the process by the end of the phase
+    peak_memory = models.BigIntegerField(null=True, blank=True, verbose_name=u'aumento do pico de memória (bytes)')
+    outcome     = models.CharField(max_length=5, choices=OUTCOME_CHOICES, default=OK,
+                                   verbose_name=u'resultado')
+    error_class = models.CharField(max_length=100, blank=True, verbose_name=u'classe do erro')
+    error       = models.CharField(max_length=255, blank=True, verbose_name=u'erro')
+
+    class Meta:
+        app_label = 'client'
+        verbose_name = u'fase de operação'
+        verbose_name_plural = u'fases de operações'
+        ordering = ('started_at',)
+        #time ranges of a phase (stats, metrics) and the phases of a backup
+        index_together = (('phase', 'started_at'), ('backup', 'started_at'))
+
+    def __unicode__(self):
+        return u'%s: %.2fs' % (self.get_phase_display(), self.wall_time)
+
+
+class OpLogRollup(models.Model):
+    """
+    Totals of the OpLogs of a day, kept once the rows themselves are compacted.
+    The counts per bucket of the metrics histograms are kept too, so the
+    metrics don't change when rows are compacted
+    """
+    day         = models.DateField(verbose_name=u'dia')
+    operation   = models.CharField(max_length=10, choices=OpLog.OPERATION_CHOICES, verbose_name=u'operação')
+    phase       = models.CharField(max_length=10, choices=OpLog.PHASE_CHOICES, verbose_name=u'fase')
+    outcome     = models.CharField(max_length=5, choices=OpLog.OUTCOME_CHOICES, verbose_name=u'resultado')
+    error_class = models.CharField(max_length=100, blank=True, verbose_name=u'classe do erro')
+    count       = models.PositiveIntegerField(default=0, verbose_name=u'quantidade')
+    wall_time   = models.FloatField(default=0, verbose_name=u'duração total (s)')
+    cpu_time    = models.FloatField(default=0, verbose_name=u'tempo de CPU total (s)')
+    bytes_in    = models.BigIntegerField(default=0, verbose_name=u'bytes lidos')
+    bytes_out   = models.BigIntegerField(default=0, verbose_name=u'bytes escritos')
+    peak_memory = models.BigIntegerField(null=True, blank=True, verbose_name=u'aumento do pico de memória (bytes)')
+    #of metrics.PHASE_DURATION and, for uploads, metrics.UPLOAD_THROUGHPUT.
+    #Blank in rollups compacted before they were kept
+    duration_buckets   = models.CommaSeparatedIntegerField(max_length=255, blank=True,
+                                                           verbose_name=u'durações por faixa')
+    throughput_buckets = models.CommaSeparatedIntegerField(max_length=255, blank=True,
+                                                           verbose_name=u'vazões por faixa')
+    throughput         = models.FloatField(default=0, verbose_name=u'soma das vazões (bytes/s)')
+
     class Meta:
         app_label = 'client'
-    
\ No newline at end of file
+        verbose_name = u'resumo diário de operações'
+        verbose_name_plural = u'resumos diários de operações'
+        ordering = ('day',)
+        unique_together = (('day', 'operation', 'phase', 'outcome', 'error_class'),)
+
+    def __unicode__(self):
+        return u'%s %s: %d' % (self.day, self.get_phase_display(), self.count)
@@ -1,6 +1,7 @@
 
 from .Backup import Backup
-from .OpLog  import OpLog
+from .OpLog  import OpLog, OpLogRollup
+from .AgentStatus import AgentStatus
 
 from .schedule import RRule, Schedule
 from .location import Origin, WebServer
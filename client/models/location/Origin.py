@@ -17,6 +17,13 @@ class Origin(models.Model):
     def __unicode__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        super(Origin, self).save(*args, **kwargs)
+        #jitter offsets of schedules derive from the origin's identity
+        from client.models.schedule import Schedule
+        for schedule in Schedule.objects.exclude(jitter_window=0):
+            schedule.save()
+
     @staticmethod
     def instance():
         return Origin.objects.get(pk=1) if Origin.objects.exists() else None
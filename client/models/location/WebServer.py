@@ -1,14 +1,18 @@
 # -*- coding: utf-8 -*-
 import os
-import socket
 import slumber
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from client.conf.settings import (
     GET,
     POST,
+    WEBSERVER_PROBE_TIMEOUT,
+    WEBSERVER_HEALTH_TTL,
+    API_MAX_CONCURRENCY,
     #WEBSERVER_NAME,
     #WEBSERVER_URL,
     #WEBSERVER_API_URL,
@@ -16,6 +20,9 @@ from client.conf.settings import (
 )
 from client.functions import json_request
 from client.auth import HTTPTokenAuth
+from client.remote import AsyncAPI
+
+from . import health, selection
 
 DEFAULT_TOKEN = None
 try:
@@ -31,6 +38,18 @@ class WebServer(models.Model):
     active        = models.BooleanField(default=True)
     creation_date = models.DateTimeField(auto_now_add=True)
     
+    #rolling transfer statistics, used to pick the server for each upload
+    avg_latency      = models.FloatField(null=True, blank=True, editable=False,
+                                         verbose_name=u'latência média (s)')
+    avg_throughput   = models.FloatField(null=True, blank=True, editable=False,
+                                         verbose_name=u'vazão média (bytes/s)')
+    transfers        = models.PositiveIntegerField(default=0, editable=False,
+                                                   verbose_name=u'transferências')
+    failed_transfers = models.PositiveIntegerField(default=0, editable=False,
+                                                   verbose_name=u'transferências com erro')
+    last_failure     = models.DateTimeField(null=True, blank=True, editable=False,
+                                            verbose_name=u'último erro')
+    
     def __unicode__(self):
         return self.name
 
@@ -42,16 +61,60 @@ class WebServer(models.Model):
 
     @staticmethod
     def instance():
-        #gets a list of available WebServers, new first
-        webservers = WebServer.objects.filter(active=True).order_by('creation_date')
-        if webservers.count() == 0:
+        #gets a list of available WebServers
+        webservers = list(WebServer.objects.filter(active=True).order_by('creation_date'))
+        if len(webservers) == 0:
             raise Exception(_('No active WebServer. Please contact administrators'))
-        for ws in webservers:
-            #returns the first one which is online
-            if ws.is_online():
-                return ws
-        raise Exception(_('There are no online servers at the moment'))
+        #probes them concurrently and returns the fastest one which is online
+        ws = health.fastest_online(webservers, WEBSERVER_PROBE_TIMEOUT, WEBSERVER_HEALTH_TTL)
+        if ws is None:
+            raise Exception(_('There are no online servers at the moment'))
+        return ws
 
+    @staticmethod
+    def ranked(size=0):
+        """
+        Returns online WebServers, best first for transferring size bytes
+        """
+        webservers = WebServer.objects.filter(active=True).order_by('creation_date')
+        latencies = health.online(webservers, WEBSERVER_PROBE_TIMEOUT, WEBSERVER_HEALTH_TTL)
+        return selection.rank(latencies, size)
+
+    def record_transfer(self, size, seconds):
+        """
+        Updates rolling statistics after a successful transfer
+        """
+        entry = health.cached(self, WEBSERVER_HEALTH_TTL)
+        servers = WebServer.objects.filter(pk=self.pk)
+        with transaction.atomic():
+            #writing first locks the row (the whole database in sqlite, where
+            #select_for_update does nothing) until commit, so the averages
+            #below start from the ones of any concurrent transfer
+            servers.update(transfers=F('transfers') + 1)
+            current = servers.values('avg_latency', 'avg_throughput', 'transfers').get()
+            if entry is not None and entry[0] is not None:
+                current['avg_latency'] = selection.rolling_average(current['avg_latency'], entry[0])
+            if seconds > 0:
+                current['avg_throughput'] = selection.rolling_average(current['avg_throughput'], size / seconds)
+            servers.update(avg_latency=current['avg_latency'], avg_throughput=current['avg_throughput'])
+        self.avg_latency = current['avg_latency']
+        self.avg_throughput = current['avg_throughput']
+        self.transfers = current['transfers']
+
+    def record_failure(self):
+        self.failed_transfers += 1
+        self.last_failure = timezone.now()
+        WebServer.objects.filter(pk=self.pk).update(failed_transfers=F('failed_transfers') + 1,
+                                                    last_failure=self.last_failure)
+        #don't trust a cached 'online' for a server that just failed
+        health.invalidate(self)
+
+    def current_latency(self):
+        entry = health.cached(self, WEBSERVER_HEALTH_TTL)
+        if entry is None:
+            return u'-'
+        return u'%.3f' % entry[0] if entry[0] is not None else u'offline'
+    current_latency.short_description = u'latência atual (s)'
     
     #@staticmethod
     #def update_ws_info():
@@ -96,20 +159,10 @@ class WebServer(models.Model):
         """
         Checks if WebServer is online
         """
-        hostname = self.url.replace('http://', '').rpartition(':')[0].rpartition('/')[0]
-        answer = False
-        for port in (443,80, 7000, 8000):
-            try:
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.connect((hostname,port))
-                answer = True
-                break
-            except:
-                s.close()
-                continue
-        s.close()
-        
-        return answer
+        entry = health.cached(self, WEBSERVER_HEALTH_TTL)
+        if entry is not None:
+            return entry[0] is not None
+        return health.probe(self, WEBSERVER_PROBE_TIMEOUT) is not None
     
     
     def get_api(self, token=None, auth=None):
@@ -117,3 +170,6 @@ class WebServer(models.Model):
                 else HTTPTokenAuth(token) if token \
                 else HTTPTokenAuth(DEFAULT_TOKEN)
         return slumber.API(self.url, auth=_auth)
+    
+    def get_async_api(self, token=None, auth=None, max_concurrency=API_MAX_CONCURRENCY):
+        return AsyncAPI(self.get_api(token=token, auth=auth), max_concurrency)
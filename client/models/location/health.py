@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+import Queue
+import socket
+import threading
+import time
+
+from urlparse import urlparse
+
+#per-process health cache: webserver id -> (latency in seconds or None if offline, checked at)
+_cache = {}
+_lock = threading.Lock()
+#webservers being probed in background, and the threads probing them
+_probing = set()
+_threads = []
+
+def get_address(url):
+    """
+    >>> get_address('https://backup.example.com/api/')
+    ('backup.example.com', 443)
+    >>> get_address('http://127.0.0.1:7000')
+    ('127.0.0.1', 7000)
+    """
+    parsed = urlparse(url if '://' in url else 'http://%s' % url)
+    port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    return parsed.hostname, port
+
+def probe(webserver, timeout):
+    """
+    Opens a connection to webserver and caches the result.
+    Returns the latency in seconds, or None if it's unreachable
+    """
+    start = time.time()
+    try:
+        connection = socket.create_connection(get_address(webserver.url), timeout)
+        connection.close()
+        latency = time.time() - start
+    except (socket.error, ValueError):
+        latency = None
+    with _lock:
+        _cache[webserver.pk] = (latency, time.time())
+    return latency
+
+def cached(webserver, ttl):
+    """
+    Returns the cached (latency, checked_at) of webserver if it's fresh
+    """
+    entry = _cache.get(webserver.pk)
+    if entry is not None and time.time() - entry[1] < ttl:
+        return entry
+    return None
+
+def invalidate(webserver=None):
+    with _lock:
+        if webserver is None:
+            _cache.clear()
+        else:
+            _cache.pop(webserver.pk, None)
+
+def _probe_in_background(webserver, timeout, results=None):
+    def run():
+        try:
+            latency = probe(webserver, timeout)
+        finally:
+            with _lock:
+                _probing.discard(webserver.pk)
+        if results is not None:
+            results.put((webserver, latency))
+    with _lock:
+        if results is None and webserver.pk in _probing:
+            return
+        _probing.add(webserver.pk)
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    with _lock:
+        _threads[:] = [t for t in _threads if t.is_alive()] + [thread]
+
+def join(timeout=None):
+    """
+    Waits for the probes running in background to finish
+    """
+    with _lock:
+        threads = list(_threads)
+    for thread in threads:
+        thread.join(timeout)
+
+def fastest_online(webservers, timeout, ttl):
+    """
+    Returns the online webserver with the lowest latency, or None.
+    Fresh cached results are used right away and stale ones refreshed in
+    background. Without a fresh online server, all stale ones are probed
+    concurrently and the first to answer is returned, waiting no longer
+    than timeout.
+    """
+    online = []
+    stale = []
+    for ws in webservers:
+        entry = cached(ws, ttl)
+        if entry is None:
+            stale.append(ws)
+        elif entry[0] is not None:
+            online.append((entry[0], ws))
+
+    if online:
+        for ws in stale:
+            _probe_in_background(ws, timeout)
+        return min(online, key=lambda o: o[0])[1]
+
+    results = Queue.Queue()
+    for ws in stale:
+        _probe_in_background(ws, timeout, results)
+    deadline = time.time() + timeout
+    for _ in stale:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            ws, latency = results.get(timeout=remaining)
+        except Queue.Empty:
+            break
+        if latency is not None:
+            return ws
+    return None
+
+def latest(webservers, timeout, ttl):
+    """
+    Returns a dict of webserver -> latency or None if it's offline, for
+    the webservers with a cached result, without waiting: stale ones are
+    probed in background
+    """
+    latencies = {}
+    for ws in webservers:
+        entry = _cache.get(ws.pk)
+        if entry is None or time.time() - entry[1] >= ttl:
+            _probe_in_background(ws, timeout)
+        if entry is not None:
+            latencies[ws] = entry[0]
+    return latencies
+
+def online(webservers, timeout, ttl):
+    """
+    Returns a dict of online webserver -> latency, probing concurrently
+    the ones without a fresh cached result and waiting no longer than timeout
+    """
+    latencies = {}
+    stale = []
+    for ws in webservers:
+        entry = cached(ws, ttl)
+        if entry is None:
+            stale.append(ws)
+        elif entry[0] is not None:
+            latencies[ws] = entry[0]
+
+    results = Queue.Queue()
+    for ws in stale:
+        _probe_in_background(ws, timeout, results)
+    deadline = time.time() + timeout
+    for _ in stale:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            ws, latency = results.get(timeout=remaining)
+        except Queue.Empty:
+            break
+        if latency is not None:
+            latencies[ws] = latency
+    return latencies
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from datetime import timedelta
+
+from django.utils import timezone
+
+#weight of the newest sample in rolling averages
+ALPHA = 0.3
+#servers that failed a transfer this recently are only tried after the others
+FAILURE_COOLDOWN = timedelta(minutes=10)
+
+def rolling_average(average, sample):
+    if average is None:
+        return sample
+    return (1 - ALPHA) * average + ALPHA * sample
+
+def expected_time(webserver, latency, size, default_throughput):
+    throughput = webserver.avg_throughput or default_throughput
+    return latency + (float(size) / throughput if throughput else 0)
+
+def rank(latencies, size=0):
+    """
+    Orders online webservers (a dict of webserver -> latency) by the
+    expected time to transfer size bytes. Servers without throughput
+    statistics are assumed as fast as the best known one, so they get tried.
+    """
+    throughputs = [ws.avg_throughput for ws in latencies if ws.avg_throughput]
+    default_throughput = max(throughputs) if throughputs else None
+    recently = timezone.now() - FAILURE_COOLDOWN
+
+    def key(ws):
+        failed_recently = ws.last_failure is not None and ws.last_failure > recently
+        return (failed_recently, expected_time(ws, latencies[ws], size, default_throughput))
+    return sorted(latencies, key=key)
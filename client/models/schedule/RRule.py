@@ -80,7 +80,7 @@ class RRule(models.Model):
             param = param.split(':')
             if len(param) == 2:
                 param = (str(param[0]),
-                           [int(p) for p in param[1]
+                           [int(p) for p in str(param[1])
                                             .translate(None, '()[]')
                                             .split(',')])
                 if len(param[1]) == 1:
@@ -88,6 +88,13 @@ class RRule(models.Model):
                 param_dict.append(param)
         return dict(param_dict)
 
+    def save(self, *args, **kwargs):
+        super(RRule, self).save(*args, **kwargs)
+        #schedules following this rule must recompile it
+        #and recompute their next run
+        for schedule in self.schedule_set.all():
+            schedule.save()
+
     def __unicode__(self):
         """Human readable string for Rule"""
         return self.name
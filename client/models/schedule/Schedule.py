@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from datetime     import datetime
-from dateutil     import rrule
+from datetime     import datetime, timedelta
 from django.db    import models
 from django.utils import timezone
 
-from client.functions import normalize_time
+from client.conf.settings import SCHEDULE_RETRY_DELAY, SCHEDULE_MAX_RETRIES
+from client.functions import normalize_time, to_local_naive, from_local_naive, jitter_offset
+from .compiled import get_compiled, invalidate
 
 from django.utils.translation import ugettext_lazy as _
 
@@ -18,10 +19,28 @@ class Schedule(models.Model):
                                       verbose_name='repetir',
                                       help_text=u'Selecione "----" para um evento não recorrente')
     active       = models.BooleanField(default=True, verbose_name=u'ativo')
+    next_run_at  = models.DateTimeField(null=True,
+                                        blank=True,
+                                        editable=False,
+                                        db_index=True,
+                                        verbose_name=u'próxima execução')
+    jitter_window = models.PositiveIntegerField(default=0,
+                                                verbose_name=u'janela de dispersão',
+                                                help_text=u'Minutos após o horário agendado em que o '
+                                                          u'início pode ser distribuído entre clientes')
+    #minutes inside jitter_window this origin's runs are moved by
+    jitter_offset = models.PositiveIntegerField(default=0, editable=False)
+    #bumped on every save, so cached compiled rules can tell they're stale
+    version      = models.PositiveIntegerField(default=0, editable=False)
+    #runs that failed in a row, which back off the next retry
+    failures     = models.PositiveIntegerField(default=0, editable=False,
+                                               verbose_name=u'falhas seguidas')
     
     class Meta:
         app_label = 'client'
         verbose_name = u'agendamento'
+        #pages of the schedules table are ranges of this index
+        index_together = (('initial_time', 'id'),)
     
     def __unicode__(self):
         return u"%(destination)s%(rule)s@ %(initial_time)s" % {
@@ -39,32 +58,107 @@ class Schedule(models.Model):
     
     def save(self, *args, **kwargs):
         self.initial_time = normalize_time(self.initial_time)
+        self.jitter_offset = self.get_jitter_offset()
+        self.version += 1
+        self.failures = 0
+        invalidate(self.pk)
+        self.next_run_at = self.first_runtime_from(timezone.now())
         return super(Schedule, self).save(*args, **kwargs)
     
+    def get_jitter_offset(self):
+        from client.models.location import Origin
+        origin = Origin.instance()
+        if origin is None:
+            return 0
+        return jitter_offset(origin.name, self.jitter_window)
+    
+    def delete(self, *args, **kwargs):
+        invalidate(self.pk)
+        return super(Schedule, self).delete(*args, **kwargs)
+    
+    def mark_run(self, dt):
+        """
+        Moves next_run_at past dt, once the schedule has run at dt.
+        Uses a queryset update so save() doesn't recompute it from now.
+        """
+        self.next_run_at = self.next_runtime_after(dt)
+        self.failures = 0
+        Schedule.objects.filter(pk=self.pk).update(next_run_at=self.next_run_at, failures=0)
+    
+    def mark_failed(self, dt):
+        """
+        Backs off after the run at dt failed: it's retried after
+        SCHEDULE_RETRY_DELAY minutes, doubled on each failure in a row, but
+        never later than the next run. After SCHEDULE_MAX_RETRIES retries the
+        schedule just waits for its next run, so a broken one isn't retried
+        on every tick of the agent.
+        """
+        next_run = self.next_runtime_after(dt)
+        self.failures += 1
+        if self.failures > SCHEDULE_MAX_RETRIES:
+            self.failures = 0
+            self.next_run_at = next_run
+        else:
+            retry = dt + timedelta(minutes=SCHEDULE_RETRY_DELAY * 2 ** (self.failures - 1))
+            self.next_run_at = min(retry, next_run) if next_run is not None else retry
+        Schedule.objects.filter(pk=self.pk).update(next_run_at=self.next_run_at,
+                                                   failures=self.failures)
+    
     def last_runtime(self):
         return self.last_runtime_before_or_equal(timezone.now())
     
     def next_runtime(self):
         return self.next_runtime_after(timezone.now())
     
+    def first_runtime_from(self, dt):
+        """
+        Returns the first run time at or after dt
+        """
+        dt = normalize_time(dt) - self.jitter
+        if self.rule_id is not None:
+            run = from_local_naive(get_compiled(self).after(to_local_naive(dt), True))
+        else:
+            run = self.initial_time if self.initial_time >= dt else None
+        return self.shift(run)
+    
     def last_runtime_before_or_equal(self, dt):
-        if self.rule is not None:
-            return self.get_rule().before(normalize_time(dt), True)
+        dt = normalize_time(dt) - self.jitter
+        if self.rule_id is not None:
+            run = from_local_naive(get_compiled(self).before(to_local_naive(dt), True))
         else:
-            if self.initial_time <= dt:
-                return self.initial_time
-            else:
-                return None
+            run = self.initial_time if self.initial_time <= dt else None
+        return self.shift(run)
             
     def next_runtime_after(self, dt):
-        print self.rule
-        if self.rule is not None:
-            return self.get_rule().after(normalize_time(dt), False)
+        dt = normalize_time(dt) - self.jitter
+        if self.rule_id is not None:
+            run = from_local_naive(get_compiled(self).after(to_local_naive(dt), False))
+        else:
+            run = self.initial_time if self.initial_time > dt else None
+        return self.shift(run)
+    
+    def runtimes_between(self, after, before):
+        """
+        Returns all run times t where after < t <= before
+        """
+        if self.rule_id is not None:
+            runs = get_compiled(self).between(to_local_naive(normalize_time(after) - self.jitter),
+                                              to_local_naive(normalize_time(before) - self.jitter),
+                                              True)
+            runs = [self.shift(from_local_naive(r)) for r in runs]
         else:
-            if self.initial_time > dt:
-                return self.initial_time
-            else:
-                return None
+            runs = [self.shift(self.initial_time)]
+        return [r for r in runs if after < r <= before]
+    
+    @property
+    def jitter(self):
+        return timedelta(minutes=self.jitter_offset)
+    
+    def shift(self, run):
+        """
+        Moves a run time of the rule by this origin's jitter offset
+        """
+        return run + self.jitter if run is not None else None
     
     def is_runtime(self, dt):
         last_runtime_before_or_equal = self.last_runtime_before_or_equal(dt)
@@ -74,13 +168,10 @@ class Schedule(models.Model):
         return normalize_time(dt) == last_runtime_before_or_equal
         
     def get_rule(self):
-        if self.rule is not None:
-            p = {
-                'dtstart' : self.initial_time,
-                'byhour'  : self.initial_time.hour,
-                'byminute': self.initial_time.minute,
-            }
-            params = self.rule.get_params()
-            params.update(p)
-            frequency = 'rrule.%s' % self.rule.frequency
-            return rrule.rrule(eval(frequency), **params)
+        """
+        Returns the rrule in local wall-clock time, so occurrences keep
+        their local hour across DST changes. It's compiled once per
+        schedule version and cached for the process.
+        """
+        if self.rule_id is not None:
+            return get_compiled(self).rule
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+from datetime import date, datetime, time, timedelta
+from dateutil import rrule
+
+from client.functions import to_local_naive
+
+#per-process cache of compiled rules: schedule id -> CompiledRule
+_cache = {}
+
+def get_key(schedule):
+    #ids can be reused after a delete, so the version alone
+    #can't tell two schedules apart
+    return (schedule.version, schedule.initial_time, schedule.rule_id)
+
+def get_compiled(schedule):
+    """
+    Returns the CompiledRule for schedule, building it only when the
+    schedule changed (its version was bumped) since it was last compiled
+    """
+    compiled = _cache.get(schedule.pk)
+    if compiled is None or compiled.key != get_key(schedule):
+        compiled = CompiledRule(schedule)
+        if schedule.pk is not None:
+            _cache[schedule.pk] = compiled
+    return compiled
+
+def invalidate(pk):
+    _cache.pop(pk, None)
+
+
+class CompiledRule(object):
+    """
+    dateutil rrule of a Schedule, in local wall-clock time.
+
+    Lookups run on a copy of the rule anchored at the start of a period
+    shortly before the queried time, stepped a whole number of intervals
+    from dtstart, so by* filters and intervals repeat exactly as in the full
+    rule. They don't iterate from dtstart and their cost does not grow with
+    the age of the schedule.
+    """
+    def __init__(self, schedule):
+        self.key = get_key(schedule)
+        self.dtstart = to_local_naive(schedule.initial_time)
+        self.frequency = getattr(rrule, schedule.rule.frequency)
+
+        self.params = schedule.rule.get_params()
+        self.params.update({
+            'byhour'  : self.dtstart.hour,
+            'byminute': self.dtstart.minute,
+            'bysecond': 0,
+        })
+        self.rule = rrule.rrule(self.frequency, dtstart=self.dtstart, cache=True, **self.params)
+
+        #a rule only repeats identically from any period start when it has no
+        #count, which depends on where it starts
+        self.anchorable = 'count' not in self.params
+        self.interval = self.params.get('interval', 1)
+        self.wkst = self.params.get('wkst', rrule.MO.weekday)
+        if self.anchorable:
+            self._make_implicit_params_explicit()
+        self._anchored = None
+
+    def _make_implicit_params_explicit(self):
+        #rrule derives these from dtstart when they're missing,
+        #so anchored copies must carry the original values
+        p = self.params
+        if not any(k in p for k in ('byweekno', 'byyearday', 'bymonthday', 'byweekday', 'byeaster')):
+            if self.frequency == rrule.YEARLY:
+                p.setdefault('bymonth', self.dtstart.month)
+                p['bymonthday'] = self.dtstart.day
+            elif self.frequency == rrule.MONTHLY:
+                p['bymonthday'] = self.dtstart.day
+            elif self.frequency == rrule.WEEKLY:
+                p['byweekday'] = self.dtstart.weekday()
+
+    def _week_start(self, day):
+        return day - timedelta(days=(day.weekday() - self.wkst) % 7)
+
+    def _anchor(self, dt, back):
+        """
+        Start of the period back intervals before the one holding dt.
+        Periods are counted from dtstart's, so the anchored rule's
+        intervals fall where the full rule's do
+        """
+        start, day = self.dtstart.date(), dt.date()
+        if self.frequency == rrule.YEARLY:
+            n = (day.year - start.year) // self.interval - back
+            anchor = date(start.year + n * self.interval, 1, 1)
+        elif self.frequency == rrule.MONTHLY:
+            n = ((day.year - start.year) * 12 + day.month - start.month) // self.interval - back
+            month = start.month - 1 + n * self.interval
+            anchor = date(start.year + month // 12, month % 12 + 1, 1)
+        elif self.frequency == rrule.WEEKLY:
+            first = self._week_start(start)
+            n = (self._week_start(day) - first).days // 7 // self.interval - back
+            anchor = first + timedelta(weeks=n * self.interval)
+        else:
+            n = (day - start).days // self.interval - back
+            anchor = start + timedelta(days=n * self.interval)
+        return datetime.combine(anchor, time())
+
+    def _rule_for(self, dt, back=1):
+        if not self.anchorable:
+            return self.rule
+        try:
+            anchor = self._anchor(dt, back)
+        except (ValueError, OverflowError):
+            return self.rule
+        if anchor <= self.dtstart:
+            return self.rule
+        if self._anchored is None or self._anchored[0] != anchor:
+            self._anchored = (anchor, rrule.rrule(self.frequency, dtstart=anchor, cache=True, **self.params))
+        return self._anchored[1]
+
+    def before(self, dt, inc=False):
+        #filters may leave the periods just before dt empty (e.g. weekdays
+        #only, asked on a Monday morning), so the anchor is moved back
+        #twice as far each time, down to the full rule at dtstart
+        back = 1
+        while True:
+            rule = self._rule_for(dt, back)
+            result = rule.before(dt, inc)
+            if result is not None or rule is self.rule:
+                return result
+            back *= 2
+
+    def after(self, dt, inc=False):
+        return self._rule_for(dt).after(dt, inc)
+
+    def between(self, after, before, inc=False):
+        #anchoring at the start of the range keeps this proportional to the
+        #number of occurrences in it, not to the age of the schedule
+        return self._rule_for(after).between(after, before, inc)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+from django.db.models import Q
+from django.db.models.query import prefetch_related_objects
+
+from client.conf.settings import TABLE_PAGE_SIZE
+
+
+def encode_cursor(value, pk):
+    """
+    >>> encode_cursor(None, 7)
+    ',7'
+    """
+    return '%s,%d' % (value.isoformat() if hasattr(value, 'isoformat') else value or '', pk)
+
+def decode_cursor(model, field, cursor):
+    """
+    Returns the (value, pk) of a cursor made by encode_cursor,
+    or None if it's missing or malformed
+    """
+    value, _, pk = (cursor or '').rpartition(',')
+    if not pk.isdigit():
+        return None
+    try:
+        value = model._meta.get_field(field).to_python(value) if value else None
+    except Exception:
+        return None
+    return value, int(pk)
+
+
+class KeysetPage(object):
+    """
+    A page of queryset ordered by field and then pk, both descending or
+    both ascending, starting after a cursor instead of at an offset.
+
+    Each page is a range scan of an index on (field, pk), so deep pages
+    cost as much as the first one, and nothing counts the whole table.
+    Rows without field come first, so pages are the same on every database.
+    """
+    def __init__(self, queryset, field, cursor=None, size=TABLE_PAGE_SIZE, descending=True):
+        self.field = field
+        self.size = size
+        self.after = decode_cursor(queryset.model, field, cursor)
+        sign = '-' if descending else ''
+        lookup = '%s__%s' % (field, 'lt' if descending else 'gt')
+        pk_lookup = 'pk__lt' if descending else 'pk__gt'
+
+        #related rows are fetched once for the whole page, not per query below
+        prefetch = queryset._prefetch_related_lookups
+        queryset = queryset.prefetch_related(None)
+
+        rows = []
+        value, pk = self.after or (None, None)
+        if value is None and queryset.model._meta.get_field(field).null:
+            nulls = queryset.filter(**{'%s__isnull' % field: True})
+            if pk is not None:
+                nulls = nulls.filter(**{pk_lookup: pk})
+            rows = list(nulls.order_by(sign + 'pk')[:size + 1])
+        if len(rows) <= size:
+            rest = queryset.filter(**{'%s__isnull' % field: False})
+            if value is not None:
+                rest = rest.filter(Q(**{lookup: value}) | Q(**{field: value, pk_lookup: pk}))
+            rows += list(rest.order_by(sign + field, sign + 'pk')[:size + 1 - len(rows)])
+
+        self.has_next = len(rows) > size
+        self.object_list = rows[:size]
+        if prefetch:
+            prefetch_related_objects(self.object_list, prefetch)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def next_cursor(self):
+        if not self.has_next:
+            return None
+        last = self.object_list[-1]
+        return encode_cursor(getattr(last, self.field), last.pk)
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+import cProfile
+import gc
+import os
+import pstats
+import sys
+import threading
+
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.utils import timezone
+
+from client.conf.settings import PROFILE_INTERVAL, TBACKUP_DATETIME_FORMAT
+from client.instrumentation import peak_memory
+from client.storage import archive_storage
+
+#lines of the pstats and allocation reports
+REPORT_LINES = 40
+
+def profile_directory(label):
+    """
+    Directory for the profiles of a run, next to the archives
+    """
+    now = datetime.strftime(timezone.localtime(timezone.now()), TBACKUP_DATETIME_FORMAT)
+    return os.path.join(archive_storage.location, '.profiles', '%s_%s' % (now, label))
+
+def collapse(frame):
+    """
+    Returns the stack of frame as 'outermost;...;innermost', the collapsed
+    format flamegraph tools take
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename),
+                                     code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+def object_counts():
+    """
+    Counts the live objects tracked by the garbage collector, by type
+    """
+    return Counter(type(o).__name__ for o in gc.get_objects())
+
+@contextmanager
+def nothing(name):
+    yield
+
+
+class Sampler(threading.Thread):
+    """
+    Counts the stacks of every other thread, every interval seconds, so
+    threads cProfile doesn't see (upload workers) are sampled too
+    """
+    def __init__(self, interval):
+        super(Sampler, self).__init__(name='profiling sampler')
+        self.daemon = True
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            names = dict((t.ident, t.name) for t in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident != self.ident:
+                    self.stacks['%s;%s' % (names.get(ident, ident), collapse(frame))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Profiler(object):
+    """
+    Profiles phases of backups and restores into directory:
+
+        profiler = Profiler(profile_directory('backup'))
+        with profiler.phase(OpLog.DUMP):
+            ...
+
+    Each phase leaves <phase>.pstats (cProfile data of the calling thread),
+    <phase>.txt (its most expensive functions), <phase>.collapsed (sampled
+    stacks of all threads, for flamegraph.pl or speedscope) and
+    <phase>.allocations.txt (object types that grew the most, and the peak
+    memory). A phase run more than once gets numbered files.
+    """
+    def __init__(self, directory, interval=PROFILE_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.runs = Counter()
+        self.artifacts = []
+
+    @contextmanager
+    def phase(self, name):
+        profile = cProfile.Profile()
+        sampler = Sampler(self.interval)
+        before = object_counts()
+        sampler.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            self.write(name, profile, sampler.stacks, object_counts() - before)
+
+    def path(self, name, extension):
+        return os.path.join(self.directory, '%s%s' % (name, extension))
+
+    def write(self, name, profile, stacks, grown):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        self.runs[name] += 1
+        if self.runs[name] > 1:
+            name = '%s-%d' % (name, self.runs[name])
+        paths = [self.path(name, ext) for ext in ('.pstats', '.txt', '.collapsed', '.allocations.txt')]
+
+        profile.dump_stats(paths[0])
+        with open(paths[1], 'w') as f:
+            pstats.Stats(profile, stream=f).sort_stats('cumulative').print_stats(REPORT_LINES)
+        with open(paths[2], 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write('%s %d\n' % (stack, count))
+        with open(paths[3], 'w') as f:
+            f.write('process peak memory: %d bytes\n' % peak_memory())
+            f.write('objects created and still alive, by type:\n')
+            for type_name, count in grown.most_common(REPORT_LINES):
+                f.write('%10d %s\n' % (count, type_name))
+        self.artifacts.extend(paths)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+import Queue
+import sys
+import threading
+
+from collections import deque
+
+
+class Future(object):
+    """
+    Result of a call running on an AsyncAPI worker
+    """
+    def __init__(self):
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def exception(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise Queue.Empty('call did not finish in %s seconds' % timeout)
+        return self._exc_info[1] if self._exc_info else None
+
+    def result(self, timeout=None):
+        """
+        Waits for the call and returns its result, raising its exception if it failed
+        """
+        if self.exception(timeout) is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
+class AsyncResource(object):
+    """
+    Mirrors a slumber resource, but its requests run on the AsyncAPI
+    workers and return a Future:
+
+        api.backups.get(page=2).result()
+        api.backups(10).get().result()
+    """
+    def __init__(self, async_api, resource):
+        self._async_api = async_api
+        self._resource = resource
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return AsyncResource(self._async_api, getattr(self._resource, name))
+
+    def __call__(self, *args, **kwargs):
+        return AsyncResource(self._async_api, self._resource(*args, **kwargs))
+
+    def get(self, **kwargs):
+        return self._async_api.submit(self._resource.get, **kwargs)
+
+    def post(self, data=None, files=None, **kwargs):
+        return self._async_api.submit(self._resource.post, data, files, **kwargs)
+
+    def patch(self, data=None, files=None, **kwargs):
+        return self._async_api.submit(self._resource.patch, data, files, **kwargs)
+
+    def put(self, data=None, files=None, **kwargs):
+        return self._async_api.submit(self._resource.put, data, files, **kwargs)
+
+    def delete(self, **kwargs):
+        return self._async_api.submit(self._resource.delete, **kwargs)
+
+
+class AsyncAPI(object):
+    """
+    Runs requests to a WebServer API on a pool of at most max_concurrency
+    threads, so several of them can wait on the network at once.
+    Resources are reached as in slumber (api.backups, api.users(id), ...).
+
+    Workers only do I/O: they must not touch the database, whose
+    connections belong to the calling thread. Use it as a context manager,
+    or call close, to stop the workers.
+    """
+    def __init__(self, api, max_concurrency=4):
+        self.api = api
+        self.max_concurrency = max(max_concurrency, 1)
+        self._calls = Queue.Queue()
+        self._workers = []
+        self._idle = 0
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return AsyncResource(self, getattr(self.api, name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                self._idle += 1
+            call = self._calls.get()
+            with self._lock:
+                self._idle -= 1
+            if call is None:
+                return
+            future, fn, args, kwargs = call
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception:
+                future.set_exc_info(sys.exc_info())
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queues fn(*args, **kwargs) to run on a worker and returns its Future
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('AsyncAPI is closed')
+            #workers are started when none is free, up to max_concurrency
+            if self._idle <= self._calls.qsize() and len(self._workers) < self.max_concurrency:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+            future = Future()
+            self._calls.put((future, fn, args, kwargs))
+        return future
+
+    def imap(self, fn, iterable):
+        """
+        Yields fn(item) for each item, in order, while later items run
+        concurrently. At most max_concurrency calls are ahead of the
+        consumer, so results don't pile up in memory.
+        """
+        pending = deque()
+        for item in iterable:
+            pending.append(self.submit(fn, item))
+            if len(pending) >= self.max_concurrency:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def close(self):
+        """
+        Stops the workers once queued calls are done
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for worker in self._workers:
+                self._calls.put(None)
+        for worker in self._workers:
+            worker.join()
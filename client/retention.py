@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+from collections import Counter
+
+from client.conf.settings import (
+    RETENTION_KEEP_LAST,
+    RETENTION_KEEP_DAILY,
+    RETENTION_KEEP_WEEKLY,
+    RETENTION_KEEP_MONTHLY,
+    RETENTION_MAX_SIZE,
+)
+from client import listing
+from client.functions import to_local_naive
+from client.models import Backup
+
+#periods of the grandfather-father-son tiers, as keys of a local datetime
+DAY = lambda dt: dt.date()
+WEEK = lambda dt: dt.isocalendar()[:2]
+MONTH = lambda dt: (dt.year, dt.month)
+
+
+class RetentionPolicy(object):
+    """
+    Decides which local archives to delete. For each destination, it keeps
+    the keep_last most recent ones and the newest of each of the latest
+    daily, weekly and monthly periods that have a backup, so a busy
+    destination can't push a quieter one out of the tiers. Then it drops
+    the oldest until local archives take at most max_size bytes.
+
+    Only archives confirmed uploaded are pruned. Their rows are kept, with
+    an empty file, so they can still be restored from the server.
+    """
+    def __init__(self, keep_last=RETENTION_KEEP_LAST, daily=RETENTION_KEEP_DAILY,
+                 weekly=RETENTION_KEEP_WEEKLY, monthly=RETENTION_KEEP_MONTHLY,
+                 max_size=RETENTION_MAX_SIZE):
+        self.keep_last = keep_last
+        self.tiers = ((DAY, daily), (WEEK, weekly), (MONTH, monthly))
+        self.max_size = max_size
+
+    def local_backups(self):
+        return Backup.objects.exclude(file='').exclude(file__isnull=True)
+
+    def prunable(self):
+        #the newest first, over the remote_backup_date index
+        return self.local_backups() \
+                   .filter(remote_id__isnull=False, remote_backup_date__isnull=False) \
+                   .order_by('-remote_backup_date')
+
+    def destinations(self):
+        return set(self.prunable().order_by().values_list('destination', flat=True).distinct())
+
+    def newest_per_period(self, backups, period, count):
+        """
+        Returns the ids of the newest of backups in each of the latest count periods
+        """
+        kept = {}
+        if count <= 0:
+            return set()
+        for pk, date in backups.values_list('pk', 'remote_backup_date').iterator():
+            key = period(to_local_naive(date))
+            if key not in kept:
+                if len(kept) == count:
+                    break
+                kept[key] = pk
+        return set(kept.values())
+
+    def select(self):
+        """
+        Returns (id, file name, digest) of the archives to prune, oldest first
+        """
+        kept = set()
+        newest = set()
+        #each destination's over the (destination, remote_backup_date) index
+        for destination in self.destinations():
+            backups = self.prunable().filter(destination=destination)
+            newest.update(backups.values_list('pk', flat=True)[:1])
+            if self.keep_last > 0:
+                kept.update(backups.values_list('pk', flat=True)[:self.keep_last])
+            for period, count in self.tiers:
+                kept.update(self.newest_per_period(backups, period, count))
+
+        candidates = list(self.prunable().reverse().values_list('pk', 'file', 'digest'))
+        pruned = [c for c in candidates if c[0] not in kept]
+
+        if self.max_size is not None:
+            #archives with the same digest share one stored object, whose
+            #space is only freed with the last of them
+            refs = Counter()
+            sizes = {}
+            for pk, size, digest in self.local_backups().values_list('pk', 'size', 'digest'):
+                refs[digest or pk] += 1
+                sizes[digest or pk] = size or 0
+            total = sum(sizes.values())
+            for pk, name, digest in pruned:
+                refs[digest or pk] -= 1
+                if refs[digest or pk] == 0:
+                    total -= sizes[digest or pk]
+            #the newest archive of each destination is kept no matter its size
+            for pk, name, digest in candidates:
+                if total <= self.max_size:
+                    break
+                if pk in newest:
+                    continue
+                #pruning a copy of a kept archive frees nothing
+                if pk in kept and refs[digest or pk] == 1:
+                    pruned.append((pk, name, digest))
+                    refs[digest or pk] = 0
+                    total -= sizes[digest or pk]
+            order = dict((c[0], i) for i, c in enumerate(candidates))
+            pruned.sort(key=lambda p: order[p[0]])
+        return pruned
+
+    def prune(self, batch_size=100):
+        """
+        Deletes the selected archives in batches and returns how many were deleted
+        """
+        pruned = self.select()
+        storage = Backup._meta.get_field('file').storage
+        for i in xrange(0, len(pruned), batch_size):
+            batch = pruned[i:i + batch_size]
+            for pk, name, digest in batch:
+                storage.delete(name, digest)
+            Backup.objects.filter(pk__in=[p[0] for p in batch]).update(file='')
+        if pruned:
+            listing.invalidate()
+        return len(pruned)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+import time
+
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from client.models import Schedule
+
+
+def get_watermark():
+    """
+    Changes whenever schedules do: any save bumps a schedule version and
+    any insert or delete changes the count or the highest id
+    """
+    w = Schedule.objects.aggregate(count=Count('pk'),
+                                   last_id=Max('pk'),
+                                   versions=Sum('version'))
+    return (w['count'], w['last_id'], w['versions'])
+
+
+class Scheduler(object):
+    """
+    Keeps the upcoming run times of active schedules in a heap and sleeps
+    until the earliest one, instead of being started every minute.
+
+    Schedules are reloaded when they change, which is detected by polling
+    a cheap watermark every poll_interval seconds or forced by calling
+    request_reload (e.g. from a SIGHUP handler). heartbeat, if given, is
+    called on ticks that run nothing.
+    """
+    def __init__(self, run_callback, poll_interval=60, clock=timezone.now, sleep=time.sleep,
+                 heartbeat=None):
+        self.run_callback = run_callback
+        self.heartbeat = heartbeat
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self.sleep = sleep
+
+        self.heap = []
+        self.watermark = None
+        self.reload_requested = False
+        self.stopped = False
+
+    def reload(self, not_before=None):
+        """
+        Rebuilds the heap from active schedules. Run times earlier than
+        not_before (schedules still due after a failed run) are deferred to it.
+        """
+        self.watermark = get_watermark()
+        self.reload_requested = False
+        run_times = Schedule.objects.filter(active=True, next_run_at__isnull=False) \
+                                    .values_list('next_run_at', 'pk')
+        self.heap = [(max(t, not_before) if not_before else t, pk) for t, pk in run_times]
+        heapq.heapify(self.heap)
+
+    def request_reload(self, *args):
+        self.reload_requested = True
+
+    def stop(self, *args):
+        self.stopped = True
+
+    def pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due.append(heapq.heappop(self.heap)[1])
+        return due
+
+    def seconds_to_next_run(self, now):
+        seconds = self.poll_interval
+        if self.heap:
+            seconds = min(seconds, (self.heap[0][0] - now).total_seconds())
+        return max(seconds, 0)
+
+    def tick(self):
+        """
+        Runs due schedules, if any, and returns how long to sleep
+        """
+        close_old_connections()
+        now = self.clock()
+        if self.reload_requested or get_watermark() != self.watermark:
+            self.reload()
+        if self.pop_due(now):
+            self.run_callback()
+            #schedules were moved to their next run; whatever is still due
+            #failed and is retried after a poll interval
+            self.reload(not_before=now + timedelta(seconds=self.poll_interval))
+        elif self.heartbeat:
+            self.heartbeat()
+        return self.seconds_to_next_run(self.clock())
+
+    def run_forever(self):
+        self.reload()
+        while not self.stopped:
+            self.sleep(self.tick())
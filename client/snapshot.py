@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+#statements that open a read-only snapshot as the first ones of a transaction.
+#PostgreSQL waits, if needed, for a snapshot no serializable writer can
+#invalidate; InnoDB reads are repeatable by default; SQLite, which atomic
+#already BEGINs, reads the snapshot of its first SELECT and, in WAL mode,
+#lets writers go on meanwhile
+STATEMENTS = {
+    'postgresql': ['SET TRANSACTION ISOLATION LEVEL SERIALIZABLE, READ ONLY, DEFERRABLE'],
+    'mysql'     : ['START TRANSACTION WITH CONSISTENT SNAPSHOT'],
+    'sqlite'    : ['PRAGMA query_only = ON'],
+    'oracle'    : ['SET TRANSACTION READ ONLY'],
+}
+#statements that undo the connection settings of STATEMENTS, once it's over
+CLEANUP = {
+    'sqlite': ['PRAGMA query_only = OFF'],
+}
+
+@contextmanager
+def snapshot(using=DEFAULT_DB_ALIAS):
+    """
+    Runs the with block in a read-only transaction that sees the database
+    as it was when the block started, so queries made one after another
+    (e.g. dumpdata's, one per model) are consistent with each other, without
+    locking writers out. On SQLite, writers only go on if the database is
+    in WAL mode; otherwise they wait for the block to end.
+
+    Inside a transaction that's already open the block just runs in it,
+    since its isolation can't be changed anymore
+    """
+    connection = connections[using]
+    if connection.in_atomic_block:
+        yield
+        return
+    try:
+        with transaction.atomic(using=using):
+            cursor = connection.cursor()
+            for statement in STATEMENTS.get(connection.vendor, []):
+                cursor.execute(statement)
+            yield
+    finally:
+        if connection.connection is not None:
+            cursor = connection.cursor()
+            for statement in CLEANUP.get(connection.vendor, []):
+                cursor.execute(statement)
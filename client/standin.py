@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+import BaseHTTPServer
+import SocketServer
+import base64
+import cgi
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib
+import uuid
+
+from urlparse import urlparse, parse_qs
+
+import dateutil.parser
+
+#bytes read or written at a time when streaming files
+CHUNK_SIZE = 64 * 1024
+
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Local stand-in for the WebServer API, serving the endpoints the client
+    uses (backups, with ?fileformat=raw downloads, destinations and users).
+    Metadata is kept in memory and uploaded files in directory, a temporary
+    one by default.
+
+        with StandInServer(tokens=['token']) as server:
+            api = slumber.API(server.url, auth=HTTPTokenAuth('token'))
+            ...
+
+    Requests must carry one of tokens, or the basic auth credentials of one
+    of users. To mimic a real network, every request waits delay seconds,
+    bodies are streamed at most at bandwidth bytes per second, and a
+    failure_rate fraction of the requests is answered with a 503.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, tokens=(), users=(), destinations=(), page_size=10, delay=0,
+                 bandwidth=None, failure_rate=0, seed=None, directory=None,
+                 address=('127.0.0.1', 0)):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StandInHandler)
+        self.tokens = set(tokens)
+        self.users = list(users)
+        self.destinations = list(destinations)
+        self.page_size = page_size
+        self.delay = delay
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.own_directory = directory is None
+        self.directory = tempfile.mkdtemp(prefix='tbackup_standin') if directory is None else directory
+
+        self.backups = []
+        self.lock = threading.Lock()
+        #requests being answered, and the most there were at once
+        self.active = 0
+        self.max_active = 0
+        self.failures = 0
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://%s:%d' % self.server_address
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self.thread is not None:
+            self.thread.join()
+        if self.own_directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def should_fail(self):
+        with self.lock:
+            fail = self.random.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        return fail
+
+    def backup_path(self, id):
+        return os.path.join(self.directory, str(id))
+
+    def add_backup(self, name, destination, date, content=''):
+        with self.lock:
+            backup = {
+                'id': len(self.backups) + 1,
+                'name': name,
+                'destination': destination,
+                'date': date,
+            }
+            self.backups.append(backup)
+        if hasattr(content, 'read'):
+            with open(self.backup_path(backup['id']), 'wb') as f:
+                shutil.copyfileobj(content, f, CHUNK_SIZE)
+        else:
+            with open(self.backup_path(backup['id']), 'wb') as f:
+                f.write(content)
+        return dict(backup)
+
+    def read_backup(self, id):
+        with open(self.backup_path(id), 'rb') as f:
+            return f.read()
+
+    def get_backups(self, min_date=None):
+        with self.lock:
+            backups = [dict(b) for b in self.backups]
+        if min_date:
+            min_date = dateutil.parser.parse(min_date)
+            backups = [b for b in backups if dateutil.parser.parse(b['date']) >= min_date]
+        return backups
+
+    def get_user(self, **kwargs):
+        with self.lock:
+            for user in self.users:
+                if all(user.get(k) == v for k, v in kwargs.items()):
+                    return user
+        return None
+
+
+class Throttled(object):
+    """
+    Reads from or writes into stream no faster than bandwidth bytes per second
+    """
+    def __init__(self, stream, bandwidth):
+        self.stream = stream
+        self.bandwidth = bandwidth
+        self.start = time.time()
+        self.transferred = 0
+
+    def wait(self, size):
+        self.transferred += size
+        if self.bandwidth:
+            ahead = float(self.transferred) / self.bandwidth - (time.time() - self.start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.wait(len(data))
+        return data
+
+    def readline(self, size=-1):
+        data = self.stream.readline(size)
+        self.wait(len(data))
+        return data
+
+    def write(self, data):
+        #waits first, since written data reaches the peer right away
+        self.wait(len(data))
+        self.stream.write(data)
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.answer(self.get)
+
+    def do_POST(self):
+        self.answer(self.post)
+
+    def do_PATCH(self):
+        self.answer(self.patch)
+
+    def answer(self, view):
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try:
+            time.sleep(self.server.delay)
+            self.body = Throttled(self.rfile, self.server.bandwidth)
+            self.out = Throttled(self.wfile, self.server.bandwidth)
+            if self.server.should_fail():
+                return self.send_json({'detail': 'Injected failure'}, 503)
+            self.user = self.authenticate()
+            if self.user is None:
+                return self.send_json({'detail': 'Invalid token'}, 401)
+            url = urlparse(self.path)
+            path = [p for p in url.path.split('/') if p]
+            params = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+            view(path, params)
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+    def authenticate(self):
+        """
+        Returns the user of the request's credentials, an empty dict for
+        server tokens, or None if they're invalid
+        """
+        kind, _, credentials = self.headers.get('Authorization', '').partition(' ')
+        if kind == 'Token':
+            if credentials in self.server.tokens:
+                return {}
+            return self.server.get_user(auth_token=credentials)
+        if kind == 'Basic':
+            username, _, password = base64.b64decode(credentials).partition(':')
+            return self.server.get_user(username=username, password=password)
+        return None
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.body.read(length)) if length else {}
+
+    def send_json(self, data, status=200):
+        body = json.dumps(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.out.write(body)
+
+    def send_file(self, path):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.end_headers()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+                self.out.write(chunk)
+
+    def public_user(self, user):
+        return dict((k, v) for k, v in user.items() if k != 'password')
+
+    def get(self, path, params):
+        if path == ['backups']:
+            backups = self.server.get_backups(params.get('min_date'))
+            page = int(params.get('page', 1))
+            size = self.server.page_size
+            params['page'] = page + 1
+            has_next = page * size < len(backups)
+            return self.send_json({
+                'count': len(backups),
+                'next': '%s/backups/?%s' % (self.server.url, urllib.urlencode(params)) if has_next else None,
+                'previous': None,
+                'results': backups[(page - 1) * size:page * size],
+            })
+        if len(path) == 2 and path[0] == 'backups':
+            for backup in self.server.get_backups():
+                if str(backup['id']) == path[1]:
+                    if params.get('fileformat') == 'raw':
+                        return self.send_file(self.server.backup_path(backup['id']))
+                    return self.send_json(backup)
+            return self.send_json({'detail': 'Not found'}, 404)
+        if path == ['destinations']:
+            return self.send_json([{'name': d} for d in self.server.destinations])
+        if path == ['users']:
+            if params.get('query_type') == 'availability':
+                return self.send_json({'available': self.server.get_user(username=params.get('username')) is None})
+            user = self.server.get_user(username=params.get('username'))
+            return self.send_json([self.public_user(user)] if user else [])
+        self.send_json({'detail': 'Not found'}, 404)
+
+    def post(self, path, params):
+        if path == ['backups']:
+            #file parts are spooled to disk by cgi, not held in memory
+            form = cgi.FieldStorage(fp=self.body,
+                                    headers=self.headers,
+                                    environ={'REQUEST_METHOD': 'POST',
+                                             'CONTENT_TYPE': self.headers['Content-Type']})
+            backup = self.server.add_backup(form.getfirst('name'),
+                                            form.getfirst('destination'),
+                                            form.getfirst('date'),
+                                            form['file'].file if 'file' in form else '')
+            return self.send_json(backup, 201)
+        if path == ['users']:
+            user = self.read_json()
+            if self.server.get_user(username=user.get('username')) is not None:
+                return self.send_json({'username': ['Already taken']}, 400)
+            with self.server.lock:
+                user['id'] = len(self.server.users) + 1
+                user['auth_token'] = uuid.uuid4().hex
+                self.server.users.append(user)
+            return self.send_json(self.public_user(user), 201)
+        self.send_json({'detail': 'Not found'}, 404)
+
+    def patch(self, path, params):
+        if len(path) == 2 and path[0] == 'users':
+            user = self.server.get_user(id=int(path[1]))
+            if user is None or (self.user and self.user is not user):
+                return self.send_json({'detail': 'Not found'}, 404)
+            changes = self.read_json()
+            with self.server.lock:
+                user.update((k, v) for k, v in changes.items() if k in ('email', 'password'))
+            return self.send_json(self.public_user(user))
+        self.send_json({'detail': 'Not found'}, 404)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import hashlib
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+
+#where archive contents are stored, relative to the storage root
+OBJECTS_DIR = '.objects'
+#errors of file systems that can't hard link
+NO_LINKS = set(getattr(errno, code) for code in ('EPERM', 'EXDEV', 'EMLINK', 'ENOSYS', 'ENOTSUP', 'EOPNOTSUPP')
+               if hasattr(errno, code))
+
+
+def hard_link(source, link_name):
+    """
+    Hard links link_name to source. Copies would not be counted as
+    references to source, so a file system without hard links fails clearly
+    """
+    try:
+        os.link(source, link_name)
+    except AttributeError:
+        raise ImproperlyConfigured('Archives are stored as hard links, which this platform lacks')
+    except OSError as e:
+        if e.errno in NO_LINKS:
+            raise ImproperlyConfigured('Archives are stored as hard links, but %s can\'t be linked '
+                                       'to %s: %s' % (link_name, source, e.strerror))
+        raise
+
+
+class ArchiveStorage(FileSystemStorage):
+    """
+    Stores each distinct archive once, named by its SHA-256 digest under
+    OBJECTS_DIR. Files saved under any other name (e.g. the
+    <destination>/<name> of a Backup) are hard links to that object, so
+    writing the same dump twice costs no space.
+
+    The number of links to an object is its reference count: deleting a
+    file removes its link, and the object goes with the last one. The
+    storage must be on a file system that supports hard links.
+    """
+
+    def object_name(self, digest):
+        return os.path.join(OBJECTS_DIR, digest[:2], digest)
+
+    def hash(self, content):
+        sha = hashlib.sha256()
+        for chunk in content.chunks():
+            sha.update(chunk)
+        return sha.hexdigest()
+
+    def store(self, content, digest=None):
+        """
+        Stores content, unless it's already there, and returns its digest.
+        Passing the digest of content, when known, saves hashing it
+        """
+        digest = digest or self.hash(content)
+        name = self.object_name(digest)
+        if not self.exists(name):
+            #written aside and moved in place, so an object is never partial
+            tmp_name = FileSystemStorage._save(self, name + '.tmp', content)
+            os.rename(self.path(tmp_name), self.path(name))
+        return digest
+
+    def link(self, digest, name):
+        """
+        Makes name a reference to the stored object with digest.
+        Returns the name actually used, as save does
+        """
+        name = self.get_available_name(name)
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        hard_link(self.path(self.object_name(digest)), path)
+        return name
+
+    def _save(self, name, content):
+        return self.link(self.store(content), name)
+
+    def references(self, digest):
+        """
+        Returns how many files refer to the object with digest
+        """
+        try:
+            return os.stat(self.path(self.object_name(digest))).st_nlink - 1
+        except OSError:
+            return 0
+
+    def delete(self, name, digest=None):
+        """
+        Deletes the file name, and its object if no other file refers to it.
+        Passing the digest of name, when known, saves hashing it
+        """
+        path = self.path(name)
+        try:
+            links = os.stat(path).st_nlink
+        except OSError:
+            return
+        #only this file and its object are left
+        if links == 2:
+            if digest is None:
+                with self.open(name) as f:
+                    digest = self.hash(f)
+            FileSystemStorage.delete(self, self.object_name(digest))
+        FileSystemStorage.delete(self, name)
+
+
+class HashingWriter(object):
+    """
+    Writes into stream, hashing what's written as ArchiveStorage does,
+    so an archive is hashed as it's made instead of read again to be stored
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.sha = hashlib.sha256()
+
+    def write(self, data):
+        self.sha.update(data)
+        self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def hexdigest(self):
+        return self.sha.hexdigest()
+
+
+archive_storage = ArchiveStorage()
@@ -11,15 +11,16 @@ import itertools
 class BackupTable(tables.Table):
     row_number = columns.Column(empty_values=(), verbose_name='No.')
     schedule = columns.Column(empty_values=())
+    phases = columns.Column(empty_values=(), orderable=False, verbose_name=u'Fases')
     restore = columns.LinkColumn('client:restore',
                                  args=[A('pk')],
                                  orderable=False,
                                  verbose_name=u'Restaurar')
     
     def __init__(self, *args, **kwargs):
+        #number of the first row, on later pages
+        self.counter = itertools.count(kwargs.pop('start', 1))
         super(BackupTable, self).__init__(*args, **kwargs)
-        self.counter = itertools.count()
-        next(self.counter)
     
     def render_row_number(self):
         return '%d' % next(self.counter)
@@ -30,14 +31,22 @@ class BackupTable(tables.Table):
         else:
             return u'antes da restauração'
     
+    def render_phases(self, record):
+        #phases are prefetched by the view
+        return u', '.join(u'%s %.1fs' % (p.phase, p.wall_time) for p in record.phases.all())
+    
     class Meta:
         model = Backup
         fields = ('row_number',
                   'name',
                   'schedule',
                   'remote_backup_date',
+                  'size',
+                  'raw_size',
+                  'phases',
                   'restore')
-        order_by = ('-remote_backup_date')
+        #pages follow the index on (remote_backup_date, id), so their order is fixed
+        orderable = False
 
 class ScheduleTable(tables.Table):
     row_number = columns.Column(empty_values=(), verbose_name='No.')
@@ -47,9 +56,8 @@ class ScheduleTable(tables.Table):
                                  verbose_name=u'Editar')
     
     def __init__(self, *args, **kwargs):
+        self.counter = itertools.count(kwargs.pop('start', 1))
         super(ScheduleTable, self).__init__(*args, **kwargs)
-        self.counter = itertools.count()
-        next(self.counter)
         
     def render_row_number(self):
         return '%d' % next(self.counter)
@@ -60,7 +68,9 @@ class ScheduleTable(tables.Table):
                   'destination',
                   'initial_time',
                   'rule',
+                  'next_run_at',
                   'active',
                   'edit')
-        order_by = ('initial_time')
+        #pages follow the index on (initial_time, id), so their order is fixed
+        orderable = False
     
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import dateutil.parser
+
+from celery import shared_task
+
+from client.models import Backup, Origin, Schedule, WebServer
+from client.handlers import DataHandler
+from client.instrumentation import compact_oplog
+from client.jobs import Job, BACKUP, RESTORE
+from client.retention import RetentionPolicy
+
+
+@shared_task
+def dump(schedule_id=None, destination=None):
+    """
+    Dumps data into a local Backup and queues its upload
+    """
+    schedule = Schedule.objects.get(pk=schedule_id) if schedule_id else None
+    handler = DataHandler(origin=Origin.instance())
+    handler.cache_dumpdata()
+    backup = handler.create_local_backup(schedule=schedule, destination=destination)
+    upload.delay(backup.pk, handler.run_time.isoformat())
+    return backup.pk
+
+
+@shared_task
+def prune():
+    """
+    Deletes local archives the retention policy doesn't keep
+    """
+    pruned = RetentionPolicy().prune()
+    compact.delay()
+    return pruned
+
+
+@shared_task
+def compact():
+    """
+    Rolls up old OpLogs into daily totals
+    """
+    return compact_oplog()
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=60)
+def upload(self, backup_id, date=None):
+    """
+    Sends a local Backup to the server, retrying while it's unreachable
+    """
+    backup = Backup.objects.get(pk=backup_id)
+    try:
+        handler = DataHandler(origin=Origin.instance(), webserver=WebServer.instance())
+        handler.upload(backup, date=dateutil.parser.parse(date) if date else None)
+    except Exception as exc:
+        raise self.retry(exc=exc)
+    prune.delay()
+    return backup.remote_id
+
+
+@shared_task
+def backup(destination, job_id=None):
+    """
+    Backs up data to destination and sends it, reporting progress on a Job
+    """
+    with Job.get(job_id) or Job.create(BACKUP) as job:
+        handler = DataHandler(origin=Origin.instance(), webserver=WebServer.instance(), job=job)
+        handler.cache_dumpdata()
+        return handler.backup(destination=destination)
+
+
+@shared_task
+def restore(backup_id, job_id=None):
+    """
+    Backs up current data to the restored backup's destination,
+    then restores the backup, reporting progress on a Job
+    """
+    with Job.get(job_id) or Job.create(RESTORE, backup_id) as job:
+        backup = Backup.objects.get(pk=backup_id)
+        #restores from the server the backup was sent to
+        webserver = backup.webserver or WebServer.instance()
+        handler = DataHandler(origin=Origin.instance(), webserver=webserver, job=job)
+        handler.cache_dumpdata()
+        if handler.backup(destination=backup.destination):
+            return handler.restore(backup.remote_id)
+
+
+@shared_task
+def sync(min_date):
+    """
+    Fetches metadata of remote backups made since min_date
+    """
+    handler = DataHandler(origin=Origin.instance(), webserver=WebServer.instance())
+    handler.sync_backup_info(min_date=min_date)
@@ -1,21 +1,84 @@
 # -*- coding: utf-8 -*-
 
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.forms.models import modelform_factory
+from django.http import QueryDict
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings, CaptureQueriesContext
 from django.utils import timezone
 
 from .models import (
-#    Origin,
+    Backup,
+    OpLog,
+    OpLogRollup,
+    Origin,
     Schedule,
-#    WebServer,
+    WebServer,
     RRule,
 )
+from .models.schedule.compiled import get_compiled
+from .handlers import DataHandler
+from .scheduler import Scheduler
+from .beat import rrule_schedule, ScheduleBeat
+from .models.location import health, selection
+from . import tasks, destinations, listing
+from .forms import ScheduleForm
+from .remote import AsyncAPI
+from .retention import RetentionPolicy
+from . import encryption, estimator, benchmark, metrics, profiling
+from .snapshot import snapshot
+from .storage import archive_storage
+from .instrumentation import OpLogBuffer, Phase, compact_oplog
+from .jobs import Job
+from .standin import StandInServer
+from .auth import HTTPTokenAuth
+from tbackup_client.celery import app as celery_app
+from .functions import to_local_naive, from_local_naive, jitter_offset
 
-from datetime import timedelta
+from cStringIO import StringIO
+from datetime import date, datetime, timedelta
+from dateutil import rrule
+
+import errno
+import gzip
+import json
+import mock
+import os
+import pstats
+import pytz
+import requests
+import slumber
+import shutil
+import socket
+import threading
+import time
 
 PATH='/Users/gustavo/'
 #PATH='/home/gustavo.azevedo/Projects/'
 
 # Create your tests here.
+class StandInServerMixin(object):
+    """
+    Starts a StandInServer for a test case, with an Origin and a WebServer
+    to reach it, and stops it and forgets its health once the test is over
+    """
+    def start_standin(self, **options):
+        options.setdefault('tokens', ['token'])
+        health.invalidate()
+        self.server = StandInServer(**options).start()
+        self.addCleanup(health.invalidate)
+        self.addCleanup(health.join)
+        self.addCleanup(self.server.stop)
+        self.origin = Origin.objects.create(name='origin', auth_token='token', remote_id=1)
+        self.webserver = WebServer.objects.create(name='standin', url=self.server.url)
+        return self.server
+
+
 class RuleCase(TestCase):
     fixtures = ['rules.json']
     
@@ -64,4 +127,1476 @@ class RuleCase(TestCase):
     def test_is_runtime(self):
         time = self.now + timedelta(hours=1)
         self.assertTrue(self.schedule.is_runtime(time))
+
+
+class ScheduleNextRunCase(TestCase):
+    
+    def setUp(self):
+        self.daily_rule = RRule.objects.create(name=u'diário',
+                                               description=u'uma vez por dia',
+                                               frequency=RRule.DAILY)
+        self.origin = Origin.objects.create(name='origin', auth_token='token', remote_id=1)
+        
+        self.now = timezone.now()
+        self.now -= timedelta(seconds=self.now.second) + timedelta(microseconds=self.now.microsecond)
+        self.schedule = Schedule.objects.create(initial_time=self.now + timedelta(hours=1),
+                                                rule=self.daily_rule)
+    
+    def test_next_run_at_on_save(self):
+        self.assertEqual(self.schedule.next_run_at, self.now + timedelta(hours=1))
+    
+    def test_mark_run(self):
+        self.schedule.mark_run(self.now + timedelta(hours=1))
+        schedule = Schedule.objects.get(pk=self.schedule.pk)
+        self.assertEqual(schedule.next_run_at, self.now + timedelta(days=1, hours=1))
+    
+    def test_failed_runs_back_off(self):
+        run = self.now + timedelta(hours=1)
+        retries = []
+        for _ in range(6):
+            self.schedule.mark_failed(run)
+            retries.append(Schedule.objects.get(pk=self.schedule.pk).next_run_at - run)
+        self.assertEqual(retries, [timedelta(minutes=m) for m in (5, 10, 20, 40, 80)] +
+                                  [timedelta(days=1)])
+        self.assertEqual(Schedule.objects.get(pk=self.schedule.pk).failures, 0)
+        #retries never go past the next run
+        self.schedule.mark_failed(run + timedelta(days=1) - timedelta(minutes=3))
+        self.assertEqual(self.schedule.next_run_at, run + timedelta(days=1))
+        self.schedule.mark_run(run + timedelta(days=1))
+        self.assertEqual(Schedule.objects.get(pk=self.schedule.pk).failures, 0)
+    
+    def test_agent_backs_off_failed_dumps(self):
+        webserver = WebServer.objects.create(name='standin', url='http://127.0.0.1:1')
+        schedule = Schedule.objects.create(initial_time=self.now - timedelta(days=1),
+                                           rule=self.daily_rule)
+        due_at = schedule.next_run_at
+        with mock.patch.object(WebServer, 'instance', return_value=webserver), \
+             mock.patch.object(DataHandler, 'cache_dumpdata', side_effect=IOError('disk full')):
+            self.assertRaises(IOError, call_command, 'backup_agent', trigger_backups=True)
+        schedule = Schedule.objects.get(pk=schedule.pk)
+        self.assertEqual(schedule.failures, 1)
+        self.assertGreater(schedule.next_run_at, due_at)
+    
+    def test_schedules_to_run(self):
+        due = Schedule.objects.create(initial_time=self.now - timedelta(days=1),
+                                      rule=self.daily_rule)
+        Schedule.objects.filter(pk=due.pk).update(next_run_at=self.now - timedelta(minutes=5))
+        
+        schedules = DataHandler(origin=self.origin).schedules
+        self.assertIn(due, schedules)
+        self.assertNotIn(self.schedule, schedules)
+    
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_next_runtime_across_dst(self):
+        tz = pytz.timezone('America/New_York')
+        schedule = Schedule(initial_time=tz.localize(datetime(2014, 3, 1, 2, 30)),
+                            rule=self.daily_rule)
+        #2014-03-09 02:30 does not exist in New York, so it runs at 03:30 EDT
+        after = tz.localize(datetime(2014, 3, 8, 12, 0))
+        self.assertEqual(schedule.next_runtime_after(after),
+                         tz.localize(datetime(2014, 3, 9, 3, 30), is_dst=True))
+        #and it is back at 02:30 local time on the day after
+        after = tz.localize(datetime(2014, 3, 9, 12, 0), is_dst=True)
+        self.assertEqual(schedule.next_runtime_after(after),
+                         tz.localize(datetime(2014, 3, 10, 2, 30), is_dst=True))
+
+
+class CompiledRuleCase(TestCase):
+    fixtures = ['rules.json']
+    
+    def setUp(self):
+        self.initial_time = timezone.now().replace(year=2010, second=0, microsecond=0)
+    
+    def test_compiled_rule_is_cached(self):
+        schedule = Schedule.objects.create(initial_time=self.initial_time,
+                                           rule=RRule.objects.get(pk=1))
+        self.assertIs(get_compiled(schedule), get_compiled(schedule))
+    
+    def test_save_invalidates_compiled_rule(self):
+        schedule = Schedule.objects.create(initial_time=self.initial_time,
+                                           rule=RRule.objects.get(pk=1))
+        compiled = get_compiled(schedule)
+        schedule.rule = RRule.objects.get(pk=2)
+        schedule.save()
+        self.assertIsNot(get_compiled(schedule), compiled)
+        self.assertEqual(get_compiled(schedule).frequency, rrule.WEEKLY)
+    
+    def create_filtered_rules(self):
+        for frequency, params in ((RRule.DAILY, 'byweekday:[0,1,2,3,4]'),
+                                  (RRule.DAILY, 'interval:3'),
+                                  (RRule.WEEKLY, 'interval:2;byweekday:[0,3]'),
+                                  (RRule.MONTHLY, 'interval:5;bysetpos:-1;byweekday:4'),
+                                  (RRule.YEARLY, 'bymonth:2;bymonthday:29')):
+            RRule.objects.create(name=params, description=params, frequency=frequency, params=params)
+    
+    def test_filtered_lookups_stay_near_the_query(self):
+        self.create_filtered_rules()
+        weekdays = RRule.objects.get(frequency=RRule.DAILY, params='byweekday:[0,1,2,3,4]')
+        schedule = Schedule.objects.create(initial_time=self.initial_time.replace(year=2000),
+                                           rule=weekdays)
+        compiled = get_compiled(schedule)
+        #a Monday before the run: the previous one was on Friday
+        monday = datetime(2014, 6, 2, 0, 0)
+        iterations = [0]
+        real_iter = rrule.rrule._iter
+        def counting_iter(rule):
+            for occurrence in real_iter(rule):
+                iterations[0] += 1
+                yield occurrence
+        with mock.patch.object(rrule.rrule, '_iter', counting_iter):
+            self.assertEqual(compiled.before(monday).weekday(), 4)
+            self.assertLess(iterations[0], 50)
+            iterations[0] = 0
+            rrule.rrule(compiled.frequency, dtstart=compiled.dtstart, **compiled.params).before(monday)
+            self.assertGreater(iterations[0], 3000)
+    
+    def test_anchored_lookups_match_full_rule(self):
+        self.create_filtered_rules()
+        for rule in RRule.objects.all():
+            schedule = Schedule.objects.create(initial_time=self.initial_time, rule=rule)
+            compiled = get_compiled(schedule)
+            params = rule.get_params()
+            params.update(byhour=compiled.dtstart.hour, byminute=compiled.dtstart.minute)
+            full_rule = rrule.rrule(compiled.frequency, dtstart=compiled.dtstart, **params)
+            dt = to_local_naive(self.initial_time) + timedelta(days=1000)
+            for i in range(40):
+                dt += timedelta(days=11, hours=5)
+                self.assertEqual(compiled.before(dt, True), full_rule.before(dt, True), rule.name)
+                self.assertEqual(compiled.after(dt), full_rule.after(dt), rule.name)
+
+
+class SchedulerCase(TestCase):
+    
+    def setUp(self):
+        self.daily_rule = RRule.objects.create(name=u'diário',
+                                               description=u'uma vez por dia',
+                                               frequency=RRule.DAILY)
+        self.now = timezone.now().replace(second=0, microsecond=0)
+        self.schedule = Schedule.objects.create(initial_time=self.now + timedelta(hours=1),
+                                                rule=self.daily_rule)
+        self.runs = []
+        self.clock = self.now
+        self.scheduler = Scheduler(self.run_backups, poll_interval=60, clock=lambda: self.clock)
+        self.scheduler.reload()
+    
+    def run_backups(self):
+        self.runs.append(self.clock)
+        for s in Schedule.objects.filter(next_run_at__lte=self.clock):
+            s.mark_run(self.clock)
+    
+    def test_sleeps_until_poll_interval_or_next_run(self):
+        self.assertEqual(self.scheduler.tick(), 60)
+        self.clock = self.now + timedelta(minutes=59, seconds=30)
+        self.assertEqual(self.scheduler.tick(), 30)
+        self.assertEqual(self.runs, [])
+    
+    def test_runs_due_schedule_once(self):
+        self.clock = self.now + timedelta(hours=1)
+        self.scheduler.tick()
+        self.scheduler.tick()
+        self.assertEqual(self.runs, [self.now + timedelta(hours=1)])
+        self.assertEqual(self.scheduler.heap[0][0], self.now + timedelta(days=1, hours=1))
+    
+    def test_reloads_changed_schedules(self):
+        Schedule.objects.create(initial_time=self.now + timedelta(minutes=10),
+                                rule=self.daily_rule)
+        self.clock = self.now + timedelta(minutes=9, seconds=30)
+        self.assertEqual(self.scheduler.tick(), 30)
+    
+    def test_failed_run_is_retried_after_poll_interval(self):
+        self.scheduler.run_callback = lambda: self.runs.append(self.clock)
+        self.clock = self.now + timedelta(hours=1)
+        self.assertEqual(self.scheduler.tick(), 60)
+        self.assertEqual(len(self.runs), 1)
+
+
+@override_settings(TIME_ZONE='UTC')
+class MissedRunsCase(TestCase):
+    
+    def setUp(self):
+        self.daily_rule = RRule.objects.create(name=u'diário',
+                                               description=u'uma vez por dia',
+                                               frequency=RRule.DAILY)
+        self.origin = Origin.objects.create(name='origin', auth_token='token', remote_id=1)
+        self.now = timezone.now().replace(second=0, microsecond=0)
+        #ran 3 hours ago for the last time, next run is tomorrow
+        self.schedule = Schedule.objects.create(initial_time=self.now - timedelta(days=10, hours=3),
+                                                rule=self.daily_rule)
+    
+    def test_handlers_leave_schedules_alone(self):
+        DataHandler(origin=self.origin)
+        self.assertEqual(Schedule.objects.get(pk=self.schedule.pk).next_run_at, self.schedule.next_run_at)
+    
+    def test_missed_runs_are_coalesced(self):
+        handler = DataHandler(origin=self.origin)
+        handler.catch_up(self.now - timedelta(days=3, hours=1))
+        self.assertEqual(handler.missed_runs[self.schedule],
+                         [self.now - timedelta(days=d, hours=3) for d in (2, 1, 0)])
+        self.assertEqual(handler.schedules, [self.schedule])
+    
+    def test_no_catch_up_after_recent_tick(self):
+        handler = DataHandler(origin=self.origin)
+        handler.catch_up(self.now - timedelta(minutes=1))
+        self.assertEqual(handler.missed_runs, {})
+        self.assertEqual(handler.schedules, [])
+    
+    def test_no_missed_runs_before_window(self):
+        handler = DataHandler(origin=self.origin)
+        handler.catch_up(self.now - timedelta(hours=2))
+        self.assertEqual(handler.missed_runs, {})
+        self.assertEqual(handler.schedules, [])
+
+
+class TasksCase(TestCase):
+    
+    def setUp(self):
+        self.daily_rule = RRule.objects.create(name=u'diário',
+                                               description=u'uma vez por dia',
+                                               frequency=RRule.DAILY)
+        self.origin = Origin.objects.create(name='origin', auth_token='token', remote_id=1)
+        self.webserver = WebServer.objects.create(name='webserver', url='http://127.0.0.1:7000', api_root='/')
+        self.now = timezone.now().replace(second=0, microsecond=0)
+        self.schedule = Schedule.objects.create(initial_time=self.now - timedelta(days=1),
+                                                destination='destination',
+                                                rule=self.daily_rule)
+    
+    @mock.patch('client.tasks.upload.delay')
+    def test_dump(self, upload_delay):
+        backup_id = tasks.dump.delay(self.schedule.pk).get()
+        
+        backup = Backup.objects.get(pk=backup_id)
+        self.assertEqual(backup.destination, 'destination')
+        backup.file.open('rb')
+        dumped = json.loads(gzip.GzipFile(fileobj=backup.file).read())
+        backup.file.close()
+        self.assertIn('client.schedule', [o['model'] for o in dumped])
+        self.assertEqual(upload_delay.call_args[0][0], backup_id)
+        self.assertGreater(Schedule.objects.get(pk=self.schedule.pk).next_run_at, self.now)
+    
+    @mock.patch('client.tasks.upload.delay')
+    def test_upload(self, upload_delay):
+        backup_id = tasks.dump.delay(self.schedule.pk).get()
+        api = mock.MagicMock()
+        api.backups.post.return_value = {'id': 7}
+        with mock.patch.object(WebServer, 'instance', return_value=self.webserver), \
+             mock.patch.object(WebServer, 'get_api', return_value=api):
+            self.assertEqual(tasks.upload.apply(upload_delay.call_args[0]).get(), 7)
+        self.assertEqual(Backup.objects.get(pk=backup_id).remote_id, 7)
+    
+    def test_rrule_schedule_is_due(self):
+        schedule = rrule_schedule(self.schedule, nowfun=lambda: self.now)
+        is_due, next_check = schedule.is_due(self.now - timedelta(days=1, minutes=1))
+        self.assertTrue(is_due)
+        is_due, next_check = schedule.is_due(self.now)
+        self.assertFalse(is_due)
+        self.assertEqual(next_check, 300)
+    
+    def test_beat_entries_follow_schedules(self):
+        beat = ScheduleBeat(app=celery_app, lazy=True)
+        beat.setup_schedule()
+        entry = beat.schedule['schedule-%d' % self.schedule.pk]
+        self.assertEqual(entry.task, 'client.tasks.dump')
+        self.assertTrue(entry.is_due()[0])
+        
+        self.schedule.active = False
+        self.schedule.save()
+        beat.update_from_schedules()
+        self.assertNotIn('schedule-%d' % self.schedule.pk, beat.schedule)
+
+
+class JitterCase(TestCase):
+    
+    def setUp(self):
+        self.daily_rule = RRule.objects.create(name=u'diário',
+                                               description=u'uma vez por dia',
+                                               frequency=RRule.DAILY)
+        self.origin = Origin.objects.create(name='origin', auth_token='token', remote_id=1)
+        self.now = timezone.now().replace(second=0, microsecond=0)
+        self.schedule = Schedule.objects.create(initial_time=self.now + timedelta(hours=1),
+                                                rule=self.daily_rule,
+                                                jitter_window=30)
+        self.offset = timedelta(minutes=jitter_offset('origin', 30))
+    
+    def test_offset_is_stable_and_inside_window(self):
+        self.assertEqual(self.schedule.jitter, self.offset)
+        self.assertEqual(jitter_offset('origin', 30), jitter_offset('origin', 30))
+        self.assertTrue(0 <= self.schedule.jitter_offset < 30)
+    
+    def test_offsets_spread_across_window(self):
+        counts = [0] * 30
+        for i in range(3000):
+            counts[jitter_offset(u'client%d' % i, 30)] += 1
+        self.assertTrue(all(50 < c < 150 for c in counts))
+    
+    def test_runs_are_shifted(self):
+        self.assertEqual(self.schedule.next_run_at, self.now + timedelta(hours=1) + self.offset)
+        self.schedule.mark_run(self.schedule.next_run_at)
+        self.assertEqual(self.schedule.next_run_at,
+                         self.now + timedelta(days=1, hours=1) + self.offset)
+    
+    def test_pending_run_is_kept_on_save(self):
+        #inside the window, the run that is still to start must not be skipped
+        schedule = Schedule(initial_time=self.now - timedelta(days=1, minutes=1),
+                            rule=self.daily_rule,
+                            jitter_offset=20)
+        self.assertEqual(schedule.first_runtime_from(self.now),
+                         self.now - timedelta(minutes=1) + timedelta(minutes=20))
+    
+    def test_origin_change_updates_offsets(self):
+        self.origin.name = 'other'
+        self.origin.save()
+        self.assertEqual(Schedule.objects.get(pk=self.schedule.pk).jitter_offset,
+                         jitter_offset('other', 30))
+
+
+class WebServerHealthCase(TestCase):
+    
+    def setUp(self):
+        health.invalidate()
+        self.slow = WebServer.objects.create(name='slow', url='http://slow.example.com:7000', api_root='/')
+        self.fast = WebServer.objects.create(name='fast', url='https://fast.example.com/api', api_root='/')
+        self.down = WebServer.objects.create(name='down', url='http://down.example.com', api_root='/')
+        #slow and blackholed servers hang until released
+        self.hanging = set(['slow.example.com', 'down.example.com'])
+        self.release = threading.Event()
+        self.arrived = threading.Semaphore(0)
+        self.probed = []
+        self.finished = []
+    
+    def tearDown(self):
+        self.release.set()
+        health.join()
+        health.invalidate()
+    
+    def create_connection(self, address, timeout):
+        self.probed.append(address)
+        self.arrived.release()
+        if address[0] in self.hanging:
+            self.release.wait()
+        self.finished.append(address[0])
+        if address[0] == 'down.example.com':
+            raise socket.timeout()
+        return mock.Mock()
+    
+    def test_get_address(self):
+        self.assertEqual(health.get_address('http://127.0.0.1:7000'), ('127.0.0.1', 7000))
+        self.assertEqual(health.get_address('https://fast.example.com/api'), ('fast.example.com', 443))
+        self.assertEqual(health.get_address('down.example.com/api'), ('down.example.com', 80))
+    
+    def test_returns_fastest_without_waiting_for_blackholed_server(self):
+        with mock.patch.object(health.socket, 'create_connection', self.create_connection):
+            self.assertEqual(WebServer.instance(), self.fast)
+            #all three were probed at once, and the hanging ones are still at it
+            for _ in range(3):
+                self.arrived.acquire()
+            self.assertEqual(len(self.probed), 3)
+            self.assertEqual(self.finished, ['fast.example.com'])
+    
+    def test_health_is_cached(self):
+        with mock.patch.object(health.socket, 'create_connection', self.create_connection):
+            WebServer.instance()
+            self.release.set()
+            health.join()
+            probed = len(self.probed)
+            self.assertEqual(WebServer.instance(), self.fast)
+            self.assertTrue(self.slow.is_online())
+            self.assertFalse(self.down.is_online())
+            self.assertEqual(len(self.probed), probed)
+    
+    def test_no_online_server(self):
+        self.hanging.add('fast.example.com')
+        with mock.patch.object(health.socket, 'create_connection', self.create_connection):
+            self.assertIsNone(health.fastest_online([self.slow, self.fast, self.down], 0.1, 30))
+            #gave up at the timeout, without waiting for the probes
+            self.assertEqual(self.finished, [])
+
+
+class WebServerSelectionCase(TestCase):
+    
+    def setUp(self):
+        health.invalidate()
+        self.origin = Origin.objects.create(name='origin', auth_token='token', remote_id=1)
+        self.near = WebServer.objects.create(name='near', url='http://near.example.com', api_root='/',
+                                             avg_throughput=1000.0)
+        self.far = WebServer.objects.create(name='far', url='http://far.example.com', api_root='/',
+                                            avg_throughput=1000000.0)
+        self.latencies = {self.near: 0.01, self.far: 0.2}
+    
+    def test_rank_by_expected_transfer_time(self):
+        self.assertEqual(selection.rank(self.latencies, 0), [self.near, self.far])
+        self.assertEqual(selection.rank(self.latencies, 10 ** 6), [self.far, self.near])
+    
+    def test_recently_failed_server_is_tried_last(self):
+        self.far.record_failure()
+        self.assertEqual(selection.rank(self.latencies, 10 ** 6), [self.near, self.far])
+    
+    @mock.patch('client.tasks.upload.delay')
+    def test_upload_fails_over(self, upload_delay):
+        Schedule.objects.create(initial_time=timezone.now(), destination='destination')
+        backup = Backup.objects.get(pk=tasks.dump.delay(destination='destination').get())
+        
+        failing, working = mock.MagicMock(), mock.MagicMock()
+        failing.backups.post.side_effect = Exception('connection reset')
+        working.backups.post.return_value = {'id': 9}
+        apis = {self.far.pk: failing, self.near.pk: working}
+        
+        def get_api(webserver, token=None, auth=None):
+            return apis[webserver.pk]
+        
+        with mock.patch.object(health, 'online', return_value=self.latencies), \
+             mock.patch.object(WebServer, 'get_api', get_api):
+            handler = DataHandler(origin=self.origin, webserver=self.far)
+            self.assertTrue(handler.upload(backup))
+        
+        backup = Backup.objects.get(pk=backup.pk)
+        self.assertEqual((backup.remote_id, backup.webserver), (9, self.near))
+        self.assertEqual(WebServer.objects.get(pk=self.far.pk).failed_transfers, 1)
+        self.assertEqual(WebServer.objects.get(pk=self.near.pk).transfers, 1)
+    
+    def test_concurrent_transfers_are_all_averaged(self):
+        #two workers holding the same, soon stale, webserver
+        first, second = WebServer.objects.get(pk=self.near.pk), WebServer.objects.get(pk=self.near.pk)
+        first.record_transfer(2000, 1.0)
+        second.record_transfer(4000, 1.0)
+        expected = selection.rolling_average(selection.rolling_average(1000.0, 2000.0), 4000.0)
+        near = WebServer.objects.get(pk=self.near.pk)
+        self.assertAlmostEqual(near.avg_throughput, expected)
+        self.assertEqual(near.transfers, 2)
+        self.assertAlmostEqual(second.avg_throughput, expected)
+
+
+class DestinationsCacheCase(TestCase):
+    
+    def setUp(self):
+        cache.delete(destinations.CACHE_KEY)
+    
+    def tearDown(self):
+        cache.delete(destinations.CACHE_KEY)
+    
+    def test_empty_cache_waits_for_the_server(self):
+        with mock.patch.object(destinations, 'fetch', return_value=['dest1']):
+            self.assertEqual(destinations.get_destinations(), ['dest1'])
+    
+    def test_empty_cache_waits_for_a_slow_server_up_to_the_timeout(self):
+        fetched = threading.Event()
+        def fetch():
+            fetched.wait()
+            return ['dest1']
+        with mock.patch.object(destinations, 'fetch', fetch):
+            with mock.patch.object(destinations, 'WEBSERVER_PROBE_TIMEOUT', 0.05):
+                self.assertEqual(destinations.get_destinations(), [])
+            fetched.set()
+            self.wait_for_refresh()
+            self.assertEqual(destinations.get_destinations(), ['dest1'])
+    
+    def wait_for_refresh(self):
+        destinations.refresh_in_background().join()
+    
+    def test_form_says_destinations_are_loading(self):
+        fetched = threading.Event()
+        def fetch():
+            fetched.wait()
+            return ['dest1']
+        form_class = modelform_factory(Schedule, form=ScheduleForm)
+        with mock.patch.object(destinations, 'fetch', fetch):
+            with mock.patch.object(destinations, 'WEBSERVER_PROBE_TIMEOUT', 0.05):
+                form = form_class({'destination': 'dest1'})
+                self.assertFalse(form.is_valid())
+            fetched.set()
+            self.wait_for_refresh()
+        self.assertIn(u'carregados', form.non_field_errors()[0])
+        self.assertEqual(form_class().fields['destination'].choices, [('dest1', 'dest1')])
+    
+    def test_stale_destinations_are_served_while_refreshing(self):
+        cache.set(destinations.CACHE_KEY, {'destinations': ['old'], 'fetched_at': 0}, None)
+        with mock.patch.object(destinations, 'fetch', return_value=['new']):
+            with mock.patch.object(destinations, 'refresh_in_background') as refresh:
+                self.assertEqual(destinations.get_destinations(), ['old'])
+            self.assertTrue(refresh.called)
+            destinations.refresh_in_background().join()
+        self.assertEqual(destinations.get_destinations(), ['new'])
+    
+    def test_form_renders_without_server(self):
+        schedule = Schedule(destination='current')
+        with mock.patch.object(destinations, 'fetch', side_effect=Exception('offline')):
+            #built as the admin does, since ScheduleForm has no Meta.model
+            form = modelform_factory(Schedule, form=ScheduleForm)(instance=schedule)
+            self.wait_for_refresh()
+        self.assertEqual(form.fields['destination'].choices, [('current', 'current')])
+
+
+class SyncBackupInfoCase(TestCase):
+    
+    def setUp(self):
+        self.origin = Origin.objects.create(name='origin', auth_token='token', remote_id=1)
+        self.daily_rule = RRule.objects.create(name=u'diário',
+                                               description=u'uma vez por dia',
+                                               frequency=RRule.DAILY)
+        self.schedule = Schedule.objects.create(initial_time=from_local_naive(datetime(2014, 1, 1, 2, 0)),
+                                                destination='destination',
+                                                rule=self.daily_rule)
+        self.handler = DataHandler(origin=self.origin)
+        self.handler.api = mock.MagicMock()
+    
+    def remote_backup(self, id, hour=2, name=None):
+        date = from_local_naive(datetime(2014, 2, id % 28 + 1, hour))
+        return {'id': id,
+                'date': date.astimezone(pytz.utc).isoformat(),
+                'destination': 'destination',
+                'name': name or 'backup%d' % id}
+    
+    def pages(self, *pages):
+        return [{'results': page, 'next': 'next' if i < len(pages) - 1 else None}
+                for i, page in enumerate(pages)]
+    
+    def test_sync_upserts_pages(self):
+        self.handler.api.backups.get.side_effect = self.pages(
+            [self.remote_backup(1), self.remote_backup(2, hour=5)],
+            [self.remote_backup(3)])
+        self.handler.sync_backup_info(min_date='2014-02-01')
+        self.assertEqual(Backup.objects.count(), 3)
+        self.assertEqual(Backup.objects.get(remote_id=1).schedule, self.schedule)
+        self.assertIsNone(Backup.objects.get(remote_id=2).schedule)
+        
+        self.handler.api.backups.get.side_effect = self.pages(
+            [self.remote_backup(1, name='renamed'), self.remote_backup(4)])
+        self.handler.sync_backup_info(min_date='2014-02-01')
+        self.assertEqual(Backup.objects.count(), 4)
+        self.assertEqual(Backup.objects.get(remote_id=1).name, 'renamed')
+    
+    def test_queries_per_page_do_not_grow_with_page_size(self):
+        schedules = self.handler.get_schedules_by_time()
+        counts = []
+        for size in (2, 20):
+            page = [self.remote_backup(size * 100 + i) for i in range(size)]
+            with CaptureQueriesContext(connection) as queries:
+                self.handler.upsert_backups(page, schedules)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class AsyncAPICase(StandInServerMixin, TestCase):
+    
+    def setUp(self):
+        self.start_standin(destinations=['dest1', 'dest2'], page_size=10, delay=0.2)
+        self.api = self.webserver.get_api(token='token')
+    
+    def test_requests_run_concurrently_up_to_the_bound(self):
+        with AsyncAPI(self.api, max_concurrency=4) as async_api:
+            futures = [async_api.destinations.get() for _ in range(4)]
+            results = [f.result() for f in futures]
+        self.assertEqual(results, [[{'name': 'dest1'}, {'name': 'dest2'}]] * 4)
+        self.assertEqual(self.server.max_active, 4)
+        
+        self.server.max_active = 0
+        with AsyncAPI(self.api, max_concurrency=2) as async_api:
+            [f.result() for f in [async_api.destinations.get() for _ in range(6)]]
+        self.assertEqual(self.server.max_active, 2)
+    
+    def test_imap_keeps_order_and_errors_are_raised_by_result(self):
+        for i in range(25):
+            self.server.add_backup('backup%d' % i, 'dest1', '2014-02-01T02:00:00+00:00')
+        with AsyncAPI(self.api, max_concurrency=3) as async_api:
+            pages = list(async_api.imap(lambda page: self.api.backups.get(page=page)['results'], [3, 1, 2]))
+        self.assertEqual([[b['id'] for b in page][0] for page in pages], [21, 1, 11])
+        
+        bad_api = WebServer(url=self.server.url).get_api(token='wrong')
+        with AsyncAPI(bad_api) as async_api:
+            future = async_api.backups(1).get()
+            self.assertRaises(slumber.exceptions.HttpClientError, future.result)
+
+
+class RemoteOperationsCase(StandInServerMixin, TestCase):
+    
+    def setUp(self):
+        self.start_standin(page_size=10, delay=0.1)
+        self.handler = DataHandler(origin=self.origin, webserver=self.webserver)
+    
+    def test_sync_fetches_pages_concurrently(self):
+        for i in range(45):
+            self.server.add_backup('backup%d' % i, 'dest1', '2014-02-01T02:%02d:00+00:00' % i)
+        self.handler.sync_backup_info(min_date='2014-01-01T00:00:00+00:00')
+        self.assertGreater(self.server.max_active, 1)
+        self.assertEqual(Backup.objects.count(), 45)
+        self.assertEqual(set(Backup.objects.values_list('remote_id', flat=True)), set(range(1, 46)))
+    
+    def test_drain_sends_pending_backups(self):
+        for i in range(3):
+            backup = Backup.objects.create(name='local%d' % i, destination='dest1')
+            backup.file.save('local%d.gz' % i, ContentFile('contents %d' % i))
+        #already sent, so it's left alone
+        Backup.objects.create(name='sent', destination='dest1', remote_id=99)
+        
+        self.server.max_active = 0
+        self.assertEqual(self.handler.drain(), [])
+        self.assertEqual(self.server.max_active, 3)
+        
+        self.assertFalse(Backup.objects.filter(remote_id__isnull=True).exists())
+        self.assertEqual(sorted(self.server.read_backup(b['id']) for b in self.server.get_backups()),
+                         ['contents 0', 'contents 1', 'contents 2'])
+        self.assertEqual(set(Backup.objects.exclude(name='sent').values_list('webserver', flat=True)),
+                         set([self.webserver.pk]))
+        self.assertEqual(sorted(OpLog.objects.filter(phase=OpLog.UPLOAD).values_list('bytes_out', flat=True)),
+                         [10, 10, 10])
+
+
+class StandInServerCase(TestCase):
+    
+    def test_downloads_are_streamed_from_disk_under_the_bandwidth_cap(self):
+        with StandInServer(tokens=['token'], bandwidth=100 * 1024) as server:
+            server.add_backup('big', 'dest1', '2014-02-01T02:00:00+00:00', StringIO('x' * 50 * 1024))
+            self.assertEqual(os.path.getsize(server.backup_path(1)), 50 * 1024)
+            
+            start = time.time()
+            response = requests.get('%s/backups/1/?fileformat=raw' % server.url,
+                                    auth=HTTPTokenAuth('token'), stream=True)
+            content = ''.join(response.iter_content(1024))
+            self.assertGreaterEqual(time.time() - start, 0.45)
+            self.assertEqual(content, 'x' * 50 * 1024)
+        self.assertFalse(os.path.exists(server.directory))
+    
+    def test_injected_failures(self):
+        with StandInServer(tokens=['token'], destinations=['dest1'], failure_rate=1) as server:
+            api = WebServer(url=server.url).get_api(token='token')
+            self.assertRaises(slumber.exceptions.HttpServerError, api.destinations.get)
+            self.assertEqual(server.failures, 1)
+        
+        with StandInServer(tokens=['token'], destinations=['dest1'], failure_rate=0.5, seed=1) as server:
+            api = WebServer(url=server.url).get_api(token='token')
+            failures = 0
+            for _ in range(20):
+                try:
+                    api.destinations.get()
+                except slumber.exceptions.HttpServerError:
+                    failures += 1
+            self.assertEqual(failures, server.failures)
+            self.assertTrue(0 < failures < 20)
+    
+    def test_users(self):
+        with StandInServer(tokens=['token']) as server:
+            api = WebServer(url=server.url).get_api(token='token')
+            self.assertEqual(api.users.get(username='ana', query_type='availability'), {'available': True})
+            user = api.users.post({'username': 'ana', 'password': 'secret', 'email': 'ana@example.com'})
+            self.assertNotIn('password', user)
+            self.assertEqual(api.users.get(username='ana', query_type='availability'), {'available': False})
+            self.assertRaises(slumber.exceptions.HttpClientError, api.users.post, {'username': 'ana'})
+            
+            #users reach the API with their credentials or their token
+            user_api = WebServer(url=server.url).get_api(auth=('ana', 'secret'))
+            self.assertEqual(user_api.users.get(username='ana')[0]['id'], user['id'])
+            user_api.users(user['id']).patch({'email': 'new@example.com'})
+            token_api = WebServer(url=server.url).get_api(token=user['auth_token'])
+            self.assertEqual(token_api.users.get(username='ana')[0]['email'], 'new@example.com')
+            
+            wrong_api = WebServer(url=server.url).get_api(auth=('ana', 'wrong'))
+            self.assertRaises(slumber.exceptions.HttpClientError, wrong_api.users.get, username='ana')
+
+
+@override_settings(TIME_ZONE='UTC')
+class RetentionCase(TestCase):
+    
+    def setUp(self):
+        Origin.objects.create(name='origin', auth_token='token', remote_id=1)
+        #one uploaded backup a day from 2014-01-01 to 2014-03-01, a Saturday
+        self.days = [datetime(2014, 1, 1, 2, 0, tzinfo=pytz.utc) + timedelta(days=i) for i in range(60)]
+        for i, day in enumerate(self.days):
+            self.create_backup('backup%d' % i, remote_id=i + 1, remote_backup_date=day)
+        self.unsent = self.create_backup('unsent')
+    
+    def create_backup(self, name, **kwargs):
+        kwargs.setdefault('destination', 'dest')
+        backup = Backup.objects.create(name=name, size=10, **kwargs)
+        backup.file.save(name + '.gz', ContentFile('0123456789'))
+        return backup
+    
+    def local_dates(self):
+        return set(d.date() for d in Backup.objects.exclude(file='')
+                                                   .exclude(remote_backup_date=None)
+                                                   .values_list('remote_backup_date', flat=True))
+    
+    def test_gfs_tiers(self):
+        policy = RetentionPolicy(keep_last=3, daily=7, weekly=4, monthly=3, max_size=None)
+        self.assertEqual(policy.prune(batch_size=7), 50)
+        
+        expected = set(date(2014, 2, d) for d in range(23, 29)) | \
+                   set([date(2014, 3, 1), date(2014, 2, 16), date(2014, 2, 9), date(2014, 1, 31)])
+        self.assertEqual(self.local_dates(), expected)
+        #pruned rows stay, and can be restored from the server
+        self.assertEqual(Backup.objects.filter(remote_id__isnull=False).count(), 60)
+        self.assertTrue(Backup.objects.get(pk=self.unsent.pk).file)
+    
+    def test_pruned_files_are_deleted(self):
+        old = Backup.objects.get(name='backup0')
+        path = old.file.path
+        RetentionPolicy(keep_last=1, daily=0, weekly=0, monthly=0, max_size=None).prune()
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(Backup.objects.exclude(file='').count(), 2)
+    
+    def test_tiers_are_kept_per_destination(self):
+        #a quieter destination, backed up weekly, older than all of dest's backups
+        for i in range(3):
+            self.create_backup('quiet%d' % i, destination='quiet', remote_id=100 + i,
+                               remote_backup_date=datetime(2013, 12, 1 + 7 * i, 2, 0, tzinfo=pytz.utc))
+        RetentionPolicy(keep_last=1, daily=2, weekly=0, monthly=0, max_size=None).prune()
+        self.assertEqual(sorted(Backup.objects.filter(destination='quiet').exclude(file='')
+                                              .values_list('name', flat=True)),
+                         ['quiet1', 'quiet2'])
+        self.assertEqual(Backup.objects.filter(destination='dest', remote_id__isnull=False)
+                                       .exclude(file='').count(), 2)
+    
+    def test_max_size_never_prunes_unsent_or_newest(self):
+        policy = RetentionPolicy(keep_last=5, daily=0, weekly=0, monthly=0, max_size=25)
+        policy.prune()
+        self.assertEqual(self.local_dates(), set([self.days[-1].date()]))
+        self.assertTrue(Backup.objects.get(pk=self.unsent.pk).file)
+        
+        #even if the unsent archive alone is over the limit
+        RetentionPolicy(keep_last=0, daily=0, weekly=0, monthly=0, max_size=0).prune()
+        self.assertTrue(Backup.objects.get(pk=self.unsent.pk).file)
+
+
+class ArchiveStorageCase(TestCase):
+    
+    def setUp(self):
+        self.origin = Origin.objects.create(name='origin', auth_token='token', remote_id=1)
+    
+    def test_identical_files_are_stored_once(self):
+        first = archive_storage.save('dest1/a.gz', ContentFile('same contents'))
+        second = archive_storage.save('dest2/b.gz', ContentFile('same contents'))
+        digest = archive_storage.hash(ContentFile('same contents'))
+        self.assertEqual(os.stat(archive_storage.path(first)).st_ino,
+                         os.stat(archive_storage.path(second)).st_ino)
+        self.assertEqual(archive_storage.references(digest), 2)
+        
+        archive_storage.delete(first)
+        self.assertEqual(archive_storage.references(digest), 1)
+        self.assertEqual(archive_storage.open(second).read(), 'same contents')
+        archive_storage.delete(second)
+        self.assertFalse(archive_storage.exists(archive_storage.object_name(digest)))
+    
+    def test_file_systems_without_links_fail_clearly(self):
+        digest = archive_storage.store(ContentFile('contents'))
+        with mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')):
+            self.assertRaises(ImproperlyConfigured, archive_storage.link, digest, 'dest/a.gz')
+        self.assertFalse(archive_storage.exists('dest/a.gz'))
+        self.assertEqual(archive_storage.references(digest), 0)
+    
+    def test_dumps_for_several_destinations_share_their_object(self):
+        handler = DataHandler(origin=self.origin)
+        handler.contents = StringIO('dumped data')
+        first = handler.create_local_backup(destination='dest1')
+        second = handler.create_local_backup(destination='dest2')
+        self.assertEqual(first.digest, second.digest)
+        self.assertTrue(first.file.name.startswith('./dest1/'))
+        self.assertTrue(second.file.name.startswith('./dest2/'))
+        self.assertEqual(archive_storage.references(first.digest), 2)
+        
+        first.file.delete(save=False)
+        second.file.delete(save=False)
+        self.assertEqual(archive_storage.references(first.digest), 0)
+    
+    def test_identical_dumps_made_at_different_times_are_stored_once(self):
+        handlers = [DataHandler(origin=self.origin), DataHandler(origin=self.origin)]
+        for handler, now in zip(handlers, (1400000000, 1400086400)):
+            with mock.patch('gzip.time.time', return_value=now):
+                handler.cache_dumpdata()
+        first, second = [handler.create_local_backup(destination='dest1') for handler in handlers]
+        self.assertEqual(first.digest, second.digest)
+        self.assertEqual(archive_storage.references(first.digest), 2)
+        self.assertEqual(os.listdir(os.path.dirname(archive_storage.path(archive_storage.object_name(first.digest)))),
+                         [first.digest])
+    
+    def test_retention_counts_shared_objects_once(self):
+        def create_backup(name, contents, day):
+            backup = Backup(name=name, destination='dest', size=len(contents), remote_id=day,
+                            remote_backup_date=datetime(2014, 2, day, 2, 0, tzinfo=pytz.utc))
+            backup.digest = archive_storage.store(ContentFile(contents))
+            backup.file = archive_storage.link(backup.digest, 'dest/%s.gz' % name)
+            backup.save()
+            return backup
+        
+        create_backup('old', '0123456789', 1)
+        other = create_backup('other', 'abcdefghij', 2)
+        create_backup('new', '0123456789', 3)
+        
+        #old shares its object with new, so only pruning other frees space
+        RetentionPolicy(keep_last=3, daily=0, weekly=0, monthly=0, max_size=10).prune()
+        self.assertEqual(set(Backup.objects.exclude(file='').values_list('name', flat=True)),
+                         set(['old', 'new']))
+        self.assertEqual(archive_storage.references(other.digest), 0)
+
+
+class EncryptionCase(StandInServerMixin, TestCase):
+    
+    def encrypt(self, data, chunk_size=10):
+        out = StringIO()
+        writer = encryption.EncryptingWriter(out, 'secret', chunk_size=chunk_size)
+        for i in xrange(0, len(data), 7):
+            writer.write(data[i:i + 7])
+        writer.close()
+        return out.getvalue()
+    
+    def decrypt(self, archive, key='secret', piece=5):
+        decryptor = encryption.Decryptor(key)
+        return ''.join(decryptor.feed(archive[i:i + piece])
+                       for i in xrange(0, len(archive), piece)) + decryptor.finish()
+    
+    def test_round_trip_in_pieces(self):
+        data = 'x' * 95 + 'the end'
+        archive = self.encrypt(data)
+        self.assertTrue(archive.startswith(encryption.MAGIC))
+        self.assertNotIn('the end', archive)
+        self.assertEqual(self.decrypt(archive), data)
+        self.assertEqual(self.decrypt(self.encrypt('')), '')
+        #the same data never encrypts the same way
+        self.assertNotEqual(self.encrypt(data), archive)
+        #archives that aren't encrypted pass through
+        self.assertEqual(self.decrypt('\x1f\x8bplain gzip', key=None), '\x1f\x8bplain gzip')
+    
+    def test_tampering_is_detected(self):
+        archive = self.encrypt('x' * 100)
+        changed = archive[:40] + chr(ord(archive[40]) ^ 1) + archive[41:]
+        self.assertRaises(encryption.DecryptionError, self.decrypt, changed)
+        self.assertRaises(encryption.DecryptionError, self.decrypt, archive, key='wrong')
+        self.assertRaises(encryption.DecryptionError, self.decrypt, archive, key=None)
+        #cut at the end of a chunk, so only the missing final chunk tells
+        chunk = encryption.CHUNK_HEADER.size + 10 + encryption.TAG_SIZE
+        self.assertRaises(encryption.DecryptionError, self.decrypt,
+                          archive[:encryption.HEADER_SIZE + 3 * chunk])
+        self.assertRaises(encryption.DecryptionError, self.decrypt, archive + archive[-chunk:])
+    
+    def test_backup_and_restore_encrypted(self):
+        server = self.start_standin()
+        
+        handler = DataHandler(origin=self.origin, webserver=self.webserver, key='secret')
+        handler.cache_dumpdata()
+        handler.backup(destination='dest1')
+        backup = Backup.objects.get(destination='dest1')
+        sent = server.read_backup(backup.remote_id)
+        self.assertTrue(sent.startswith(encryption.MAGIC))
+        self.assertNotIn('client.origin', sent)
+        #hashed as it was written
+        backup.file.open('rb')
+        self.assertEqual(backup.digest, archive_storage.hash(backup.file))
+        backup.file.close()
+        encrypt = OpLog.objects.get(phase=OpLog.ENCRYPT)
+        self.assertEqual(encrypt.bytes_out, backup.size)
+        self.assertLess(encrypt.bytes_in, encrypt.bytes_out)
+        
+        self.assertRaises(encryption.DecryptionError,
+                          DataHandler(origin=self.origin, webserver=self.webserver, key=None).restore,
+                          backup.remote_id)
+        DataHandler(origin=self.origin, webserver=self.webserver, key='secret').restore(backup.remote_id)
+        self.assertTrue(Backup.objects.filter(destination='dest1', remote_id=backup.remote_id).exists())
+        self.assertGreater(OpLog.objects.filter(phase=OpLog.DOWNLOAD).latest('started_at').bytes_out,
+                           backup.size)
+
+
+class SnapshotCase(TransactionTestCase):
+    
+    def test_dump_reads_one_read_only_snapshot(self):
+        with CaptureQueriesContext(connection) as queries:
+            with snapshot():
+                self.assertTrue(connection.in_atomic_block)
+                with self.assertRaisesRegexp(DatabaseError, 'readonly'):
+                    Origin.objects.create(name='origin', auth_token='t', remote_id=1)
+        begin, read_only = [q['sql'] for q in queries.captured_queries[:2]]
+        self.assertIn('BEGIN', begin)
+        self.assertIn('query_only = ON', read_only)
+        #writable again once it's over
+        self.assertFalse(connection.in_atomic_block)
+        Origin.objects.create(name='origin', auth_token='t', remote_id=1)
+        
+        with mock.patch('client.handlers.snapshot', wraps=snapshot) as dump_snapshot:
+            DataHandler(origin=Origin.objects.get()).get_dumped_data()
+        self.assertEqual(dump_snapshot.call_count, 1)
+    
+    def test_open_transactions_are_left_alone(self):
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                with snapshot():
+                    pass
+        self.assertEqual(queries.captured_queries, [])
+
+
+class DumpEstimateCase(TestCase):
+    
+    def setUp(self):
+        self.origin = Origin.objects.create(name='origin', auth_token='token', remote_id=1)
+        for i in range(30):
+            rule = RRule.objects.create(name=u'regra %d' % i,
+                                        description=u'descrição da regra %d' % i,
+                                        frequency=RRule.DAILY)
+            Schedule.objects.create(initial_time=timezone.now(), destination='dest%d' % i, rule=rule)
+        self.handler = DataHandler(origin=self.origin)
+    
+    def test_estimate_is_close_to_the_dump(self):
+        estimate = estimator.estimate_dump()
+        #origin, rules and schedules, and rows of other apps such as south's
+        self.assertGreaterEqual(estimate.rows, 61)
+        self.handler.cache_dumpdata()
+        self.assertGreater(estimate.raw_size, self.handler.raw_size * 0.8)
+        self.assertLess(estimate.raw_size, self.handler.raw_size * 1.2)
+    
+    def test_past_runs_calibrate_compression_and_duration(self):
+        self.handler.cache_dumpdata()
+        backup = self.handler.create_local_backup(destination='dest')
+        ratio, throughput = estimator.history()
+        self.assertEqual(ratio, float(backup.size) / backup.raw_size)
+        self.assertEqual(throughput, backup.raw_size / backup.dump_seconds)
+        self.assertEqual(estimator.estimate_dump().compressed_size,
+                         int(estimator.estimate_dump().raw_size * ratio))
+    
+    def test_plan(self):
+        estimate = estimator.Estimate(rows=1000, raw_size=4000, compressed_size=1000, seconds=1)
+        with mock.patch.object(estimator, 'free_space', return_value=10000):
+            self.assertEqual(estimator.plan(estimate, '/', memory_limit=2000), estimator.MEMORY)
+            self.assertEqual(estimator.plan(estimate, '/', memory_limit=1000), estimator.SPILL)
+        with mock.patch.object(estimator, 'free_space', return_value=2000):
+            self.assertRaises(estimator.InsufficientSpace, estimator.plan, estimate, '/', 1000)
+        
+        with mock.patch.object(estimator, 'free_space', return_value=0):
+            self.assertRaises(estimator.InsufficientSpace, self.handler.cache_dumpdata)
+        self.assertIsNone(self.handler.contents)
+    
+    def test_plan_spills_when_memory_is_short(self):
+        estimate = estimator.Estimate(rows=1000, raw_size=4000, compressed_size=1000, seconds=1)
+        with mock.patch.object(estimator, 'free_space', return_value=10000):
+            with mock.patch.object(estimator, 'available_memory', return_value=1000):
+                self.assertEqual(estimator.plan(estimate, '/', memory_limit=2000), estimator.SPILL)
+            with mock.patch.object(estimator, 'available_memory', return_value=None):
+                self.assertEqual(estimator.plan(estimate, '/', memory_limit=2000), estimator.MEMORY)
+    
+    def test_free_space_of_a_missing_directory(self):
+        missing = os.path.join(archive_storage.location, 'not', 'created', 'yet')
+        with mock.patch.object(estimator.os, 'statvfs', wraps=os.statvfs) as statvfs:
+            self.assertGreater(estimator.free_space(missing), 0)
+        statvfs.assert_called_once_with(os.path.abspath(archive_storage.location))
+        self.assertFalse(os.path.exists(missing))
+    
+    def test_spilled_dump_has_the_same_data(self):
+        in_memory = gzip.GzipFile(fileobj=self.handler.get_dumped_data()).read()
+        spilled = self.handler.get_dumped_data(spill=True)
+        self.assertFalse(isinstance(spilled, type(StringIO())))
+        self.assertEqual(json.loads(gzip.GzipFile(fileobj=spilled, mode='rb').read()), json.loads(in_memory))
+
+
+class PhaseInstrumentationCase(TestCase):
+    
+    def setUp(self):
+        #archives outlive each test's database, so dumps are made unlike any
+        #other test's, and written to the store rather than linked
+        self.origin = Origin.objects.create(name='origin', auth_token=os.urandom(8).encode('hex'),
+                                            remote_id=1)
+        self.handler = DataHandler(origin=self.origin)
+    
+    def test_phases_of_a_local_backup(self):
+        self.handler.cache_dumpdata()
+        first = self.handler.create_local_backup(destination='dest1')
+        phases = dict((log.phase, log) for log in first.phases.all())
+        self.assertEqual(sorted(phases), sorted([OpLog.DUMP, OpLog.COMPRESS, OpLog.STORE]))
+        self.assertEqual(phases[OpLog.DUMP].bytes_out, first.raw_size)
+        self.assertEqual(phases[OpLog.COMPRESS].bytes_in, first.raw_size)
+        self.assertEqual(phases[OpLog.COMPRESS].bytes_out, first.size)
+        self.assertEqual(phases[OpLog.STORE].bytes_out, first.size)
+        self.assertAlmostEqual(phases[OpLog.DUMP].wall_time + phases[OpLog.COMPRESS].wall_time,
+                               first.dump_seconds)
+        for log in phases.values():
+            self.assertGreaterEqual(log.peak_memory, 0)
+        
+        #the dump is shared, and so is the stored archive
+        second = self.handler.create_local_backup(destination='dest2')
+        self.assertEqual([(log.phase, log.bytes_out) for log in second.phases.all()],
+                         [(OpLog.STORE, 0)])
+    
+    def test_failed_stores_are_logged(self):
+        self.handler.cache_dumpdata()
+        with mock.patch.object(archive_storage, 'link', side_effect=IOError('No space left on device')):
+            self.assertRaises(IOError, self.handler.create_local_backup, destination='dest1')
+        logs = dict((log.phase, log) for log in OpLog.objects.all())
+        self.assertEqual(sorted(logs), sorted([OpLog.DUMP, OpLog.COMPRESS, OpLog.STORE]))
+        self.assertEqual((logs[OpLog.STORE].outcome, logs[OpLog.STORE].error_class),
+                         (OpLog.ERROR, 'IOError'))
+        self.assertEqual(logs[OpLog.DUMP].outcome, OpLog.OK)
+    
+    def test_handlers_keep_their_own_logs(self):
+        other = DataHandler(origin=self.origin)
+        self.handler.oplog_buffer.add(Phase(OpLog.UPLOAD).oplog())
+        self.assertEqual(other.oplog_buffer.flush(), 0)
+        self.assertEqual(OpLog.objects.count(), 0)
+    
+    def test_peak_memory_is_what_the_phase_added(self):
+        phase = Phase(OpLog.DUMP)
+        #the process' high-water mark, before and after each with block
+        with mock.patch('client.instrumentation.peak_memory', side_effect=[1000, 5000, 5000, 7000]):
+            with phase:
+                pass
+            with phase:
+                pass
+        self.assertEqual(phase.peak_memory, 6000)
+    
+    def test_stats_command_prints_percentiles(self):
+        now = timezone.now()
+        for i in range(10):
+            OpLog.objects.create(phase=OpLog.UPLOAD, started_at=now - timedelta(hours=i),
+                                 wall_time=i + 1, cpu_time=0.5, bytes_out=100, peak_memory=1024)
+        #too old to be included
+        OpLog.objects.create(phase=OpLog.DUMP, started_at=now - timedelta(days=60), wall_time=1)
+        
+        out = StringIO()
+        call_command('backup_stats', by='all', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1].split(), ['all', 'upload', '10', '5.00/9.00/10.00', '0.50', '100', '1024'])
+
+
+class OpLogCase(StandInServerMixin, TestCase):
+    
+    def test_buffered_logs_are_written_in_one_query(self):
+        oplog_buffer = OpLogBuffer()
+        phase = Phase(OpLog.UPLOAD)
+        for _ in range(3):
+            with phase:
+                pass
+            oplog_buffer.add(phase.oplog())
+        self.assertEqual(OpLog.objects.count(), 0)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(oplog_buffer.flush(), 3)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(oplog_buffer.flush(), 0)
+        log = OpLog.objects.all()[0]
+        self.assertEqual((log.operation, log.outcome), (OpLog.BACKUP, OpLog.OK))
+        self.assertGreaterEqual(log.finished_at, log.started_at)
+    
+    def test_failed_uploads_are_logged(self):
+        self.start_standin(failure_rate=1)
+        backup = Backup.objects.create(name='local', destination='dest1')
+        backup.file.save('local.gz', ContentFile('contents'))
+        handler = DataHandler(origin=self.origin, webserver=self.webserver)
+        self.assertEqual(handler.drain(), [backup])
+        
+        #the concurrent attempt and the retry
+        logs = OpLog.objects.filter(backup=backup)
+        self.assertEqual(len(logs), 2)
+        for log in logs:
+            self.assertEqual((log.phase, log.outcome, log.error_class),
+                             (OpLog.UPLOAD, OpLog.ERROR, 'HttpServerError'))
+            self.assertIn('503', log.error)
+    
+    def test_old_logs_are_rolled_up(self):
+        now = timezone.now()
+        old = now - timedelta(days=100)
+        for i in range(3):
+            OpLog.objects.create(phase=OpLog.DUMP, started_at=old, wall_time=1,
+                                 bytes_out=10, peak_memory=100 * (i + 1))
+        OpLog.objects.create(phase=OpLog.DOWNLOAD, operation=OpLog.RESTORE, started_at=old,
+                             wall_time=2, outcome=OpLog.ERROR, error_class='IOError')
+        recent = OpLog.objects.create(phase=OpLog.DUMP, started_at=now, wall_time=1)
+        
+        self.assertEqual(compact_oplog(days=90, batch_size=3), 4)
+        self.assertEqual(list(OpLog.objects.all()), [recent])
+        day = to_local_naive(old).date()
+        dumps = OpLogRollup.objects.get(day=day, phase=OpLog.DUMP, outcome=OpLog.OK)
+        self.assertEqual((dumps.operation, dumps.count, dumps.wall_time, dumps.bytes_out, dumps.peak_memory),
+                         (OpLog.BACKUP, 3, 3, 30, 300))
+        self.assertEqual(OpLogRollup.objects.get(day=day, phase=OpLog.DOWNLOAD).outcome, OpLog.ERROR)
+        
+        #later compactions add to the totals of the day
+        OpLog.objects.create(phase=OpLog.DUMP, started_at=old, wall_time=1, bytes_out=10)
+        self.assertEqual(compact_oplog(days=90), 1)
+        self.assertEqual(OpLogRollup.objects.get(pk=dumps.pk).count, 4)
+        self.assertEqual(compact_oplog(days=90), 0)
+
+
+class ProfilingCase(StandInServerMixin, TestCase):
+    
+    def setUp(self):
+        self.start_standin()
+        self.directory = profiling.profile_directory('test')
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+    
+    def test_phases_of_a_backup_are_profiled(self):
+        profiler = profiling.Profiler(self.directory, interval=0.001)
+        handler = DataHandler(origin=self.origin, webserver=self.webserver, profiler=profiler)
+        handler.cache_dumpdata()
+        handler.backup(destination='dest1')
+        handler.backup(destination='dest2')
+        
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted('%s%s' % (phase, ext)
+                                for phase in ('dump', 'store', 'store-2', 'upload', 'upload-2')
+                                for ext in ('.pstats', '.txt', '.collapsed', '.allocations.txt')))
+        stats = pstats.Stats(os.path.join(self.directory, 'dump.pstats'))
+        self.assertTrue(any(filename.endswith('dumpdata.py') for filename, _, _ in stats.stats))
+        with open(os.path.join(self.directory, 'dump.collapsed')) as f:
+            for line in f:
+                stack, count = line.rsplit(' ', 1)
+                self.assertGreater(int(count), 0)
+                self.assertIn(';', stack)
+        with open(os.path.join(self.directory, 'dump.allocations.txt')) as f:
+            self.assertTrue(f.readline().startswith('process peak memory: '))
+    
+    def test_agent_profiles_a_restore(self):
+        handler = DataHandler(origin=self.origin, webserver=self.webserver)
+        handler.cache_dumpdata()
+        handler.backup(destination='dest1')
+        remote_id = Backup.objects.get(destination='dest1').remote_id
+        
+        out = StringIO()
+        with mock.patch('client.management.commands.backup_agent.profile_directory',
+                        return_value=self.directory):
+            call_command('backup_agent', restore=remote_id, profile=True, stdout=out)
+        self.assertIn('Profiles written to %s' % self.directory, out.getvalue())
+        for phase in ('dump', 'store', 'upload', 'download', 'load'):
+            self.assertTrue(os.path.exists(os.path.join(self.directory, '%s.pstats' % phase)))
+
+
+class TablePaginationCase(TestCase):
+    
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        rule = RRule.objects.create(name=u'diário', description=u'uma vez por dia', frequency=RRule.DAILY)
+        self.schedule = Schedule.objects.create(destination='dest1', rule=rule,
+                                                initial_time=timezone.now())
+        self.date = timezone.now().replace(microsecond=0)
+    
+    def create_backups(self, sent, unsent=0):
+        for i in range(unsent):
+            Backup.objects.create(name='unsent%d' % i, destination='dest1', schedule=self.schedule)
+        for i in range(sent):
+            #pairs of backups share a date, so pages may split ties
+            Backup.objects.create(name='sent%d' % i, destination='dest1', schedule=self.schedule,
+                                  remote_backup_date=self.date - timedelta(hours=i // 2), remote_id=i)
+    
+    def walk(self, url):
+        names = []
+        cursor = None
+        while True:
+            response = self.client.get(url, {'after': cursor, 'start': len(names) + 1} if cursor else {})
+            self.assertEqual(response.status_code, 200)
+            self.assertContains(response, '<td class="row_number">%d</td>' % (len(names) + 1))
+            names.extend(row.record.pk for row in response.context['table'].rows)
+            cursor = response.context['next_cursor']
+            if cursor is None:
+                return names
+    
+    def test_pages_follow_the_index_without_gaps(self):
+        self.create_backups(sent=40, unsent=15)
+        expected = list(Backup.objects.filter(remote_backup_date__isnull=True).order_by('-pk')
+                                      .values_list('pk', flat=True)) + \
+                   list(Backup.objects.filter(remote_backup_date__isnull=False)
+                                      .order_by('-remote_backup_date', '-pk')
+                                      .values_list('pk', flat=True))
+        self.assertEqual(self.walk('/client/backups/'), expected)
+        self.assertEqual(len(self.walk('/client/schedules/')), 1)
+        #a bad cursor starts over
+        response = self.client.get('/client/backups/', {'after': 'nonsense'})
+        self.assertEqual([r.record.pk for r in response.context['table'].rows], expected[:25])
+    
+    def test_queries_dont_grow_with_history(self):
+        self.create_backups(sent=30)
+        with CaptureQueriesContext(connection) as small:
+            response = self.client.get('/client/backups/')
+        self.create_backups(sent=200, unsent=10)
+        with CaptureQueriesContext(connection) as large:
+            self.client.get('/client/backups/')
+        with CaptureQueriesContext(connection) as deep:
+            self.client.get('/client/backups/', {'after': response.context['next_cursor']})
+        self.assertEqual(len(small), len(large))
+        self.assertLessEqual(len(deep), len(small))
+        self.assertFalse(any('COUNT(' in q['sql'] or 'OFFSET' in q['sql'] for q in large.captured_queries))
+
+
+class BackupsAPICase(TestCase):
+    
+    def setUp(self):
+        cache.clear()
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.date = timezone.now().replace(microsecond=0)
+        for i in range(5):
+            Backup.objects.create(name='sent%d' % i, destination='dest%d' % (i % 2), remote_id=i,
+                                  remote_backup_date=self.date - timedelta(days=i))
+        Backup.objects.create(name='unsent', destination='dest0')
+        Backup.objects.create(name='failed', destination='dest0', last_error='Server down')
+    
+    def get(self, params=None, **headers):
+        headers.setdefault('HTTP_AUTHORIZATION', 'Token secret')
+        with mock.patch('client.views.BACKUPS_API_TOKEN', 'secret'):
+            return self.client.get('/client/api/backups/', params or {}, **headers)
+    
+    def names(self, params):
+        return [b['name'] for b in json.loads(self.get(params).content)['results']]
+    
+    def test_filters_and_pages(self):
+        self.assertEqual(self.names({'status': 'failed'}), ['failed'])
+        self.assertEqual(self.names({'status': 'unsent'}), ['unsent'])
+        self.assertEqual(self.names({'destination': 'dest1'}), ['sent1', 'sent3'])
+        self.assertEqual(self.names({'min_date': (self.date - timedelta(days=2)).isoformat(),
+                                     'max_date': self.date.isoformat()}), ['sent1', 'sent2'])
+        self.assertEqual(self.get({'status': 'lost'}).status_code, 400)
+        self.assertEqual(self.get({'min_date': 'yesterday'}).status_code, 400)
+        
+        names = []
+        response = self.get({'status': 'sent', 'limit': 2})
+        while True:
+            data = json.loads(response.content)
+            names.extend(b['name'] for b in data['results'])
+            if data['next'] is None:
+                break
+            response = self.get(dict(QueryDict(data['next'].split('?', 1)[1]).items()))
+        self.assertEqual(names, ['sent0', 'sent1', 'sent2', 'sent3', 'sent4'])
+    
+    def test_unchanged_pages_are_not_modified(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+            self.assertEqual(self.get().content, response.content)
+        self.assertEqual(len(queries), 0)
+        
+        backup = Backup.objects.get(name='unsent')
+        backup.remote_id = 99
+        backup.save()
+        changed = self.get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed['ETag'], etag)
+    
+    def test_changes_within_the_same_second_are_modified(self):
+        with mock.patch.object(listing.time, 'time', return_value=1400000000.5):
+            response = self.get()
+            backup = Backup.objects.get(name='unsent')
+            backup.remote_id = 99
+            backup.save()
+            changed = self.get(HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.content, response.content)
+    
+    def test_changes_reach_other_processes(self):
+        state = listing.state()
+        #as the agent or a celery worker, which share the cache backend
+        pid = os.fork()
+        if pid == 0:
+            try:
+                listing.invalidate()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertNotEqual(listing.state()['version'], state['version'])
+    
+    def test_requires_staff_or_token(self):
+        self.assertEqual(self.client.get('/client/api/backups/').status_code, 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Token wrong').status_code, 403)
+        self.client.login(username='admin', password='admin')
+        self.assertEqual(self.client.get('/client/api/backups/').status_code, 200)
+
+
+class JobsCase(StandInServerMixin, TestCase):
+    
+    def setUp(self):
+        self.start_standin(users=[{'id': 1, 'username': 'origin', 'password': 'secret'}])
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+    
+    def progress(self, response):
+        self.assertEqual(response.status_code, 202)
+        return json.loads(self.client.get(json.loads(response.content)['progress_url']).content)
+    
+    def test_manual_backup(self):
+        self.assertEqual(self.client.post('/client/backup/').status_code, 400)
+        job = self.progress(self.client.post('/client/backup/', {'destination': 'dest1'}))
+        backup = Backup.objects.get(destination='dest1')
+        self.assertEqual((job['kind'], job['state'], job['phase']), ('backup', 'done', None))
+        self.assertEqual(job['bytes_transferred'], backup.size)
+        self.assertIsNotNone(backup.remote_id)
+    
+    def test_restore_reports_downloaded_bytes_and_loaded_rows(self):
+        tasks.backup('dest1')
+        backup = Backup.objects.get(destination='dest1')
+        response = self.client.post('/client/restore/%d/' % backup.pk,
+                                    {'username': 'origin', 'password': 'secret'},
+                                    HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        job = self.progress(response)
+        self.assertEqual((job['kind'], job['state'], job['backup']), ('restore', 'done', backup.pk))
+        self.assertEqual(job['bytes_transferred'], job['bytes_total'])
+        self.assertGreater(job['rows_loaded'], 0)
+        #polling needs no session, which the restore flushed
+        self.client.logout()
+        self.assertEqual(self.client.get('/client/jobs/%s/' % job['id']).status_code, 200)
+        self.assertEqual(self.client.get('/client/jobs/%s/' % ('0' * 32)).status_code, 404)
+    
+    def test_progress_is_throttled_and_failures_recorded(self):
+        job = Job.create('backup')
+        with mock.patch('client.jobs.JOBS_PROGRESS_INTERVAL', 60):
+            with self.assertRaises(ValueError):
+                with job:
+                    job.update(phase='dump', bytes_transferred=10)
+                    job.update(bytes_transferred=20)
+                    self.assertEqual(Job.get(job.id).bytes_transferred, 10)
+                    raise ValueError('disk full')
+        saved = Job.get(job.id)
+        self.assertEqual((saved.state, saved.bytes_transferred, saved.error),
+                         ('failed', 20, 'ValueError: disk full'))
+    
+    def test_old_jobs_and_leftovers_are_deleted(self):
+        old, current = Job.create('backup'), Job.create('backup')
+        leftover, writing = os.path.join(Job.directory(), 'a.tmp'), os.path.join(Job.directory(), 'b.tmp')
+        for path in (leftover, writing):
+            open(path, 'w').close()
+        os.utime(Job.path(old.id), (time.time() - 8 * 24 * 60 * 60,) * 2)
+        os.utime(leftover, (time.time() - 2 * 60 * 60,) * 2)
+        Job.delete_old(days=7)
+        self.assertEqual([os.path.exists(path) for path in (Job.path(old.id), Job.path(current.id),
+                                                            leftover, writing)],
+                         [False, True, False, True])
+        
+        #files another process renames or deletes meanwhile are skipped
+        with mock.patch('os.path.getmtime', side_effect=OSError(errno.ENOENT, 'No such file or directory')):
+            Job.delete_old(days=7)
+
+
+class MetricsCase(TestCase):
+    
+    def setUp(self):
+        metrics.reset()
+        health.invalidate()
+    
+    def tearDown(self):
+        health.join()
+        health.invalidate()
+    
+    def get(self, **headers):
+        with mock.patch('client.views.BACKUPS_API_TOKEN', 'secret'):
+            return self.client.get('/client/metrics/', **headers)
+    
+    def scrape(self):
+        response = self.get(HTTP_AUTHORIZATION='Token secret')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return dict(line.rsplit(' ', 1) for line in response.content.splitlines()
+                    if not line.startswith('#'))
+    
+    def test_phases_gauges_and_probes(self):
+        now = timezone.now()
+        #logged by any process, before this one started too
+        OpLog.objects.create(phase=OpLog.DUMP, started_at=now - timedelta(days=1), wall_time=1, bytes_out=10)
+        OpLog.objects.create(phase=OpLog.DUMP, started_at=now, wall_time=2, cpu_time=1.5, bytes_out=1000)
+        OpLog.objects.create(phase=OpLog.UPLOAD, started_at=now, wall_time=0.5, bytes_out=100000)
+        Backup.objects.create(name='unsent', destination='dest1', file='unsent.gz')
+        Backup.objects.create(name='sent', destination='dest1', file='sent.gz', remote_id=1)
+        rule = RRule.objects.create(name=u'diário', description=u'uma vez por dia', frequency=RRule.DAILY)
+        schedule = Schedule.objects.create(initial_time=now + timedelta(hours=1), rule=rule)
+        Schedule.objects.filter(pk=schedule.pk).update(next_run_at=now - timedelta(minutes=10))
+        with StandInServer() as server:
+            health.probe(WebServer.objects.create(name='standin', url=server.url, api_root='/'), timeout=1)
+        health.probe(WebServer.objects.create(name='nowhere', url='http://127.0.0.1:1', api_root='/'),
+                     timeout=1)
+        
+        samples = self.scrape()
+        self.assertEqual(samples['tbackup_phase_duration_seconds_count{phase="dump"}'], '2')
+        self.assertEqual(samples['tbackup_phase_duration_seconds_bucket{phase="dump",le="1"}'], '1')
+        self.assertEqual(samples['tbackup_phase_duration_seconds_bucket{phase="dump",le="5"}'], '2')
+        self.assertEqual(samples['tbackup_phase_cpu_seconds_total{phase="dump"}'], '1.5')
+        self.assertEqual(samples['tbackup_phase_bytes_total{phase="dump"}'], '1010')
+        self.assertEqual(samples['tbackup_phase_bytes_total{phase="upload"}'], '100000')
+        self.assertEqual(samples['tbackup_upload_throughput_bytes_per_second_sum'], '200000')
+        self.assertEqual(samples['tbackup_unsent_backups'], '1')
+        self.assertGreaterEqual(float(samples['tbackup_schedule_lag_seconds']), 600)
+        self.assertIn('tbackup_webserver_probe_latency_seconds{webserver="standin"}', samples)
+        self.assertNotIn('tbackup_webserver_probe_latency_seconds{webserver="nowhere"}', samples)
+        self.assertEqual(samples['tbackup_webserver_up{webserver="standin"}'], '1')
+        self.assertEqual(samples['tbackup_webserver_up{webserver="nowhere"}'], '0')
+    
+    def test_restarts_and_compaction_keep_the_values(self):
+        now = timezone.now()
+        for days in (100, 100, 0):
+            OpLog.objects.create(phase=OpLog.DUMP, started_at=now - timedelta(days=days),
+                                 wall_time=days + 0.5, cpu_time=1, bytes_out=10)
+            OpLog.objects.create(phase=OpLog.UPLOAD, started_at=now - timedelta(days=days),
+                                 wall_time=2, bytes_out=1000 * (days + 1))
+        OpLog.objects.create(phase=OpLog.UPLOAD, started_at=now - timedelta(days=100), wall_time=1,
+                             outcome=OpLog.ERROR, error_class='HttpServerError')
+        samples = self.scrape()
+        self.assertEqual(samples['tbackup_phase_errors_total{phase="upload",error_class="HttpServerError"}'], '1')
+        
+        #as another process, or this one restarted, would see them after a compaction
+        metrics.reset()
+        self.assertEqual(compact_oplog(days=90), 5)
+        self.assertEqual(self.scrape(), samples)
+    
+    def test_scrapes_reuse_the_values_for_a_while(self):
+        self.scrape()
+        OpLog.objects.create(phase=OpLog.STORE, started_at=timezone.now(), wall_time=1, bytes_out=10)
+        with CaptureQueriesContext(connection) as queries:
+            samples = self.scrape()
+        #reused until METRICS_TTL runs out
+        self.assertEqual(len(queries), 0)
+        self.assertNotIn('tbackup_phase_bytes_total{phase="store"}', samples)
+        with mock.patch.object(metrics, 'METRICS_TTL', 0):
+            self.assertEqual(self.scrape()['tbackup_phase_bytes_total{phase="store"}'], '10')
+    
+    def test_phases_are_added_up_by_the_database(self):
+        def phase_queries():
+            with mock.patch.object(metrics, 'METRICS_TTL', 0):
+                with CaptureQueriesContext(connection) as queries:
+                    samples = self.scrape()
+            return samples, [q['sql'] for q in queries.captured_queries
+                             if 'client_oplog' in q['sql'] and 'SUM(' not in q['sql'].upper()]
+        
+        old = timezone.now() - timedelta(days=100)
+        for i in range(20):
+            OpLog.objects.create(phase=OpLog.UPLOAD, started_at=old if i % 2 else timezone.now(),
+                                 wall_time=i + 1, bytes_out=1000 * i)
+        self.scrape()
+        #rows are neither fetched nor the rollups read again until a compaction
+        samples, fetched = phase_queries()
+        self.assertEqual(fetched, [])
+        self.assertEqual(samples['tbackup_phase_duration_seconds_bucket{phase="upload",le="10"}'], '10')
+        self.assertEqual(samples['tbackup_upload_throughput_bytes_per_second_count'], '20')
+        
+        self.assertEqual(compact_oplog(days=90), 10)
+        compacted, fetched = phase_queries()
+        self.assertEqual(len(fetched), 1)
+        self.assertIn('client_oplogrollup', fetched[0])
+        #the throughputs are added up in another order
+        key = 'tbackup_upload_throughput_bytes_per_second_sum'
+        self.assertAlmostEqual(float(compacted.pop(key)), float(samples.pop(key)))
+        self.assertEqual(compacted, samples)
+    
+    def test_staff_or_token_only(self):
+        self.assertEqual(self.get().status_code, 403)
+        self.assertEqual(self.get(HTTP_AUTHORIZATION='Token wrong').status_code, 403)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        self.assertEqual(self.get().status_code, 200)
+
+
+class BenchmarkCase(TestCase):
+    
+    def test_generated_data_follows_the_parameters(self):
+        self.assertEqual(benchmark.generate(rows=45, width=50, fanout=4),
+                         {'rules': 3, 'schedules': 12, 'backups': 45})
+        self.assertEqual(Backup.objects.filter(schedule__destination='bench-11').count(), 1)
+        self.assertEqual(Schedule.objects.filter(rule__name='bench rule 0').count(), 4)
+        self.assertEqual(len(Backup.objects.get(name='bench backup 0').last_error), 50)
     
+    def test_results_are_json(self):
+        results = json.loads(json.dumps(benchmark.run(rows=20, width=10, fanout=5, repeat=2)))
+        self.assertEqual(sorted(results['results']), ['backup', 'dump', 'encrypted_backup',
+                                                      'encrypted_restore', 'restore'])
+        self.assertIn('throughput_cost', results['results']['encrypted_backup'])
+        for operation in results['results'].values():
+            self.assertEqual(len(operation['samples']), 2)
+            self.assertGreater(operation['throughput_p50'], 0)
+            self.assertGreaterEqual(operation['peak_memory_growth'], 0)
+        self.assertGreater(results['peak_memory'], 0)
+        self.assertEqual(results['parameters']['rows'], 20)
+        #backups are measured by the bytes dumped, as dumps are, not by their archives
+        dumped = results['results']['dump']['samples'][0]['bytes']
+        for name in ('backup', 'encrypted_backup'):
+            self.assertGreater(results['results'][name]['samples'][0]['bytes'], dumped * 0.9)
+        #restored data includes the synthetic rows
+        self.assertEqual(Backup.objects.filter(name__startswith='bench backup').count(), 20)
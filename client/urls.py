@@ -5,6 +5,10 @@ from .views import ConfirmRestoreView
 urlpatterns = patterns('client.views' ,
     url(r'^backups/$', 'backups', name='backups'),
     url(r'^schedules/$', 'schedules', name='schedules'),
+    url(r'^metrics/$', 'metrics', name='metrics'),
+    url(r'^api/backups/$', 'backups_json', name='backups_json'),
+    url(r'^backup/$', 'start_backup', name='start_backup'),
+    url(r'^jobs/(?P<id>[0-9a-f]{32})/$', 'job', name='job'),
     url(r'^schedule_change/(?P<id>[0-9]+)/?$', 'schedule_change', name='schedule_change'),
     url(r'^restore/(?P<pk>[0-9]+)/?$', ConfirmRestoreView.as_view(), name='restore'),
 )
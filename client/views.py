@@ -1,37 +1,203 @@
 # -*- coding: utf-8 -*-
 
+import json
+import urllib
+
+from datetime import datetime
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
 from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition, require_GET, require_POST
 from django.contrib.admin.views.decorators import staff_member_required
 from django.views.generic import FormView
+from django.core.urlresolvers import reverse
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, Http404
 from django.shortcuts import render, get_object_or_404
-from .models import Backup
-from .models.location import Origin, WebServer
+from .models import Backup, Schedule
 
 from django_tables2 import RequestConfig
 
-from .handlers import DataHandler
+from .conf.settings import BACKUPS_API_MAX_LIMIT, BACKUPS_API_TOKEN
+from .pagination import KeysetPage
 from .tables import BackupTable, ScheduleTable
 from .forms import ConfirmRestoreForm
+from .jobs import Job, BACKUP, RESTORE
+from . import listing, tasks, metrics as client_metrics
 
 from django.contrib import messages
 from django.shortcuts import redirect
 
 # Create your views here.
 
-def render_table(request, table_class):
+def render_table(request, table_class, queryset, field, descending=True):
+    '''
+        Renders a page of queryset, ordered by the indexed field,
+        starting after the cursor in the request's "after" parameter
+    '''
     table_class._meta.attrs = {'class': 'paleblue'}
     model = table_class._meta.model
-    table = table_class(model.objects.all())
+    page = KeysetPage(queryset, field, request.GET.get('after'), descending=descending)
+    try:
+        start = max(int(request.GET.get('start', 1)), 1) if page.after else 1
+    except ValueError:
+        start = 1
+    table = table_class(page.object_list, start=start)
     pagename = model._meta.verbose_name_plural.capitalize()
-    RequestConfig(request).configure(table)
-    return render(request, 'table.html', {'table': table, 'pagename': pagename})
+    RequestConfig(request, paginate=False).configure(table)
+    return render(request, 'table.html', {'table': table,
+                                          'pagename': pagename,
+                                          'next_cursor': page.next_cursor,
+                                          'next_start': start + len(page),
+                                          'is_first_page': page.after is None})
 
 @staff_member_required
 def backups(request):
-    return render_table(request, BackupTable)
+    queryset = Backup.objects.select_related('schedule__rule').prefetch_related('phases')
+    return render_table(request, BackupTable, queryset, 'remote_backup_date')
+
+#filters of the JSON listing of backups
+BACKUP_STATUSES = {
+    'sent'  : Q(remote_id__isnull=False),
+    'unsent': Q(remote_id__isnull=True) & (Q(last_error__isnull=True) | Q(last_error='')),
+    'failed': Q(remote_id__isnull=True) & Q(last_error__gt=''),
+}
+API_PARAMS = ('min_date', 'max_date', 'destination', 'status', 'after', 'limit')
+
+def encode_params(params):
+    return urllib.urlencode(sorted((k, unicode(v).encode('utf-8')) for k, v in params.items()))
+
+def backup_status(backup):
+    if backup.remote_id is not None:
+        return 'sent'
+    return 'failed' if backup.last_error else 'unsent'
+
+def parse_date(value):
+    dt = parse_datetime(value)
+    if dt is None:
+        raise ValueError(u'Invalid date: %s' % value)
+    return dt if timezone.is_aware(dt) else timezone.make_aware(dt, timezone.get_current_timezone())
+
+def filter_backups(params):
+    '''
+        Returns the backups matching the listing's params,
+        raising ValueError if any is invalid
+    '''
+    queryset = Backup.objects.all()
+    if params.get('min_date'):
+        queryset = queryset.filter(remote_backup_date__gte=parse_date(params['min_date']))
+    if params.get('max_date'):
+        queryset = queryset.filter(remote_backup_date__lt=parse_date(params['max_date']))
+    if params.get('destination'):
+        queryset = queryset.filter(destination=params['destination'])
+    if params.get('status'):
+        if params['status'] not in BACKUP_STATUSES:
+            raise ValueError(u'status must be one of %s' % u', '.join(sorted(BACKUP_STATUSES)))
+        queryset = queryset.filter(BACKUP_STATUSES[params['status']])
+    return queryset
+
+def list_backups(request, queryset, params):
+    page = KeysetPage(queryset, 'remote_backup_date', params.get('after'), size=params['limit'])
+    next_url = None
+    if page.next_cursor:
+        next_params = dict(params, after=page.next_cursor)
+        next_url = request.build_absolute_uri('?' + encode_params(next_params))
+    return {
+        'results': [{
+            'id': b.pk,
+            'name': b.name,
+            'destination': b.destination,
+            'schedule': b.schedule_id,
+            'status': backup_status(b),
+            'remote_id': b.remote_id,
+            'remote_backup_date': b.remote_backup_date.isoformat() if b.remote_backup_date else None,
+            'size': b.size,
+            'raw_size': b.raw_size,
+            'dump_seconds': b.dump_seconds,
+            'last_error': b.last_error,
+        } for b in page],
+        'next': next_url,
+    }
+
+def api_allowed(request):
+    kind, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    if BACKUPS_API_TOKEN and kind == 'Token':
+        return constant_time_compare(token, BACKUPS_API_TOKEN)
+    return request.user.is_active and request.user.is_staff
+
+@condition(etag_func=lambda request, page: page['etag'],
+           last_modified_func=lambda request, page: datetime.utcfromtimestamp(page['modified']))
+def cached_page(request, page):
+    return HttpResponse(page['body'], content_type='application/json')
+
+@require_GET
+def backups_json(request):
+    '''
+        Read-only JSON listing of backups, filtered by min_date, max_date,
+        destination and status and paged by cursor. Pages are cached until
+        a backup changes, and answered with 304 to conditional requests for
+        a page that didn't change, without touching the database
+    '''
+    if not api_allowed(request):
+        return HttpResponseForbidden(json.dumps({'detail': 'Forbidden'}), content_type='application/json')
+    params = dict((k, request.GET[k]) for k in API_PARAMS if request.GET.get(k))
+    try:
+        params['limit'] = min(max(int(params.get('limit', BACKUPS_API_MAX_LIMIT)), 1), BACKUPS_API_MAX_LIMIT)
+        queryset = filter_backups(params)
+    except ValueError as e:
+        return HttpResponseBadRequest(json.dumps({'detail': unicode(e)}), content_type='application/json')
+    
+    query = encode_params(params)
+    page = listing.get_page(query, lambda: json.dumps(list_backups(request, queryset, params)))
+    return cached_page(request, page)
 
 def schedules(request):
-    return render_table(request, ScheduleTable)
+    queryset = Schedule.objects.select_related('rule')
+    return render_table(request, ScheduleTable, queryset, 'initial_time', descending=False)
+
+@require_GET
+def metrics(request):
+    '''
+        Metrics in the Prometheus text format, for staff or the
+        BACKUPS_API_TOKEN, as the backups listing
+    '''
+    if not api_allowed(request):
+        return HttpResponseForbidden('Forbidden', content_type='text/plain')
+    return HttpResponse(client_metrics.render(), content_type=client_metrics.CONTENT_TYPE)
+
+def job_started(job):
+    return HttpResponse(json.dumps({'job': job.id,
+                                    'progress_url': reverse('client:job', args=[job.id])}),
+                        content_type='application/json', status=202)
+
+@require_GET
+def job(request, id):
+    '''
+        Progress of a background backup or restore. The id, random and only
+        known to whoever started the job, grants access: restores flush the
+        database, sessions included, while they're polled
+    '''
+    job = Job.get(id)
+    if job is None:
+        raise Http404
+    return HttpResponse(json.dumps(job.as_dict()), content_type='application/json')
+
+@staff_member_required
+@require_POST
+def start_backup(request):
+    '''
+        Starts a backup to the posted destination in a worker
+        and returns the id of its job
+    '''
+    destination = request.POST.get('destination')
+    if not destination:
+        return HttpResponseBadRequest(json.dumps({'detail': 'destination is required'}),
+                                      content_type='application/json')
+    job = Job.create(BACKUP)
+    tasks.backup.delay(destination, job.id)
+    return job_started(job)
 
 def schedule_change(request, id):
     return redirect('admin:client_schedule_change', id)
@@ -53,7 +219,9 @@ class ConfirmRestoreView(FormView):
         form = ConfirmRestoreForm(request.POST)
         if form.is_valid():
             result = self.form_valid(form)
-            messages.add_message(request, messages.SUCCESS, u'Dados restaurados com sucesso')
+            if not request.is_ajax():
+                messages.add_message(request, messages.SUCCESS,
+                                     u'Restauração iniciada. Progresso em %s' % reverse('client:job', args=[self.job.id]))
         else:
             result = self.form_invalid(form)
             messages.add_message(request, messages.ERROR, u'Erro na restauração de dados. Favor Contactar os administratores.')
@@ -67,17 +235,12 @@ class ConfirmRestoreView(FormView):
     
     def form_valid(self, form):
         
-        handler = DataHandler(origin=Origin.instance(),webserver=WebServer.instance())
-        
-        #before restoring, run a backup without schedule
-        handler.cache_dumpdata()
-        #same destination as the restored one
-        ok = handler.backup(destination=self.backup.destination)
-        
-        if ok:
-            #id to restore
-            handler.restore(self.backup.remote_id)
-            
+        #the backup made before restoring, the download and the load run in
+        #a worker, so they go on after the request (or the browser) is gone
+        self.job = Job.create(RESTORE, self.backup.pk)
+        tasks.restore.delay(self.backup.pk, self.job.id)
         
+        if self.request.is_ajax():
+            return job_started(self.job)
         return super(ConfirmRestoreView, self).form_valid(form)
     
\ No newline at end of file
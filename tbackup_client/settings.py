@@ -13,6 +13,7 @@ import os
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 
 from settings_dev import (
+    BROKER_URL,
     DATABASES,
     DEBUG,
     R_SIGNATURE_KEY,
@@ -113,3 +114,46 @@ STATIC_URL = '/static/'
 #WEBSERVER_API_VERSION = 'v1'
 
 TBACKUP_DUMP_DIR = os.path.join(BASE_DIR, 'backup_dumps')
+
+# local copies of backups (Backup.file) are kept here
+MEDIA_ROOT = TBACKUP_DUMP_DIR
+
+# Cache
+# https://docs.djangoproject.com/en/1.6/topics/cache/
+
+# shared by the web, agent and celery processes, so the backups listing and
+# remote destinations they change are seen by all of them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(TBACKUP_DUMP_DIR, '.cache'),
+    }
+}
+
+
+# Celery
+# http://docs.celeryproject.org/en/3.1/django/first-steps-with-django.html
+
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+CELERY_TIMEZONE = TIME_ZONE
+
+# dumps are CPU bound and uploads are network bound,
+# so each gets its own queue and workers scale independently
+CELERY_ROUTES = {
+    'client.tasks.dump'   : {'queue': 'dumps'},
+    'client.tasks.backup' : {'queue': 'dumps'},
+    'client.tasks.restore': {'queue': 'dumps'},
+    'client.tasks.prune'  : {'queue': 'dumps'},
+    'client.tasks.compact': {'queue': 'dumps'},
+    'client.tasks.upload' : {'queue': 'uploads'},
+    'client.tasks.sync'   : {'queue': 'uploads'},
+}
+
+# one beat entry per active Schedule
+CELERYBEAT_SCHEDULER = 'client.beat:ScheduleBeat'
+
+# tests run tasks in process, without a broker, and write archives
+# to a temporary directory
+TEST_RUNNER = 'tbackup_client.test_runner.TestRunner'
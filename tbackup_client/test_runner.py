@@ -0,0 +1,44 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs Celery tasks eagerly, so tests need no broker, and points the
+    archive storage and a file-based cache at a temporary directory,
+    removed after the run
+    """
+    def setup_test_environment(self, **kwargs):
+        super(TestRunner, self).setup_test_environment(**kwargs)
+        from django.core.cache import cache
+        from client.storage import archive_storage
+        from .celery import app
+
+        app.conf.update(CELERY_ALWAYS_EAGER=True,
+                        CELERY_EAGER_PROPAGATES_EXCEPTIONS=True)
+        self.saved_media_root = settings.MEDIA_ROOT, archive_storage.base_location
+        self.media_root = tempfile.mkdtemp(prefix='tbackup_client_tests')
+        settings.MEDIA_ROOT = self.media_root
+        archive_storage.base_location = archive_storage.location = self.media_root
+        #the cache was made from the settings already, so its directory is moved
+        if isinstance(cache, FileBasedCache):
+            self.saved_cache_dir = cache._dir
+            cache._dir = os.path.join(self.media_root, '.cache')
+
+    def teardown_test_environment(self, **kwargs):
+        from django.core.cache import cache
+        from client.storage import archive_storage
+
+        settings.MEDIA_ROOT, archive_storage.base_location = self.saved_media_root
+        archive_storage.location = os.path.abspath(archive_storage.base_location)
+        if isinstance(cache, FileBasedCache):
+            cache._dir = self.saved_cache_dir
+        shutil.rmtree(self.media_root, ignore_errors=True)
+        super(TestRunner, self).teardown_test_environment(**kwargs)